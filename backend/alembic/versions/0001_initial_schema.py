@@ -0,0 +1,83 @@
+"""Initial schema: sessions, nodes, edges, session archives and shard instances
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'sessions',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('title', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True)),
+    )
+    op.create_index('ix_sessions_id', 'sessions', ['id'])
+
+    op.create_table(
+        'nodes',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('session_id', sa.Integer(), sa.ForeignKey('sessions.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('content', sa.Text()),
+        sa.Column('x', sa.Integer()),
+        sa.Column('y', sa.Integer()),
+        sa.Column('width', sa.Integer()),
+        sa.Column('height', sa.Integer()),
+        sa.Column('style', sa.JSON()),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True)),
+    )
+    op.create_index('ix_nodes_id', 'nodes', ['id'])
+    op.create_index('ix_nodes_session_id', 'nodes', ['session_id'])
+
+    op.create_table(
+        'edges',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('session_id', sa.Integer(), sa.ForeignKey('sessions.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('source_id', sa.Integer(), sa.ForeignKey('nodes.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('target_id', sa.Integer(), sa.ForeignKey('nodes.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index('ix_edges_id', 'edges', ['id'])
+    op.create_index('ix_edges_session_id', 'edges', ['session_id'])
+
+    op.create_table(
+        'session_archives',
+        sa.Column('session_id', sa.Integer(), sa.ForeignKey('sessions.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('payload', sa.LargeBinary(), nullable=False),
+        sa.Column('node_count', sa.Integer(), nullable=False),
+        sa.Column('edge_count', sa.Integer(), nullable=False),
+        sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+
+    op.create_table(
+        'shard_instances',
+        sa.Column('instance_id', sa.String(), primary_key=True),
+        sa.Column('url', sa.String(), nullable=False),
+        sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index('ix_shard_instances_heartbeat_at', 'shard_instances', ['heartbeat_at'])
+
+
+def downgrade():
+    op.drop_index('ix_shard_instances_heartbeat_at', table_name='shard_instances')
+    op.drop_table('shard_instances')
+    op.drop_table('session_archives')
+    op.drop_index('ix_edges_session_id', table_name='edges')
+    op.drop_index('ix_edges_id', table_name='edges')
+    op.drop_table('edges')
+    op.drop_index('ix_nodes_session_id', table_name='nodes')
+    op.drop_index('ix_nodes_id', table_name='nodes')
+    op.drop_table('nodes')
+    op.drop_index('ix_sessions_id', table_name='sessions')
+    op.drop_table('sessions')
@@ -0,0 +1,152 @@
+"""
+Archival tier for cold sessions.
+
+A batched background job moves the nodes and edges of sessions untouched for
+ARCHIVE_AFTER_DAYS into one compressed `session_archives` row each, keeping
+the hot tables (and their `session_id` indexes) small. Archived sessions are
+rehydrated transparently the next time they are joined or fetched.
+
+Archiving and restoring both run through the session's mutation queue, so they
+never interleave with live mutations of the same board.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict
+
+import crud
+
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "0"))  # 0 disables the job
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "50"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+ARCHIVE_KNOWN_MAX = int(os.getenv("ARCHIVE_KNOWN_MAX", "10000"))  # sessions remembered as not archived
+
+
+class SessionArchiver:
+    """Moves cold sessions into the archive table and restores them on demand"""
+
+    def __init__(
+        self,
+        session_factory,
+        mutations,
+        is_active: Callable[[int], bool],
+        after_days: float = ARCHIVE_AFTER_DAYS,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+        known_max: int = ARCHIVE_KNOWN_MAX,
+    ):
+        self.session_factory = session_factory
+        self.mutations = mutations
+        self.is_active = is_active
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self.known_max = known_max
+        # Sessions checked since they were last archived (LRU); restoring them is a no-op
+        self._unarchived: "OrderedDict[int, None]" = OrderedDict()
+        self.counters = {
+            'runs': 0, 'archived_sessions': 0, 'archived_nodes': 0, 'archived_edges': 0,
+            'archived_bytes': 0, 'restored_sessions': 0, 'restore_skips': 0, 'errors': 0,
+        }
+        self.progress = {'running': False, 'batch': 0, 'processed': 0, 'last_run_seconds': None}
+
+    async def restore(self, session_id: int) -> bool:
+        """Rehydrate `session_id` if it is archived; free if it is known not to be"""
+        if session_id in self._unarchived:
+            self._unarchived.move_to_end(session_id)
+            self.counters['restore_skips'] += 1
+            return False
+
+        async def remember(restored):
+            self._remember_unarchived(session_id)
+
+        restored = await self.mutations.submit(
+            session_id, lambda db: crud.restore_session(db, session_id, commit=False), remember,
+        )
+        if restored:
+            self.counters['restored_sessions'] += 1
+            print(f'✅ Restored archived session {session_id}')
+        return restored
+
+    def _remember_unarchived(self, session_id: int) -> None:
+        self._unarchived[session_id] = None
+        self._unarchived.move_to_end(session_id)
+        while len(self._unarchived) > self.known_max:
+            self._unarchived.popitem(last=False)
+
+    def forget_unarchived(self) -> None:
+        """
+        Drop what `restore` remembers. Only a session's owner archives it, so
+        call this when ownership moves: another instance may archive a session
+        while it is away.
+        """
+        self._unarchived.clear()
+
+    async def archive(self, session_id: int) -> bool:
+        async def apply(db):
+            # Re-check under the session's queue: someone may have joined meanwhile
+            if self.is_active(session_id):
+                return None
+            return await crud.archive_session(db, session_id, commit=False)
+
+        async def forget(archive):
+            # In commit order, so a restore queued earlier cannot re-add it
+            if archive is not None:
+                self._unarchived.pop(session_id, None)
+
+        archive = await self.mutations.submit(session_id, apply, forget)
+        if archive is None:
+            return False
+        self.counters['archived_sessions'] += 1
+        self.counters['archived_nodes'] += archive.node_count
+        self.counters['archived_edges'] += archive.edge_count
+        self.counters['archived_bytes'] += len(archive.payload)
+        return True
+
+    async def run_once(self) -> int:
+        """Archive cold sessions in batches until none are left; returns the count"""
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.after_days)
+        started = time.monotonic()
+        archived = 0
+        skipped = set()
+        self.counters['runs'] += 1
+        self.progress.update(running=True, batch=0, processed=0)
+        try:
+            while True:
+                async with self.session_factory() as db:
+                    candidates = await crud.find_cold_sessions(db, cutoff, self.batch_size + len(skipped))
+                batch = [session_id for session_id in candidates if session_id not in skipped]
+                if not batch:
+                    break
+                self.progress['batch'] += 1
+                for session_id in batch:
+                    try:
+                        if await self.archive(session_id):
+                            archived += 1
+                        else:
+                            skipped.add(session_id)
+                    except Exception as e:
+                        skipped.add(session_id)
+                        self.counters['errors'] += 1
+                        print(f'❌ Error archiving session {session_id}: {e}')
+                    self.progress['processed'] += 1
+                # Let live traffic through between batches
+                await asyncio.sleep(0)
+        finally:
+            self.progress.update(running=False, last_run_seconds=round(time.monotonic() - started, 3))
+        if archived:
+            print(f'✅ Archived {archived} cold sessions')
+        return archived
+
+    async def run(self, interval: float = ARCHIVE_INTERVAL) -> None:
+        """Archive forever; meant to run as a background task"""
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.counters['errors'] += 1
+                print(f'❌ Error in archive job: {e}')
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'after_days': self.after_days, 'known_unarchived': len(self._unarchived), **self.counters, **self.progress}
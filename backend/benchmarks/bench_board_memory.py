@@ -0,0 +1,88 @@
+"""
+Memory benchmark: current ORM + Pydantic session state vs CompactBoard.
+
+Builds the same synthetic board both ways and reports the traced allocation
+per node. Usage:
+
+    python benchmarks/bench_board_memory.py [--nodes 100000]
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import models
+import schemas
+from compact_board import CompactBoard
+
+STYLES = [{}, {'color': '#f87171'}, {'color': '#60a5fa', 'shape': 'round'}]
+
+
+def node_rows(count, now):
+    for i in range(1, count + 1):
+        yield (i, f'Idea {i}', (i % 400) * 220, (i // 400) * 120, 200, 100, STYLES[i % 3], now, now)
+
+
+def edge_rows(count, now):
+    for i in range(2, count + 1):
+        yield (i - 1, i // 2, i, now)
+
+
+def current_path(count, now):
+    """What crud.get_session_state materializes today"""
+    nodes = [
+        models.Node(id=i, session_id=1, content=c, x=x, y=y, width=w, height=h,
+                    style=s, created_at=ca, updated_at=ua)
+        for i, c, x, y, w, h, s, ca, ua in node_rows(count, now)
+    ]
+    edges = [
+        models.Edge(id=i, session_id=1, source_id=s, target_id=t, created_at=ca)
+        for i, s, t, ca in edge_rows(count, now)
+    ]
+    state = schemas.SessionState(
+        nodes=[schemas.Node.model_validate(n) for n in nodes],
+        edges=[schemas.Edge.model_validate(e) for e in edges],
+    )
+    return nodes, edges, state
+
+
+def compact_path(count, now):
+    return CompactBoard.from_rows(1, node_rows(count, now), edge_rows(count, now))
+
+
+def measure(label, build, count, now):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build(count, now)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label:<12} {current / 1e6:9.1f} MB resident  {peak / 1e6:9.1f} MB peak  '
+          f'{current / count:7.0f} B/node  {elapsed:6.2f} s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--nodes', type=int, default=100_000)
+    args = parser.parse_args()
+
+    now = datetime.now(timezone.utc)
+    print(f'Board with {args.nodes} nodes and {args.nodes - 1} edges')
+    current = measure('orm+pydantic', current_path, args.nodes, now)
+    del current
+    board = measure('compact', compact_path, args.nodes, now)
+
+    started = time.perf_counter()
+    board.to_wire()
+    print(f'compact to_wire: {time.perf_counter() - started:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Import-time profile of the backend (python -X importtime).
+
+Runs a fresh interpreter that imports `main`, parses the importtime report
+and prints the total plus the slowest modules by cumulative time. Usage:
+
+    python benchmarks/bench_import_time.py [--module main] [--top 25] [--runs 5] [--save profile.txt]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def profile(module):
+    """Return [(self_us, cumulative_us, name)] for one cold import of `module`"""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        sys.exit(proc.stderr)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return rows, proc.stderr
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--module', default='main')
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--save', help='write the raw importtime report of the last run here')
+    args = parser.parse_args()
+
+    totals = []
+    for _ in range(args.runs):
+        rows, raw = profile(args.module)
+        # The top-level import is the last entry with no indentation
+        totals.append(next(c for s, c, name in reversed(rows) if name.strip() == args.module))
+
+    print(f'import {args.module}: median {statistics.median(totals) / 1000:.1f} ms '
+          f'(min {min(totals) / 1000:.1f} ms over {args.runs} runs)')
+    print(f'{"cumulative ms":>14} {"self ms":>9}  module')
+    for self_us, cumulative_us, name in sorted(rows, key=lambda r: r[1], reverse=True)[:args.top]:
+        print(f'{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {name}')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            f.write(raw)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Storage benchmark: the app's write and read paths against any backend.
+
+Creates a session in the given database, inserts nodes and updates them
+through the mutation queue (as the socket handlers do), then loads the board
+and streams it back. The session is deleted afterwards. Usage:
+
+    python benchmarks/bench_storage.py [--database-url sqlite:///./bench.db] [--nodes 5000] [--concurrency 64]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+async def run(nodes, concurrency, updates):
+    import crud
+    import database
+    import models  # noqa: F401  (registers the tables)
+    import schemas
+    from mutation_queue import MutationQueue
+
+    await database.ensure_schema('create_all')
+    print(f'Backend {database.get_storage().name}: {database.get_database_url()}')
+
+    async with database.AsyncSessionLocal() as db:
+        session = await crud.create_session(db, 'storage benchmark')
+    mutations = MutationQueue(database.AsyncSessionLocal)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def submit(apply):
+        async with semaphore:
+            return await mutations.submit(session.id, apply)
+
+    def create(i):
+        data = schemas.NodeCreate(content=f'Idea {i}', x=(i % 100) * 220, y=(i // 100) * 120)
+        return lambda db: crud.create_node(db, session.id, data, commit=False)
+
+    def move(node_id):
+        patch = {'x': random.randint(0, 20000), 'y': random.randint(0, 20000)}
+        return lambda db: crud.update_node_partial(db, node_id, patch, commit=False)
+
+    async def timed(label, count, work):
+        started = time.perf_counter()
+        result = await work
+        elapsed = time.perf_counter() - started
+        rate = f'{count / elapsed:10.0f} ops/s' if count else ''
+        print(f'{label:<10} {elapsed:8.3f} s {rate}')
+        return result
+
+    try:
+        created = await timed('insert', nodes, asyncio.gather(*(submit(create(i)) for i in range(nodes))))
+        node_ids = [node.id for node in created]
+        await timed('update', updates, asyncio.gather(*(submit(move(random.choice(node_ids))) for _ in range(updates))))
+        print(f'transactions: {mutations.stats()["transactions"]} for {mutations.stats()["submitted"]} mutations')
+
+        async def load():
+            async with database.AsyncSessionLocal() as db:
+                return await crud.load_compact_board(db, session.id)
+
+        async def stream():
+            async with database.AsyncSessionLocal() as db:
+                return [chunk async for chunk in crud.stream_session_state(db, session.id, (0, 0), 500)]
+
+        board = await timed('load', 0, load())
+        assert len(board.node_ids) == nodes
+        await timed('stream', 0, stream())
+    finally:
+        async with database.AsyncSessionLocal() as db:
+            await crud.delete_session(db, session.id)
+        await database.get_engine().dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL', 'sqlite:///./bench.db'))
+    parser.add_argument('--nodes', type=int, default=5000)
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    args = parser.parse_args()
+
+    # The engine is created lazily from DATABASE_URL on first use
+    os.environ['DATABASE_URL'] = args.database_url
+    asyncio.run(run(args.nodes, args.concurrency, args.updates))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""
+Compact, array-backed in-memory representation of a board.
+
+Node and edge attributes are stored column-wise in `array` buffers, styles are
+interned, and wire-format dicts are only built when a client actually needs
+them. A resident board costs tens of bytes per node (plus its text) instead of
+one SQLAlchemy object and one Pydantic model per row.
+"""
+import json
+import math
+import sys
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from residency import ResidentComponent
+import text_sync
+
+# Column order expected by `CompactBoard.from_rows`
+NODE_COLUMNS = ('id', 'content', 'x', 'y', 'width', 'height', 'style', 'created_at', 'updated_at')
+EDGE_COLUMNS = ('id', 'source_id', 'target_id', 'created_at')
+
+_NO_TIME = math.nan
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes; they are stored in UTC, not local time
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def _to_timestamp(value) -> float:
+    if value is None:
+        return _NO_TIME
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return _as_utc(value).timestamp()
+
+
+def _to_wire_time(ts: float) -> Optional[str]:
+    """Render a timestamp the way `model_dump(mode='json')` renders UTC datetimes"""
+    if ts != ts:  # NaN
+        return None
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _wire_datetime(value: Optional[datetime]) -> Optional[str]:
+    return None if value is None else _to_wire_time(_as_utc(value).timestamp())
+
+
+def node_row_to_wire(session_id: int, row: Sequence) -> Dict[str, Any]:
+    """Wire-format dict of a node row in NODE_COLUMNS order"""
+    node_id, content, x, y, width, height, style, created_at, updated_at = row
+    return {
+        'content': content or '',
+        'x': x,
+        'y': y,
+        'width': width,
+        'height': height,
+        'style': style or {},
+        'id': node_id,
+        'session_id': session_id,
+        'created_at': _wire_datetime(created_at),
+        'updated_at': _wire_datetime(updated_at),
+    }
+
+
+def edge_row_to_wire(session_id: int, row: Sequence) -> Dict[str, Any]:
+    """Wire-format dict of an edge row in EDGE_COLUMNS order"""
+    edge_id, source_id, target_id, created_at = row
+    return {
+        'id': edge_id,
+        'session_id': session_id,
+        'source_id': source_id,
+        'target_id': target_id,
+        'created_at': _wire_datetime(created_at),
+    }
+
+
+class CompactBoard:
+    """Column-oriented nodes and edges of one session"""
+
+    __slots__ = (
+        'session_id', 'version',
+        'node_ids', 'xs', 'ys', 'widths', 'heights', 'style_refs',
+        'node_created', 'node_updated', 'contents', '_node_rows',
+        'styles', '_style_refs',
+        'edge_ids', 'sources', 'targets', 'edge_created', '_edge_rows',
+    )
+
+    def __init__(self, session_id: int):
+        self.session_id = session_id
+        self.version = 0
+
+        self.node_ids = array('q')
+        self.xs = array('i')
+        self.ys = array('i')
+        self.widths = array('i')
+        self.heights = array('i')
+        self.style_refs = array('I')
+        self.node_created = array('d')
+        self.node_updated = array('d')
+        self.contents: List[str] = []
+        self._node_rows: Dict[int, int] = {}
+
+        self.styles: List[Dict] = []
+        self._style_refs: Dict[str, int] = {}
+
+        self.edge_ids = array('q')
+        self.sources = array('q')
+        self.targets = array('q')
+        self.edge_created = array('d')
+        self._edge_rows: Dict[int, int] = {}
+
+    def snapshot(self) -> "CompactBoard":
+        """
+        Independent copy, e.g. to hand to another process. Pickling happens in
+        the executor's feeder thread, so the live board must not be passed.
+        """
+        copy = CompactBoard(self.session_id)
+        copy.version = self.version
+        for name in ('node_ids', 'xs', 'ys', 'widths', 'heights', 'style_refs',
+                     'node_created', 'node_updated', 'contents', 'styles',
+                     'edge_ids', 'sources', 'targets', 'edge_created'):
+            setattr(copy, name, getattr(self, name)[:])
+        copy._node_rows = dict(self._node_rows)
+        copy._style_refs = dict(self._style_refs)
+        copy._edge_rows = dict(self._edge_rows)
+        return copy
+
+    @classmethod
+    def from_rows(cls, session_id: int, node_rows: Iterable[Sequence], edge_rows: Iterable[Sequence]) -> "CompactBoard":
+        """Build a board from row tuples in NODE_COLUMNS / EDGE_COLUMNS order"""
+        board = cls(session_id)
+        for row in node_rows:
+            board._append_node(*row)
+        for row in edge_rows:
+            board._append_edge(*row)
+        return board
+
+    # ==================== NODES ====================
+
+    def _intern_style(self, style: Optional[Dict]) -> int:
+        key = json.dumps(style or {}, sort_keys=True, separators=(',', ':'))
+        ref = self._style_refs.get(key)
+        if ref is None:
+            ref = self._style_refs[key] = len(self.styles)
+            self.styles.append(json.loads(key))
+        return ref
+
+    def _append_node(self, node_id, content, x, y, width, height, style, created_at, updated_at) -> None:
+        self._node_rows[node_id] = len(self.node_ids)
+        self.node_ids.append(node_id)
+        self.contents.append(content or '')
+        self.xs.append(x if x is not None else 100)
+        self.ys.append(y if y is not None else 100)
+        self.widths.append(width if width is not None else 200)
+        self.heights.append(height if height is not None else 100)
+        self.style_refs.append(self._intern_style(style))
+        self.node_created.append(_to_timestamp(created_at))
+        self.node_updated.append(_to_timestamp(updated_at))
+
+    def upsert_node(self, node: Dict[str, Any]) -> None:
+        """Insert or replace a node given in wire format"""
+        row = self._node_rows.get(node['id'])
+        if row is None:
+            self._append_node(*(node.get(column) for column in NODE_COLUMNS))
+        else:
+            self.contents[row] = node.get('content') or ''
+            self.xs[row] = node['x']
+            self.ys[row] = node['y']
+            self.widths[row] = node['width']
+            self.heights[row] = node['height']
+            self.style_refs[row] = self._intern_style(node.get('style'))
+            self.node_updated[row] = _to_timestamp(node.get('updated_at'))
+        self.version += 1
+
+    def remove_node(self, node_id: int) -> bool:
+        """Remove a node and every edge touching it"""
+        row = self._node_rows.pop(node_id, None)
+        if row is None:
+            return False
+        last = len(self.node_ids) - 1
+        columns = (self.node_ids, self.xs, self.ys, self.widths, self.heights,
+                   self.style_refs, self.node_created, self.node_updated, self.contents)
+        if row != last:
+            # Swap-remove keeps deletes O(1) at the cost of row order
+            for column in columns:
+                column[row] = column[last]
+            self._node_rows[self.node_ids[row]] = row
+        for column in columns:
+            column.pop()
+
+        doomed = [edge_id for edge_id, s, t in zip(self.edge_ids, self.sources, self.targets)
+                  if s == node_id or t == node_id]
+        for edge_id in doomed:
+            self.remove_edge(edge_id)
+        self.version += 1
+        return True
+
+    def node(self, row: int) -> Dict[str, Any]:
+        """Wire-format dict of the node stored at `row`"""
+        return {
+            'content': self.contents[row],
+            'x': self.xs[row],
+            'y': self.ys[row],
+            'width': self.widths[row],
+            'height': self.heights[row],
+            'style': dict(self.styles[self.style_refs[row]]),
+            'id': self.node_ids[row],
+            'session_id': self.session_id,
+            'created_at': _to_wire_time(self.node_created[row]),
+            'updated_at': _to_wire_time(self.node_updated[row]),
+        }
+
+    def has_node(self, node_id: int) -> bool:
+        return node_id in self._node_rows
+
+    def content(self, node_id: int) -> Optional[str]:
+        row = self._node_rows.get(node_id)
+        return None if row is None else self.contents[row]
+
+    # ==================== EDGES ====================
+
+    def _append_edge(self, edge_id, source_id, target_id, created_at) -> None:
+        self._edge_rows[edge_id] = len(self.edge_ids)
+        self.edge_ids.append(edge_id)
+        self.sources.append(source_id)
+        self.targets.append(target_id)
+        self.edge_created.append(_to_timestamp(created_at))
+
+    def upsert_edge(self, edge: Dict[str, Any]) -> None:
+        """Insert an edge given in wire format"""
+        if edge['id'] not in self._edge_rows:
+            self._append_edge(*(edge.get(column) for column in EDGE_COLUMNS))
+            self.version += 1
+
+    def remove_edge(self, edge_id: int) -> bool:
+        row = self._edge_rows.pop(edge_id, None)
+        if row is None:
+            return False
+        last = len(self.edge_ids) - 1
+        columns = (self.edge_ids, self.sources, self.targets, self.edge_created)
+        if row != last:
+            for column in columns:
+                column[row] = column[last]
+            self._edge_rows[self.edge_ids[row]] = row
+        for column in columns:
+            column.pop()
+        self.version += 1
+        return True
+
+    def edge(self, row: int) -> Dict[str, Any]:
+        """Wire-format dict of the edge stored at `row`"""
+        return {
+            'id': self.edge_ids[row],
+            'session_id': self.session_id,
+            'source_id': self.sources[row],
+            'target_id': self.targets[row],
+            'created_at': _to_wire_time(self.edge_created[row]),
+        }
+
+    # ==================== WIRE FORMAT ====================
+
+    def iter_nodes(self) -> Iterator[Dict[str, Any]]:
+        return (self.node(row) for row in range(len(self.node_ids)))
+
+    def iter_edges(self) -> Iterator[Dict[str, Any]]:
+        return (self.edge(row) for row in range(len(self.edge_ids)))
+
+    def to_wire(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Same shape as `SessionState.model_dump(mode='json')`"""
+        return {'nodes': list(self.iter_nodes()), 'edges': list(self.iter_edges())}
+
+    def apply_event(self, event: str, data: Dict[str, Any]) -> None:
+        """Keep the board in sync with a committed broadcast event"""
+        if event in ('node_created', 'node_updated'):
+            self.upsert_node(data['node'])
+        elif event == 'node_text_edited':
+            row = self._node_rows.get(data['node_id'])
+            if row is not None:
+                self.contents[row] = text_sync.apply(self.contents[row], data['op'])
+                self.version += 1
+        elif event == 'node_deleted':
+            self.remove_node(data['node_id'])
+        elif event == 'edge_created':
+            self.upsert_edge(data['edge'])
+        elif event == 'edge_deleted':
+            self.remove_edge(data['edge_id'])
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the board"""
+        columns = (self.node_ids, self.xs, self.ys, self.widths, self.heights, self.style_refs,
+                   self.node_created, self.node_updated,
+                   self.edge_ids, self.sources, self.targets, self.edge_created)
+        size = sum(sys.getsizeof(column) for column in columns)
+        size += sys.getsizeof(self.contents) + sum(sys.getsizeof(c) for c in self.contents)
+        size += sys.getsizeof(self._node_rows) + sys.getsizeof(self._edge_rows)
+        size += sum(len(key) for key in self._style_refs)
+        return size
+
+
+class BoardCache(ResidentComponent):
+    """Resident `CompactBoard` per session, loaded through the mutation queue"""
+
+    name = 'board'
+
+    def __init__(self, mutations, load_board):
+        self.mutations = mutations
+        self.load_board = load_board
+        self.boards: Dict[int, CompactBoard] = {}
+
+    async def load(self, session_id: int) -> None:
+        # Loading as a queued mutation orders the snapshot with respect to
+        # concurrent writes: earlier ones are in it, later ones are applied
+        async def install(board):
+            self.boards[session_id] = board
+
+        await self.mutations.submit(session_id, lambda db: self.load_board(db, session_id), install)
+
+    def get(self, session_id: int) -> Optional[CompactBoard]:
+        return self.boards.get(session_id)
+
+    def apply_event(self, session_id: int, event: str, data: Dict[str, Any]) -> None:
+        board = self.boards.get(session_id)
+        if board is not None:
+            board.apply_event(event, data)
+
+    def sizeof(self, session_id: int) -> int:
+        board = self.boards.get(session_id)
+        return board.nbytes() if board is not None else 0
+
+    def evict(self, session_id: int) -> None:
+        self.boards.pop(session_id, None)
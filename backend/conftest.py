@@ -0,0 +1,91 @@
+"""
+Shared fakes and fixtures for the backend tests.
+"""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pytest
+
+# A script against a live database; run it with `python test_crud.py`
+collect_ignore = ['test_crud.py']
+
+
+class Clock:
+    """Time source the test moves by setting `now`"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeDb:
+    """
+    Stands in for an AsyncSession: logs ('commit' | 'rollback', applied) to
+    `log` and answers every `scalar` query with `answer`
+    """
+
+    def __init__(self, log=None, answer=None):
+        self.log = log if log is not None else []
+        self.answer = answer
+        self.applied = []
+        self.queries = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        if exc[0] is not None:
+            self.log.append(('rollback', self.applied))
+        return False
+
+    async def commit(self):
+        self.log.append(('commit', self.applied))
+
+    async def scalar(self, statement):
+        self.queries += 1
+        return self.answer
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def db_log():
+    """What the `fake_db` sessions committed and rolled back, in order"""
+    return []
+
+
+@pytest.fixture
+def fake_db(db_log):
+    """Session factory handing out FakeDbs that share `db_log`"""
+    return lambda: FakeDb(db_log)
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    """
+    Async function returning an engine and session factory on a fresh SQLite
+    file, set up the way database.py does it
+    """
+    pytest.importorskip('aiosqlite')
+
+    async def connect(name='test.db'):
+        from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+        from database import Base
+        from storage import SQLiteBackend
+        import models  # noqa: F401  (registers the tables)
+
+        url = f"sqlite+aiosqlite:///{tmp_path / name}"
+        backend = SQLiteBackend()
+        engine = create_async_engine(url, **backend.engine_options(url, 0))
+        backend.configure(engine)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        return engine, async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    return connect
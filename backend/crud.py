@@ -1,13 +1,34 @@
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete, update
-from sqlalchemy.orm import selectinload
-from typing import Optional, Dict, List
+from __future__ import annotations
+
+from sqlalchemy import select, delete, update, func, insert
+from typing import TYPE_CHECKING, Optional, Dict, List, AsyncIterator, Tuple
+from datetime import datetime
+import json
+import zlib
 
 try:
     from . import models, schemas
+    from .database import get_storage
+    from .compact_board import CompactBoard, NODE_COLUMNS, EDGE_COLUMNS, node_row_to_wire, edge_row_to_wire
 except ImportError:
     import models
     import schemas
+    from database import get_storage
+    from compact_board import CompactBoard, NODE_COLUMNS, EDGE_COLUMNS, node_row_to_wire, edge_row_to_wire
+
+if TYPE_CHECKING:
+    # Only for annotations: the asyncio extension loads when the engine is created
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+
+async def _finish(db: AsyncSession, commit: bool, obj=None) -> None:
+    """Commit, or only flush when the caller owns the transaction"""
+    if commit:
+        await db.commit()
+    else:
+        await db.flush()
+    if obj is not None:
+        await db.refresh(obj)
 
 
 # ==================== SESSION CRUD ====================
@@ -21,6 +42,18 @@ async def create_session(db: AsyncSession, title: str) -> models.Session:
     return session
 
 
+async def create_session_with_id(db: AsyncSession, session_id: int, title: str) -> models.Session:
+    """Create a session with an explicit ID (e.g. auto-created on join)"""
+    session = models.Session(id=session_id, title=title)
+    db.add(session)
+    await db.commit()
+    # Keep future auto-generated IDs clear of the one we just used
+    await get_storage().sync_id_sequence(db, models.Session.__table__)
+    await db.commit()
+    await db.refresh(session)
+    return session
+
+
 async def get_session(db: AsyncSession, session_id: int) -> Optional[models.Session]:
     """Get a session by ID"""
     result = await db.execute(
@@ -77,12 +110,160 @@ async def get_session_state(db: AsyncSession, session_id: int) -> schemas.Sessio
     return schemas.SessionState(nodes=node_schemas, edges=edge_schemas)
 
 
+async def load_compact_board(db: AsyncSession, session_id: int) -> CompactBoard:
+    """Load a session into a CompactBoard without building ORM objects"""
+    node_rows = await db.execute(
+        select(*(getattr(models.Node, column) for column in NODE_COLUMNS))
+        .where(models.Node.session_id == session_id)
+    )
+    edge_rows = await db.execute(
+        select(*(getattr(models.Edge, column) for column in EDGE_COLUMNS))
+        .where(models.Edge.session_id == session_id)
+    )
+    return CompactBoard.from_rows(session_id, node_rows, edge_rows)
+
+
+async def count_session_rows(db: AsyncSession, session_id: int) -> Tuple[int, int]:
+    """Number of nodes and edges in a session"""
+    node_count = await db.scalar(
+        select(func.count()).select_from(models.Node).where(models.Node.session_id == session_id)
+    )
+    edge_count = await db.scalar(
+        select(func.count()).select_from(models.Edge).where(models.Edge.session_id == session_id)
+    )
+    return node_count or 0, edge_count or 0
+
+
+async def stream_session_state(
+    db: AsyncSession,
+    session_id: int,
+    center: Tuple[float, float],
+    chunk_size: int
+) -> AsyncIterator[Tuple[List[Dict], List[Dict]]]:
+    """Stream wire-format (nodes, edges) chunks through a server-side cursor, nearest nodes first"""
+    cx, cy = center
+    distance = func.abs(models.Node.x - cx) + func.abs(models.Node.y - cy)
+    nodes = await db.stream(
+        select(*(getattr(models.Node, column) for column in NODE_COLUMNS))
+        .where(models.Node.session_id == session_id)
+        .order_by(distance, models.Node.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    async for rows in nodes.partitions(chunk_size):
+        yield [node_row_to_wire(session_id, row) for row in rows], []
+
+    edges = await db.stream(
+        select(*(getattr(models.Edge, column) for column in EDGE_COLUMNS))
+        .where(models.Edge.session_id == session_id)
+        .execution_options(yield_per=chunk_size)
+    )
+    async for rows in edges.partitions(chunk_size):
+        yield [], [edge_row_to_wire(session_id, row) for row in rows]
+
+
+# ==================== SESSION ARCHIVE ====================
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def _from_iso(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+async def find_cold_sessions(db: AsyncSession, cutoff: datetime, limit: int) -> List[int]:
+    """Ids of unarchived sessions with nodes but no activity since `cutoff`"""
+    touched = func.coalesce(models.Node.updated_at, models.Node.created_at)
+    recent_node = select(models.Node.id).where(
+        models.Node.session_id == models.Session.id, touched >= cutoff
+    ).exists()
+    recent_edge = select(models.Edge.id).where(
+        models.Edge.session_id == models.Session.id, models.Edge.created_at >= cutoff
+    ).exists()
+    has_nodes = select(models.Node.id).where(models.Node.session_id == models.Session.id).exists()
+    archived = select(models.SessionArchive.session_id).where(
+        models.SessionArchive.session_id == models.Session.id
+    ).exists()
+    result = await db.execute(
+        select(models.Session.id)
+        .where(
+            func.coalesce(models.Session.updated_at, models.Session.created_at) < cutoff,
+            has_nodes, ~recent_node, ~recent_edge, ~archived,
+        )
+        .order_by(models.Session.id)
+        .limit(limit)
+    )
+    return list(result.scalars().all())
+
+
+async def archive_session(db: AsyncSession, session_id: int, commit: bool = True) -> Optional[models.SessionArchive]:
+    """Move a session's nodes and edges into one compressed archive row"""
+    node_rows = (await db.execute(
+        select(*(getattr(models.Node, column) for column in NODE_COLUMNS))
+        .where(models.Node.session_id == session_id)
+    )).all()
+    if not node_rows:
+        return None
+    edge_rows = (await db.execute(
+        select(*(getattr(models.Edge, column) for column in EDGE_COLUMNS))
+        .where(models.Edge.session_id == session_id)
+    )).all()
+
+    document = {
+        'nodes': [list(row[:7]) + [_iso(row[7]), _iso(row[8])] for row in node_rows],
+        'edges': [list(row[:3]) + [_iso(row[3])] for row in edge_rows],
+    }
+    archive = models.SessionArchive(
+        session_id=session_id,
+        payload=zlib.compress(json.dumps(document, separators=(',', ':')).encode('utf-8'), 6),
+        node_count=len(node_rows),
+        edge_count=len(edge_rows),
+    )
+    db.add(archive)
+    await db.execute(delete(models.Edge).where(models.Edge.session_id == session_id))
+    await db.execute(delete(models.Node).where(models.Node.session_id == session_id))
+    await _finish(db, commit)
+    return archive
+
+
+async def load_archived_board(db: AsyncSession, session_id: int) -> Optional[CompactBoard]:
+    """Decode an archived session into a CompactBoard without restoring it"""
+    archive = await db.get(models.SessionArchive, session_id)
+    if archive is None:
+        return None
+    document = json.loads(zlib.decompress(archive.payload))
+    return CompactBoard.from_rows(session_id, document['nodes'], document['edges'])
+
+
+async def restore_session(db: AsyncSession, session_id: int, commit: bool = True) -> bool:
+    """Move an archived session back into the nodes and edges tables"""
+    archive = await db.get(models.SessionArchive, session_id)
+    if archive is None:
+        return False
+    document = json.loads(zlib.decompress(archive.payload))
+
+    if document['nodes']:
+        await db.execute(insert(models.Node), [
+            dict(zip(NODE_COLUMNS, row[:7] + [_from_iso(row[7]), _from_iso(row[8])]), session_id=session_id)
+            for row in document['nodes']
+        ])
+    if document['edges']:
+        await db.execute(insert(models.Edge), [
+            dict(zip(EDGE_COLUMNS, row[:3] + [_from_iso(row[3])]), session_id=session_id)
+            for row in document['edges']
+        ])
+    await db.delete(archive)
+    await _finish(db, commit)
+    return True
+
+
 # ==================== NODE CRUD ====================
 
 async def create_node(
     db: AsyncSession, 
     session_id: int, 
-    node_data: schemas.NodeCreate
+    node_data: schemas.NodeCreate,
+    commit: bool = True
 ) -> models.Node:
     """Create a new node in a session"""
     node = models.Node(
@@ -95,8 +276,7 @@ async def create_node(
         style=node_data.style or {}
     )
     db.add(node)
-    await db.commit()
-    await db.refresh(node)
+    await _finish(db, commit, node)
     return node
 
 
@@ -136,44 +316,61 @@ async def update_node(
     return node
 
 
+# Node fields a patch may change
+NODE_PATCH_FIELDS = ('content', 'x', 'y', 'width', 'height', 'style')
+
+
+def _node_where(node_id: int, session_id: Optional[int]):
+    """Conditions matching a node, within `session_id` if given"""
+    conditions = [models.Node.id == node_id]
+    if session_id is not None:
+        conditions.append(models.Node.session_id == session_id)
+    return conditions
+
+
 async def update_node_partial(
     db: AsyncSession, 
     node_id: int, 
-    patch: Dict
+    patch: Dict,
+    commit: bool = True,
+    session_id: Optional[int] = None
 ) -> Optional[models.Node]:
-    """Update a node with a dictionary patch (for Socket.IO updates)"""
-    node = await get_node(db, node_id)
-    if not node:
+    """
+    Update a node with a dictionary patch (for Socket.IO updates) in one
+    UPDATE ... RETURNING; None if no node matched (in `session_id`, if given)
+    """
+    values = {field: value for field, value in patch.items() if field in NODE_PATCH_FIELDS}
+    if not values:
+        result = await db.execute(select(models.Node).where(*_node_where(node_id, session_id)))
+        return result.scalar_one_or_none()
+    node = await db.scalar(
+        update(models.Node)
+        .where(*_node_where(node_id, session_id))
+        .values(**values)
+        .returning(models.Node)
+        .execution_options(populate_existing=True)
+    )
+    if node is None:
         return None
-    
-    # Update only provided fields
-    for field, value in patch.items():
-        if hasattr(node, field):
-            setattr(node, field, value)
-    
-    await db.commit()
-    await db.refresh(node)
+    await _finish(db, commit)
     return node
 
 
-async def delete_node(db: AsyncSession, node_id: int) -> bool:
-    """Delete a node (cascade will delete related edges)"""
-    node = await get_node(db, node_id)
-    if not node:
-        return False
-    
-    # Explicitly delete all edges connected to this node first
-    # This prevents SQLAlchemy from trying to set foreign keys to NULL
-    # which violates the NOT NULL constraint
-    await db.execute(
-        delete(models.Edge).where(
-            (models.Edge.source_id == node_id) | (models.Edge.target_id == node_id)
-        )
+async def delete_node(db: AsyncSession, node_id: int, commit: bool = True, session_id: Optional[int] = None) -> bool:
+    """Delete a node and its edges; False if no node matched (in `session_id`, if given)"""
+    # Explicitly delete all edges connected to this node first, so nothing
+    # depends on the database cascade
+    edges = delete(models.Edge).where(
+        (models.Edge.source_id == node_id) | (models.Edge.target_id == node_id)
     )
+    if session_id is not None:
+        edges = edges.where(models.Edge.session_id == session_id)
+    await db.execute(edges)
     
-    # Now delete the node (database cascade will handle any remaining edges)
-    await db.delete(node)
-    await db.commit()
+    result = await db.execute(delete(models.Node).where(*_node_where(node_id, session_id)))
+    if result.rowcount == 0:
+        return False
+    await _finish(db, commit)
     return True
 
 
@@ -182,7 +379,8 @@ async def delete_node(db: AsyncSession, node_id: int) -> bool:
 async def create_edge(
     db: AsyncSession, 
     session_id: int, 
-    edge_data: schemas.EdgeCreate
+    edge_data: schemas.EdgeCreate,
+    commit: bool = True
 ) -> models.Edge:
     """Create a new edge connecting two nodes"""
     # Verify both nodes exist and belong to the session
@@ -212,8 +410,7 @@ async def create_edge(
         target_id=edge_data.target_id
     )
     db.add(edge)
-    await db.commit()
-    await db.refresh(edge)
+    await _finish(db, commit, edge)
     return edge
 
 
@@ -243,13 +440,15 @@ async def get_edges_by_node(db: AsyncSession, node_id: int) -> List[models.Edge]
     return list(result.scalars().all())
 
 
-async def delete_edge(db: AsyncSession, edge_id: int) -> bool:
-    """Delete an edge"""
-    edge = await get_edge(db, edge_id)
-    if not edge:
+async def delete_edge(db: AsyncSession, edge_id: int, commit: bool = True, session_id: Optional[int] = None) -> bool:
+    """Delete an edge; False if no edge matched (in `session_id`, if given)"""
+    statement = delete(models.Edge).where(models.Edge.id == edge_id)
+    if session_id is not None:
+        statement = statement.where(models.Edge.session_id == session_id)
+    result = await db.execute(statement)
+    if result.rowcount == 0:
         return False
-    await db.delete(edge)
-    await db.commit()
+    await _finish(db, commit)
     return True
 
 
@@ -262,3 +461,32 @@ async def delete_edges_by_node(db: AsyncSession, node_id: int) -> int:
     )
     await db.commit()
     return result.rowcount
+
+
+# ==================== SHARD MEMBERSHIP ====================
+
+async def heartbeat_instance(db: AsyncSession, instance_id: str, url: str, now: datetime) -> None:
+    """Record that a backend instance is alive"""
+    result = await db.execute(
+        update(models.ShardInstance)
+        .where(models.ShardInstance.instance_id == instance_id)
+        .values(url=url, heartbeat_at=now)
+    )
+    if result.rowcount == 0:
+        db.add(models.ShardInstance(instance_id=instance_id, url=url, heartbeat_at=now))
+    await db.commit()
+
+
+async def live_instances(db: AsyncSession, since: datetime) -> Dict[str, str]:
+    """{instance_id: url} of instances with a heartbeat after `since`"""
+    result = await db.execute(
+        select(models.ShardInstance.instance_id, models.ShardInstance.url)
+        .where(models.ShardInstance.heartbeat_at >= since)
+    )
+    return {instance_id: url for instance_id, url in result.all()}
+
+
+async def remove_instance(db: AsyncSession, instance_id: str) -> None:
+    """Remove an instance that is shutting down"""
+    await db.execute(delete(models.ShardInstance).where(models.ShardInstance.instance_id == instance_id))
+    await db.commit()
@@ -0,0 +1,414 @@
+"""
+Per-session change journal for reconnecting clients.
+
+Each live session keeps a fixed-size ring buffer of its recent `node_*` /
+`edge_*` events in serialized form, bounded both by entry count and bytes.
+A client that briefly disconnects resumes from the last sequence number it
+saw instead of reloading the whole board. With JOURNAL_DIR set, the ring is
+mirrored to an append-only file per session so it survives a worker restart;
+the file is written behind, in the I/O pool.
+
+Sequence numbers are only meaningful within an epoch: a journal created from
+scratch gets a new epoch, so clients holding positions from another process
+fall back to a full reload. Events committed while a session is not resident
+are not journaled, so its file is sealed and the next load starts a new epoch
+instead of replaying with a gap.
+"""
+import asyncio
+import json
+import os
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from offload import IO, OffloadError, offloadable
+from residency import ResidentComponent
+
+JOURNAL_CAPACITY = int(os.getenv("JOURNAL_CAPACITY", "1024"))
+JOURNAL_MAX_BYTES = int(os.getenv("JOURNAL_MAX_BYTES", str(1024 * 1024)))
+JOURNAL_DIR = os.getenv("JOURNAL_DIR") or None
+
+# Last line of a file whose journal missed events
+SEAL_RECORD = b'{"sealed":true}'
+
+# Events recorded in the journal
+JOURNALED_EVENTS = frozenset({'node_created', 'node_updated', 'node_deleted', 'node_text_edited',
+                              'edge_created', 'edge_deleted'})
+
+
+class ChangeJournal:
+    """Ring buffer of serialized events, addressed by sequence number"""
+
+    __slots__ = ('epoch', 'capacity', 'max_bytes', '_slots', '_count', '_bytes', 'next_seq',
+                 'mirror', '_file_bytes', '_unwritten')
+
+    def __init__(
+        self,
+        capacity: int = JOURNAL_CAPACITY,
+        max_bytes: int = JOURNAL_MAX_BYTES,
+        epoch: Optional[str] = None,
+        next_seq: int = 1,
+    ):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.epoch = epoch or uuid.uuid4().hex
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self._slots: List[Optional[bytes]] = [None] * capacity
+        self._count = 0
+        self._bytes = 0
+        self.next_seq = next_seq
+        self.mirror: Optional[JournalFile] = None
+        self._file_bytes = 0
+        self._unwritten: List[bytes] = []
+
+    @property
+    def first_seq(self) -> int:
+        """Oldest sequence number still held"""
+        return self.next_seq - self._count
+
+    @property
+    def last_seq(self) -> int:
+        """Newest sequence number handed out (0 if none)"""
+        return self.next_seq - 1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, event: str, data: Any) -> int:
+        """Record an event and return its sequence number"""
+        seq = self.next_seq
+        record = json.dumps({'seq': seq, 'event': event, 'data': data}, separators=(',', ':')).encode('utf-8')
+        self._push(seq, record)
+        if self.mirror is not None:
+            # Handed to the file later through `take_writes`
+            self._unwritten.append(record)
+        return seq
+
+    def _push(self, seq: int, record: bytes) -> None:
+        # Drop the oldest entries until the new one fits both bounds
+        while self._count and (self._count >= self.capacity or self._bytes + len(record) > self.max_bytes):
+            self._drop_oldest()
+        self._slots[seq % self.capacity] = record
+        self._count += 1
+        self._bytes += len(record)
+        self.next_seq = seq + 1
+
+    def _drop_oldest(self) -> None:
+        slot = self.first_seq % self.capacity
+        self._bytes -= len(self._slots[slot])
+        self._slots[slot] = None
+        self._count -= 1
+
+    def since(self, seq: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Events with a sequence number greater than `seq`, oldest first.
+
+        Returns None when the journal can no longer answer: events after
+        `seq` were already truncated, or `seq` was never handed out.
+        """
+        if seq < self.first_seq - 1 or seq > self.last_seq:
+            return None
+        return [json.loads(self._slots[s % self.capacity]) for s in range(seq + 1, self.next_seq)]
+
+    def nbytes(self) -> int:
+        return self._bytes + 8 * self.capacity
+
+    # ==================== FILE MIRROR ====================
+    # The journal's own state (including `_unwritten` and `_file_bytes`) is
+    # only touched on the event loop. The I/O pool gets the `JournalFile` and
+    # the immutable bytes of a `take_writes` job, nothing else.
+
+    @classmethod
+    def open(cls, path: str, capacity: int = JOURNAL_CAPACITY, max_bytes: int = JOURNAL_MAX_BYTES) -> "ChangeJournal":
+        """Restore a journal from its append-only file and keep mirroring to it"""
+        epoch, next_seq, records = _read_journal_file(path)
+        if epoch is None:
+            # No file, or a sealed one: start over in a new epoch
+            journal = cls(capacity, max_bytes)
+        else:
+            journal = cls(capacity, max_bytes, epoch=epoch, next_seq=records[0][0] if records else next_seq)
+            for seq, record in records:
+                if seq != journal.next_seq:
+                    break  # torn or out-of-order tail
+                journal._push(seq, record)
+        # Not shared with the event loop yet, so it may be set up here
+        contents = journal._contents()
+        journal.mirror = JournalFile(path)
+        journal.mirror.rewrite(contents)
+        journal._file_bytes = len(contents)
+        return journal
+
+    def _contents(self) -> bytes:
+        """The header plus the entries still held, as the file should read"""
+        lines = [json.dumps({'epoch': self.epoch, 'next_seq': self.next_seq}).encode('utf-8')]
+        lines += [self._slots[seq % self.capacity] for seq in range(self.first_seq, self.next_seq)]
+        return b'\n'.join(lines) + b'\n'
+
+    @property
+    def dirty(self) -> bool:
+        """Whether records are waiting to be handed to the mirror file"""
+        return bool(self._unwritten)
+
+    def take_writes(self) -> Optional[Tuple[bool, bytes]]:
+        """
+        Take the records appended since the last call, as a `(rewrite, data)`
+        job for `JournalFile.write`, or None. Runs on the event loop, so the
+        job is a consistent snapshot; once the file has grown well past what
+        the ring holds, the job compacts it instead of appending.
+        """
+        if not self._unwritten:
+            return None
+        records, self._unwritten = self._unwritten, []
+        data = b''.join(record + b'\n' for record in records)
+        if self._file_bytes + len(data) > 4 * self.max_bytes:
+            contents = self._contents()
+            self._file_bytes = len(contents)
+            return True, contents
+        self._file_bytes += len(data)
+        return False, data
+
+
+class JournalFile:
+    """A journal's append-only mirror file; every method blocks"""
+
+    __slots__ = ('path', '_file')
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def rewrite(self, contents: bytes) -> None:
+        """Atomically replace the file with `contents`"""
+        if self._file is not None:
+            self._file.close()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(contents)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'ab')
+
+    def write(self, job: Optional[Tuple[bool, bytes]]) -> None:
+        """Apply a `ChangeJournal.take_writes` job"""
+        if job is None:
+            return
+        rewrite, data = job
+        if rewrite:
+            self.rewrite(data)
+        elif self._file is not None:
+            self._file.write(data)
+            self._file.flush()
+
+    def sync(self, job: Optional[Tuple[bool, bytes]] = None) -> None:
+        """Apply `job` and fsync the file"""
+        self.write(job)
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self, job: Optional[Tuple[bool, bytes]] = None) -> None:
+        """Apply `job`, fsync and close the file"""
+        if self._file is not None:
+            self.sync(job)
+            self._file.close()
+            self._file = None
+
+
+def _read_journal_file(path: str) -> Tuple[Optional[str], int, List[Tuple[int, bytes]]]:
+    """Epoch (None if the file is missing or sealed), header next_seq and (seq, record) lines"""
+    if not os.path.exists(path):
+        return None, 1, []
+    records = []
+    with open(path, 'rb') as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            return None, 1, []
+        for line in f:
+            line = line.rstrip(b'\n')
+            if line == SEAL_RECORD:
+                return None, 1, []
+            try:
+                seq = json.loads(line)['seq']
+            except (ValueError, KeyError, TypeError):
+                break  # a partial write at the tail ends the replay
+            records.append((seq, line))
+    return header.get('epoch'), header.get('next_seq', 1), records
+
+
+@offloadable(IO)
+def open_journal(path: str, capacity: int, max_bytes: int) -> ChangeJournal:
+    return ChangeJournal.open(path, capacity, max_bytes)
+
+
+@offloadable(IO)
+def write_journal(mirror: JournalFile, job: Optional[Tuple[bool, bytes]]) -> None:
+    mirror.write(job)
+
+
+@offloadable(IO)
+def sync_journal(mirror: JournalFile, job: Optional[Tuple[bool, bytes]]) -> None:
+    mirror.sync(job)
+
+
+@offloadable(IO)
+def close_journal(mirror: JournalFile, job: Optional[Tuple[bool, bytes]]) -> None:
+    mirror.close(job)
+
+
+@offloadable(IO)
+def seal_journal_file(path: str) -> None:
+    """Mark a journal file as missing events, so it is not resumed from"""
+    if os.path.exists(path):
+        with open(path, 'ab') as f:
+            f.write(SEAL_RECORD + b'\n')
+
+
+async def _file_job(job, *args) -> Any:
+    """Run a journal file job in the I/O pool, inline if the pool cannot take it"""
+    try:
+        return await job.offload(*args)
+    except OffloadError as e:
+        print(f'⚠️  Journal file I/O on the event loop: {e}')
+        return job(*args)
+
+
+class JournalStore(ResidentComponent):
+    """Resident `ChangeJournal` per session, optionally mirrored to JOURNAL_DIR"""
+
+    name = 'journal'
+
+    def __init__(
+        self,
+        directory: Optional[str] = JOURNAL_DIR,
+        capacity: int = JOURNAL_CAPACITY,
+        max_bytes: int = JOURNAL_MAX_BYTES,
+    ):
+        self.directory = directory
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.journals: Dict[int, ChangeJournal] = {}
+        # Latest file job of each session; every job waits for the one before
+        self._file_tasks: Dict[int, asyncio.Task] = {}
+        self._writing: Set[int] = set()
+        self._sealed: Set[int] = set()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, session_id: int) -> str:
+        return os.path.join(self.directory, f'session_{session_id}.journal')
+
+    def _then(self, session_id: int, work: Callable[[], Awaitable[None]]) -> asyncio.Task:
+        """Run file work for a session once its earlier file work is done"""
+        previous = self._file_tasks.get(session_id)
+
+        async def run():
+            if previous is not None:
+                await asyncio.wait([previous])
+            try:
+                await work()
+            except Exception as e:
+                print(f'❌ Error writing the journal of session {session_id}: {e}')
+
+        def forget(task):
+            if self._file_tasks.get(session_id) is task:
+                del self._file_tasks[session_id]
+
+        task = self._file_tasks[session_id] = asyncio.create_task(run())
+        task.add_done_callback(forget)
+        return task
+
+    async def _settled(self, session_id: int) -> None:
+        task = self._file_tasks.get(session_id)
+        if task is not None:
+            await asyncio.wait([task])
+
+    async def load(self, session_id: int) -> None:
+        if session_id in self.journals:
+            return
+        if self.directory:
+            while True:
+                self._sealed.discard(session_id)
+                # The file of an earlier residency may still be being written or sealed
+                await self._settled(session_id)
+                journal = await _file_job(open_journal, self.path(session_id), self.capacity, self.max_bytes)
+                if session_id not in self._sealed:
+                    break
+                # Events committed while the file was read are not in it. Opening
+                # may have rewritten the file over that seal, so seal it again;
+                # reopening then starts a new epoch
+                await _file_job(close_journal, journal.mirror, None)
+                await _file_job(seal_journal_file, self.path(session_id))
+        else:
+            journal = ChangeJournal(self.capacity, self.max_bytes)
+        self.journals[session_id] = journal
+
+    def get(self, session_id: int) -> Optional[ChangeJournal]:
+        return self.journals.get(session_id)
+
+    def append(self, session_id: int, event: str, data: Any) -> Optional[int]:
+        """Journal a committed event of a resident session; returns its seq"""
+        if event not in JOURNALED_EVENTS:
+            return None
+        journal = self.journals.get(session_id)
+        if journal is None:
+            if self.directory and session_id not in self._sealed:
+                # The file now misses an event: never resume from it
+                self._sealed.add(session_id)
+                self._then(session_id, lambda: _file_job(seal_journal_file, self.path(session_id)))
+            return None
+        seq = journal.append(event, data)
+        if self.directory and session_id not in self._writing:
+            self._writing.add(session_id)
+            self._then(session_id, lambda: self._write_behind(session_id, journal))
+        return seq
+
+    async def _write_behind(self, session_id: int, journal: ChangeJournal) -> None:
+        """Write a journal's new records until it has none left"""
+        try:
+            while True:
+                job = journal.take_writes()
+                if job is None:
+                    break
+                await _file_job(write_journal, journal.mirror, job)
+        finally:
+            self._writing.discard(session_id)
+
+    def position(self, session_id: int) -> Optional[Dict[str, Any]]:
+        """Current `{epoch, seq}` of a session's journal"""
+        journal = self.journals.get(session_id)
+        if journal is None:
+            return None
+        return {'epoch': journal.epoch, 'seq': journal.last_seq}
+
+    def since(self, session_id: int, epoch: str, seq: int) -> Optional[List[Dict[str, Any]]]:
+        """Events after `seq` in `epoch`, or None if the client must reload"""
+        journal = self.journals.get(session_id)
+        if journal is None or journal.epoch != epoch:
+            return None
+        return journal.since(seq)
+
+    def sizeof(self, session_id: int) -> int:
+        journal = self.journals.get(session_id)
+        return journal.nbytes() if journal is not None else 0
+
+    def is_dirty(self, session_id: int) -> bool:
+        journal = self.journals.get(session_id)
+        return journal is not None and journal.dirty
+
+    async def flush(self, session_id: int) -> None:
+        journal = self.journals.get(session_id)
+        if journal is not None:
+            # Writes are taken when the job starts, after the ones queued before it
+            await self._then(session_id, lambda: _file_job(sync_journal, journal.mirror, journal.take_writes()))
+
+    def evict(self, session_id: int) -> None:
+        journal = self.journals.pop(session_id, None)
+        if journal is not None and self.directory:
+            self._then(session_id, lambda: _file_job(close_journal, journal.mirror, journal.take_writes()))
+
+    async def close(self) -> None:
+        """Wait for every pending file job, e.g. on shutdown"""
+        for session_id in list(self._file_tasks):
+            await self._settled(session_id)
@@ -1,14 +1,30 @@
+import asyncio
 import os
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 import socketio
 from socketio import AsyncServer, ASGIApp
-from database import AsyncSessionLocal, engine, Base
-from sqlalchemy import text
+import database
+from database import AsyncSessionLocal
 import crud
 import schemas
-from models import Session, Node, Edge
+from rate_limit import DeferredPatches, RateLimiter, RoomOutbox
+from mutation_queue import MutationQueue
+from residency import SessionResidency
+from compact_board import BoardCache
+from journal import JournalStore, JOURNALED_EVENTS
+from archive import SessionArchiver
+from offload import offloader, OffloadCancelled, OffloadError
+import compression
+import state_stream
+import text_sync
+from thumbnails import ThumbnailCache
+from text_sync import TextDocuments
+from membership import MembershipCache, SESSION, NODE, EDGE
+from sharding import ShardRouter
 
 # Allowed origins for CORS
 ALLOWED_ORIGINS = [
@@ -22,8 +38,15 @@ ALLOWED_ORIGINS = [
     "http://127.0.0.1:3000",
 ]
 
-# Initialize Socket.IO server with CORS
-sio = AsyncServer(async_mode='asgi', cors_allowed_origins=ALLOWED_ORIGINS)
+# Initialize Socket.IO server with CORS; long-polling responses over the
+# threshold are compressed by Engine.IO. Websocket frames are not deflated:
+# large payloads are gzipped by compression.encode_payload, the rest are small
+sio = AsyncServer(
+    async_mode='asgi',
+    cors_allowed_origins=ALLOWED_ORIGINS,
+    http_compression=True,
+    compression_threshold=compression.HTTP_GZIP_MIN_SIZE,
+)
 
 # Initialize FastAPI app
 app = FastAPI(title="MindMap API", version="1.0.0")
@@ -37,21 +60,191 @@ app.add_middleware(
     allow_headers=['*'],
 )
 
+# Compress REST responses above a size threshold
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=compression.HTTP_GZIP_MIN_SIZE,
+    compresslevel=compression.HTTP_GZIP_LEVEL,
+)
+
 # Wrap FastAPI with Socket.IO ASGI app
 asgi_app = ASGIApp(sio, other_asgi_app=app)
 
+# Per-client token buckets and bounded per-room broadcast queues
+rate_limiter = RateLimiter()
+outbox = RoomOutbox(sio)
+
+# Which instance owns each session (see SHARD_* settings)
+router = ShardRouter.from_env()
+
+# Serialized, batched mutations per session; only the owner may write one
+mutations = MutationQueue(AsyncSessionLocal, fence=router.accepts)
+
+# Which session each node/edge belongs to, so handlers can skip the lookup
+membership = MembershipCache()
+
+
+def session_has_members(session_id):
+    """Whether any client is currently in the session's room"""
+    return bool(sio.manager.rooms.get('/', {}).get(f"session_{session_id}"))
+
+
+# Lifecycle of per-session in-memory data (loaded on join, evicted when idle)
+residency = SessionResidency(session_has_members)
+boards = residency.register(BoardCache(mutations, crud.load_compact_board))
+journals = residency.register(JournalStore())
+# Collaborative node text, materialized to Node.content in the background
+texts = residency.register(TextDocuments(
+    mutations,
+    boards,
+    lambda db, node_id, content: crud.update_node_partial(db, node_id, {'content': content}, commit=False),
+))
+
+
+def session_is_active(session_id):
+    """Whether a session is resident or has clients connected"""
+    return residency.is_resident(session_id) or session_has_members(session_id)
+
+
+# Moves cold sessions out of the hot tables (ARCHIVE_AFTER_DAYS > 0 enables the job);
+# sessions owned by another instance are left to that instance
+archiver = SessionArchiver(AsyncSessionLocal, mutations, lambda s: session_is_active(s) or not router.owns(s))
+
+# Board previews, re-rendered lazily once a mutation makes them stale
+thumbnails = ThumbnailCache()
+
+
+async def is_rate_limited(sid, event, notify=True):
+    """Consume a token for `event`; tell the client if it has none left"""
+    if rate_limiter.allow(sid, event):
+        return False
+    if notify:
+        await sio.emit('error', {'message': f'Rate limit exceeded for {event}', 'event': event}, to=sid)
+    return True
+
+
+async def redirect_if_elsewhere(sid, session_id):
+    """Point the client at the instance owning the session; True if that is not us"""
+    hint = router.redirect(session_id)
+    if hint is None:
+        # A session that just moved here is writable once the old owner let go
+        delay = router.handoff_delay(session_id)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return False
+    await sio.emit('session_redirect', hint, to=sid)
+    return True
+
+
+def owner_redirect(session_id, request):
+    """Redirect a REST request for a session owned by another instance, None if it is ours"""
+    hint = router.redirect(session_id)
+    if hint is None:
+        return None
+    if not hint['url']:
+        raise HTTPException(status_code=503, detail=f"Session is served by instance {hint['instance']}")
+    query = f'?{request.url.query}' if request.url.query else ''
+    return RedirectResponse(f"{hint['url']}{request.url.path}{query}", status_code=307)
+
+
+async def release_moved_sessions():
+    """Hand off resident sessions another instance owns after a ring change"""
+    released = 0
+    # Sessions that moved away may be archived by their new owner
+    archiver.forget_unarchived()
+    for session_id in residency.sessions():
+        hint = router.redirect(session_id)
+        if hint is None:
+            continue
+        room = f'session_{session_id}'
+        await sio.emit('session_redirect', hint, room=room)
+        await sio.close_room(room)
+        await residency.evict(session_id, force=True)
+        released += 1
+    return released
+
+
+async def broadcast(session_id, event, data, skip_sid=None, merge_key=None, droppable=False):
+    """Queue a broadcast to everyone in a session room"""
+    room = f"session_{session_id}"
+    # Every committed change passes through here: journal it for clients that
+    # resume after a disconnect and keep the resident board in sync. Presence
+    # (cursors) changes no state and goes straight to the outbox.
+    if event in JOURNALED_EVENTS:
+        residency.touch(session_id)
+        seq = journals.append(session_id, event, data)
+        if seq is not None:
+            data = {**data, 'seq': seq}
+        boards.apply_event(session_id, event, data)
+        texts.apply_event(session_id, event, data)
+        membership.apply_event(session_id, event, data)
+        if event != 'node_text_edited':
+            thumbnails.invalidate(session_id)
+    await outbox.emit(event, data, room=room, skip_sid=skip_sid, merge_key=merge_key, droppable=droppable)
+
 
 # Initialize database tables on startup
 @app.on_event("startup")
 async def init_database():
-    """Create database tables if they don't exist"""
+    """Bootstrap the schema (see SCHEMA_BOOTSTRAP) and warm the pool in the background"""
     try:
-        async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
-        print("✅ Database tables initialized successfully!")
+        if await database.ensure_schema():
+            print("✅ Database tables initialized successfully!")
+        else:
+            print("✅ Skipped create_all (SCHEMA_BOOTSTRAP)")
     except Exception as e:
         print(f"⚠️  Database initialization warning: {e}")
         # Don't fail startup if tables already exist
+    # Keep a reference: the loop only holds tasks weakly
+    app.state.warm_pool_task = asyncio.create_task(database.warm_pool())
+
+
+@app.on_event("startup")
+async def start_residency_sweeper():
+    """Evict idle sessions in the background"""
+    app.state.residency_task = asyncio.create_task(residency.run())
+
+
+@app.on_event("startup")
+async def start_text_materializer():
+    """Write collaboratively edited node text back to the database"""
+    app.state.text_task = asyncio.create_task(texts.run())
+
+
+@app.on_event("startup")
+async def start_shard_membership():
+    """Join the shard ring through heartbeats (SHARD_MEMBERSHIP=db)"""
+    if router.dynamic:
+        try:
+            await router.refresh(AsyncSessionLocal)
+        except Exception as e:
+            print(f"⚠️  Shard heartbeat failed: {e}")
+        app.state.shard_task = asyncio.create_task(router.run(AsyncSessionLocal, release_moved_sessions))
+    print(f"✅ Shard instance {router.instance_id} of {sorted(router.instances)}")
+
+
+@app.on_event("startup")
+async def start_archiver():
+    """Archive cold sessions in the background"""
+    if archiver.after_days > 0:
+        app.state.archiver_task = asyncio.create_task(archiver.run())
+
+
+@app.on_event("shutdown")
+async def flush_resident_sessions():
+    """Flush dirty per-session state before the process exits"""
+    app.state.residency_task.cancel()
+    app.state.text_task.cancel()
+    if router.dynamic:
+        app.state.shard_task.cancel()
+        try:
+            await router.leave(AsyncSessionLocal)
+        except Exception as e:
+            print(f"⚠️  Failed to leave the shard ring: {e}")
+    await residency.close()
+    # Journal files are written behind in the I/O pool
+    await journals.close()
+    offloader.shutdown()
 
 
 # ==================== REST API ENDPOINTS ====================
@@ -64,7 +257,9 @@ async def root():
         'version': '1.0.0',
         'endpoints': {
             'sessions': '/api/sessions',
-            'health': '/health'
+            'health': '/health',
+            'thumbnail': '/api/sessions/{session_id}/thumbnail',
+            'metrics': '/metrics'
         }
     }
 
@@ -75,6 +270,24 @@ async def health_check():
     return {'status': 'healthy'}
 
 
+@app.get('/metrics')
+async def metrics():
+    """Rate limiting, queue, sharding, cache, residency, text, archive, executor and thumbnail counters"""
+    return {
+        'rate_limiter': rate_limiter.stats(),
+        'deferred_updates': deferred_updates.stats(),
+        'outbox': outbox.stats(),
+        'mutations': mutations.stats(),
+        'sharding': router.stats(),
+        'membership': membership.stats(),
+        'residency': residency.stats(),
+        'text': texts.stats(),
+        'archive': archiver.stats(),
+        'offload': offloader.stats(),
+        'thumbnails': thumbnails.stats(),
+    }
+
+
 class CreateSessionReq(BaseModel):
     title: str
 
@@ -88,8 +301,14 @@ async def create_session(req: CreateSessionReq):
 
 
 @app.get('/api/sessions/{session_id}')
-async def get_session(session_id: int):
+async def get_session(session_id: int, request: Request):
     """Get session details"""
+    # Only the owner may restore (write) the session
+    redirect = owner_redirect(session_id, request)
+    if redirect is not None:
+        return redirect
+    # Bring an archived session back into the hot tables
+    await archiver.restore(session_id)
     async with AsyncSessionLocal() as db:
         session = await crud.get_session(db, session_id)
         if not session:
@@ -97,6 +316,54 @@ async def get_session(session_id: int):
         return schemas.Session.model_validate(session).model_dump(mode='json')
 
 
+@app.get('/api/sessions/{session_id}/changes')
+async def get_session_changes(session_id: int, epoch: str, after: int, request: Request):
+    """Journaled changes after sequence number `after`; 410 if the client must reload"""
+    # The journal lives on the owning instance
+    redirect = owner_redirect(session_id, request)
+    if redirect is not None:
+        return redirect
+    events = journals.since(session_id, epoch, after)
+    if events is None:
+        raise HTTPException(status_code=410, detail="Changes are no longer available, reload the session")
+    return {'journal': journals.position(session_id), 'events': events}
+
+
+async def load_thumbnail_board(session_id):
+    """Snapshot of a board for rendering, without making the session resident"""
+    board = boards.get(session_id)
+    if board is not None:
+        return board.snapshot()
+    async with AsyncSessionLocal() as db:
+        if not await crud.get_session(db, session_id):
+            return None
+        # Archived boards are rendered straight from the archive; a preview must not restore them
+        archived = await crud.load_archived_board(db, session_id)
+        if archived is not None:
+            return archived
+        return await crud.load_compact_board(db, session_id)
+
+
+@app.get('/api/sessions/{session_id}/thumbnail')
+async def get_session_thumbnail(session_id: int, request: Request):
+    """SVG preview of a session's board"""
+    # The owner has the live board and the up-to-date cached preview
+    redirect = owner_redirect(session_id, request)
+    if redirect is not None:
+        return redirect
+    try:
+        thumbnail = await thumbnails.get(session_id, load_thumbnail_board)
+    except OffloadError as e:
+        raise HTTPException(status_code=503, detail=f"Thumbnail unavailable: {e}")
+    if thumbnail is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    etag, svg = thumbnail
+    headers = {'ETag': etag, 'Cache-Control': f'max-age={int(thumbnails.debounce)}'}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=svg, media_type='image/svg+xml', headers=headers)
+
+
 @app.get('/api/sessions')
 async def list_sessions():
     """List all sessions"""
@@ -116,22 +383,85 @@ async def connect(sid, environ):
 @sio.event
 async def disconnect(sid):
     """Handle client disconnection"""
+    rate_limiter.forget(sid)
+    deferred_updates.forget(sid)
+    # Abandon CPU/IO jobs nobody is waiting for anymore
+    offloader.cancel_owner(sid)
     print(f'❌ Client disconnected: {sid}')
 
 
+async def send_initial_state_chunks(sid, session_id, chunks, total_nodes, total_edges, gzip=False, journal=None):
+    """
+    Emit `initial_state_chunk` messages from an async iterator of (nodes, edges).
+    Each message carries its sequence number, the totals, the journal position
+    the stream started at and the text revision of nodes being edited (their
+    `node_text_edited` events up to it are already in the chunk); the last
+    has done=True.
+    """
+    seq = 0
+    pending = None
+    
+    async def emit(nodes, edges, done):
+        payload = {
+            'seq': seq,
+            'total_nodes': total_nodes,
+            'total_edges': total_edges,
+            'nodes': nodes,
+            'edges': edges,
+            'done': done,
+            'journal': journal,
+            # Stamped when sent: rows read earlier may predate recent text edits
+            'text_revisions': texts.stamp(session_id, nodes),
+        }
+        if gzip:
+            payload = compression.encode_payload(payload)
+        await sio.emit('initial_state_chunk', payload, to=sid)
+    
+    # Hold one chunk back so the final one can be flagged as done
+    async for chunk in chunks:
+        if pending is not None:
+            await emit(*pending, done=False)
+            seq += 1
+        pending = chunk
+    nodes, edges = pending if pending is not None else ([], [])
+    await emit(nodes, edges, done=True)
+
+
+async def warm_session(session_id):
+    """Make a session resident in the background"""
+    try:
+        await residency.acquire(session_id)
+    except Exception as e:
+        print(f'❌ Error loading session {session_id}: {e}')
+
+
 @sio.event
 async def join_session(sid, data):
     """
     Handle client joining a session
-    data: {session_id, user_id, user_name}
+    data: {session_id, user_id, user_name, accept_encoding?: ['gzip'],
+           stream?: bool, viewport?: {x, y, width, height},
+           resume?: {epoch, seq}}
+    
+    With `resume` (the journal position of a previous connection) the client
+    gets a `replay` of the changes it missed if they are still journaled.
+    With `stream` the state arrives as ordered `initial_state_chunk` messages,
+    nodes nearest the viewport first; otherwise as a single `initial_state`.
     """
+    if await is_rate_limited(sid, 'join_session'):
+        return
+    
     try:
         session_id = data.get('session_id')
         user_id = data.get('user_id')
         user_name = data.get('user_name')
+        gzip = compression.accepts_gzip(data.get('accept_encoding'))
         
         if not session_id:
-            await sio.emit('error', {'message': 'session_id is required'}, to=sid)
+            await sio.emit('error', {'message': 'session_id is required', 'event': 'join_session'}, to=sid)
+            return
+        
+        if await redirect_if_elsewhere(sid, session_id):
             return
         
         # Join the session room
@@ -143,18 +473,82 @@ async def join_session(sid, data):
             session = await crud.get_session(db, session_id)
             if not session:
                 # Auto-create session if it doesn't exist
-                session = Session(id=session_id, title=f'Session {session_id}')
-                db.add(session)
-                await db.commit()
-                # Update sequence to avoid conflicts with future auto-generated IDs
-                await db.execute(text(f"SELECT setval('sessions_id_seq', GREATEST({session_id}, (SELECT MAX(id) FROM sessions)))"))
-                await db.commit()
-                await db.refresh(session)
+                session = await crud.create_session_with_id(db, session_id, f'Session {session_id}')
                 print(f'✅ Auto-created session {session_id}')
+            else:
+                # Bring an archived session back into the hot tables
+                await archiver.restore(session_id)
+            membership.remember(SESSION, session_id, session_id)
             
-            # Get initial state and send to client
-            state = await crud.get_session_state(db, session_id)
-            await sio.emit('initial_state', state.model_dump(mode='json'), to=sid)
+            resume = data.get('resume') or {}
+            events = None
+            if resume:
+                # Restores the journal from JOURNAL_DIR after a worker restart
+                await residency.acquire(session_id)
+                events = journals.since(session_id, resume.get('epoch'), int(resume.get('seq', -1)))
+            
+            if events is not None:
+                # Recent reconnect: only send what the client missed
+                residency.touch(session_id)
+                await sio.emit('replay', {'journal': journals.position(session_id), 'events': events}, to=sid)
+            elif data.get('stream'):
+                center = state_stream.viewport_center(data.get('viewport'))
+                chunk_size = state_stream.INITIAL_STATE_CHUNK_SIZE
+                board = boards.get(session_id)
+                try:
+                    if board is not None:
+                        residency.touch(session_id)
+                        chunks = state_stream.board_chunks(board, center, chunk_size)
+                        total_nodes, total_edges = len(board.node_ids), len(board.edge_ids)
+                        journal = journals.position(session_id)
+                    else:
+                        # Not resident yet: stream straight from a DB cursor and
+                        # load the board afterwards instead of blocking on it. The
+                        # journal is loaded first: everything it handed out so far
+                        # is in the rows read after, so the client can resume later
+                        await journals.load(session_id)
+                        journal = journals.position(session_id)
+                        chunks = crud.stream_session_state(db, session_id, center, chunk_size)
+                        total_nodes, total_edges = await crud.count_session_rows(db, session_id)
+                    await send_initial_state_chunks(sid, session_id, chunks, total_nodes, total_edges, gzip=gzip, journal=journal)
+                finally:
+                    if board is None:
+                        # Residency takes over the journal loaded above, or
+                        # evicts it with the other components if loading fails
+                        asyncio.create_task(warm_session(session_id))
+            else:
+                # Load the session's in-memory data on first join and keep it
+                # resident while the state is encoded and sent
+                async with residency.pinned(session_id):
+                    # Get initial state and send to client, from the resident board if loaded
+                    board = boards.get(session_id)
+                    journal = journals.position(session_id)
+                    state = None
+                    if board is not None and gzip and len(board.node_ids) >= state_stream.OFFLOAD_MIN_NODES:
+                        # Big board: serialize and compress it in the process pool
+                        try:
+                            state = await state_stream.encode_board_state.offload(
+                                board.snapshot(), journal, texts.revisions(session_id), owner=sid)
+                        except OffloadCancelled:
+                            return
+                        except OffloadError as e:
+                            # Encoding it here instead would block the event loop
+                            # for as long as the pool is busy; the client retries
+                            print(f'⚠️  Initial state not encoded: {e}')
+                            await sio.emit('error', {
+                                'message': 'Server busy, please retry', 'event': 'join_session', 'retry': True,
+                            }, to=sid)
+                            return
+                    if state is None:
+                        if board is not None:
+                            state = board.to_wire()
+                        else:
+                            state = (await crud.get_session_state(db, session_id)).model_dump(mode='json')
+                        state['journal'] = journal
+                        state['text_revisions'] = texts.stamp(session_id, state['nodes'])
+                        if gzip:
+                            state = compression.encode_payload(state)
+                    await sio.emit('initial_state', state, to=sid)
         
         # Notify other users in the room
         await sio.emit('user_joined', {
@@ -166,7 +560,7 @@ async def join_session(sid, data):
         
     except Exception as e:
         print(f'❌ Error in join_session: {e}')
-        await sio.emit('error', {'message': str(e)}, to=sid)
+        await sio.emit('error', {'message': str(e), 'event': 'join_session'}, to=sid)
 
 
 @sio.event
@@ -183,6 +577,8 @@ async def leave_session(sid, data):
 
 
 # ==================== NODE OPERATIONS ====================
+# Mutations are applied through the session's mutation queue so operations on
+# one board are serialized and batched; broadcasts run once they commit.
 
 @sio.event
 async def node_create(sid, data):
@@ -190,6 +586,9 @@ async def node_create(sid, data):
     Create a new node
     data: {session_id, node: {content, x, y, width, height, style}}
     """
+    if await is_rate_limited(sid, 'node_create'):
+        return
+    
     try:
         session_id = data.get('session_id')
         node_data = data.get('node', {})
@@ -198,24 +597,27 @@ async def node_create(sid, data):
             await sio.emit('error', {'message': 'session_id is required'}, to=sid)
             return
         
-        async with AsyncSessionLocal() as db:
+        if await redirect_if_elsewhere(sid, session_id):
+            return
+        
+        node_create_schema = schemas.NodeCreate(**node_data)
+        
+        async def apply(db):
             # Verify session exists
-            session = await crud.get_session(db, session_id)
-            if not session:
-                await sio.emit('error', {'message': 'Session not found'}, to=sid)
-                return
-            
-            # Create node
-            node_create_schema = schemas.NodeCreate(**node_data)
-            node = await crud.create_node(db, session_id, node_create_schema)
-            node_schema = schemas.Node.model_validate(node)
-            
+            if not await membership.session_exists(db, session_id):
+                raise ValueError('Session not found')
+            node = await crud.create_node(db, session_id, node_create_schema, commit=False)
+            return schemas.Node.model_validate(node).model_dump(mode='json')
+        
+        async def on_commit(node):
             # Broadcast to all clients in the session
-            room = f"session_{session_id}"
-            await sio.emit('node_created', {'node': node_schema.model_dump(mode='json')}, room=room)
-            
-            print(f'✅ Node {node.id} created in session {session_id}')
-            
+            await broadcast(session_id, 'node_created', {'node': node})
+        
+        node = await mutations.submit(session_id, apply, on_commit)
+        print(f'✅ Node {node["id"]} created in session {session_id}')
+        
+    except ValueError as e:
+        await sio.emit('error', {'message': str(e)}, to=sid)
     except Exception as e:
         print(f'❌ Error in node_create: {e}')
         await sio.emit('error', {'message': str(e)}, to=sid)
@@ -227,45 +629,153 @@ async def node_update(sid, data):
     Update a node
     data: {session_id, node_id, patch: {x, y, content, width, height, style}}
     """
+    node_id = data.get('node_id')
+    if not rate_limiter.allow(sid, 'node_update'):
+        # Keep the latest dropped patch and apply it once tokens are back
+        if node_id:
+            deferred_updates.defer(sid, node_id, data, rate_limiter.retry_after(sid, 'node_update'))
+        return
+    # A patch dropped earlier is applied underneath this one
+    data = deferred_updates.merge_into(sid, node_id, data)
+    
     try:
         session_id = data.get('session_id')
-        node_id = data.get('node_id')
         patch = data.get('patch', {})
         
         if not session_id or not node_id:
             await sio.emit('error', {'message': 'session_id and node_id are required'}, to=sid)
             return
         
-        async with AsyncSessionLocal() as db:
-            # Verify node exists and belongs to session
-            node = await crud.get_node(db, node_id)
-            if not node or node.session_id != session_id:
-                await sio.emit('error', {'message': 'Node not found'}, to=sid)
+        if await redirect_if_elsewhere(sid, session_id):
+            return
+        
+        # Validate before the UPDATE: a bad value must never reach the row
+        patch = schemas.NodeUpdate(**patch).model_dump(exclude_unset=True)
+        
+        doc = texts.get(session_id, node_id)
+        if doc is not None and 'content' in patch:
+            # The node is being edited collaboratively: a whole-content patch
+            # becomes one more operation on its document
+            patch = dict(patch)
+            content = patch.pop('content') or ''
+            revision, op = texts.edit(session_id, node_id, doc.revision, text_sync.replace(doc.text, content))
+            await broadcast(session_id, 'node_text_edited', {'node_id': node_id, 'revision': revision, 'op': op, 'origin': sid})
+            if not patch:
                 return
-            
-            # Update node
-            updated_node = await crud.update_node_partial(db, node_id, patch)
+        
+        async def apply(db):
+            # A node cached in another session fails fast; otherwise the
+            # session-scoped UPDATE is the membership check
+            if membership.cached(NODE, node_id) not in (None, session_id):
+                raise ValueError('Node not found')
+            updated_node = await crud.update_node_partial(db, node_id, patch, commit=False, session_id=session_id)
             if not updated_node:
-                await sio.emit('error', {'message': 'Failed to update node'}, to=sid)
-                return
-            
-            node_schema = schemas.Node.model_validate(updated_node)
-            
-            # Broadcast to all clients in the session
-            room = f"session_{session_id}"
-            await sio.emit('node_updated', {'node': node_schema.model_dump(mode='json')}, room=room)
-            
+                raise ValueError('Node not found')
+            return schemas.Node.model_validate(updated_node).model_dump(mode='json')
+        
+        async def on_commit(node):
+            # Broadcast to all clients in the session; queued updates of the
+            # same node are merged so slow rooms only get the latest state
+            # Stored content may lag behind an open document; send the live text
+            await broadcast(session_id, 'node_updated', {'node': texts.overlay(session_id, node)}, merge_key=node_id)
+        
+        await mutations.submit(session_id, apply, on_commit)
+        
+    except ValueError as e:
+        await sio.emit('error', {'message': str(e)}, to=sid)
     except Exception as e:
         print(f'❌ Error in node_update: {e}')
         await sio.emit('error', {'message': str(e)}, to=sid)
 
 
+# Latest rate-limited node_update of each (client, node), replayed through the handler
+deferred_updates = DeferredPatches(node_update)
+
+
+async def send_text_state(sid, session_id, node_id):
+    """Send a client the current text and revision of a node's document"""
+    doc = texts.open(session_id, node_id)
+    await sio.emit('node_text_state', {'node_id': node_id, 'revision': doc.revision, 'content': doc.text}, to=sid)
+
+
+@sio.event
+async def node_text_open(sid, data):
+    """
+    Start editing a node's text; the client gets `node_text_state`
+    data: {session_id, node_id}
+    """
+    try:
+        session_id = data.get('session_id')
+        node_id = data.get('node_id')
+        
+        if not session_id or not node_id:
+            await sio.emit('error', {'message': 'session_id and node_id are required'}, to=sid)
+            return
+        
+        if await redirect_if_elsewhere(sid, session_id):
+            return
+        
+        await residency.acquire(session_id)
+        await send_text_state(sid, session_id, node_id)
+        
+    except ValueError as e:
+        await sio.emit('error', {'message': str(e)}, to=sid)
+    except Exception as e:
+        print(f'❌ Error in node_text_open: {e}')
+        await sio.emit('error', {'message': str(e)}, to=sid)
+
+
+@sio.event
+async def node_text_edit(sid, data):
+    """
+    Apply a collaborative edit to a node's text
+    data: {session_id, node_id, revision, op}
+    
+    `op` is based on document revision `revision`. It is transformed against
+    concurrent edits and broadcast to the whole room as `node_text_edited`
+    with the new revision; the sender recognizes its own edit by `origin`.
+    A client whose revision is too old gets `node_text_state` to start over.
+    """
+    if await is_rate_limited(sid, 'node_text_edit', notify=False):
+        return
+    
+    try:
+        session_id = data.get('session_id')
+        node_id = data.get('node_id')
+        
+        if not session_id or not node_id:
+            await sio.emit('error', {'message': 'session_id and node_id are required'}, to=sid)
+            return
+        
+        if await redirect_if_elsewhere(sid, session_id):
+            return
+        
+        await residency.acquire(session_id)
+        try:
+            revision, op = texts.edit(session_id, node_id, data.get('revision'), data.get('op'))
+        except ValueError as e:
+            print(f'⚠️  Rejected text edit of node {node_id}: {e}')
+            await send_text_state(sid, session_id, node_id)
+            return
+        
+        await broadcast(session_id, 'node_text_edited', {'node_id': node_id, 'revision': revision, 'op': op, 'origin': sid})
+        
+    except ValueError as e:
+        await sio.emit('error', {'message': str(e)}, to=sid)
+    except Exception as e:
+        print(f'❌ Error in node_text_edit: {e}')
+        await sio.emit('error', {'message': str(e)}, to=sid)
+
+
 @sio.event
 async def node_delete(sid, data):
     """
     Delete a node
     data: {session_id, node_id}
     """
+    if await is_rate_limited(sid, 'node_delete'):
+        return
+    
     try:
         session_id = data.get('session_id')
         node_id = data.get('node_id')
@@ -274,25 +784,27 @@ async def node_delete(sid, data):
             await sio.emit('error', {'message': 'session_id and node_id are required'}, to=sid)
             return
         
-        async with AsyncSessionLocal() as db:
-            # Verify node exists and belongs to session
-            node = await crud.get_node(db, node_id)
-            if not node or node.session_id != session_id:
-                await sio.emit('error', {'message': 'Node not found'}, to=sid)
-                return
-            
-            # Delete node (cascade will delete edges)
-            success = await crud.delete_node(db, node_id)
-            if not success:
-                await sio.emit('error', {'message': 'Failed to delete node'}, to=sid)
-                return
-            
+        if await redirect_if_elsewhere(sid, session_id):
+            return
+        
+        async def apply(db):
+            # A node cached in another session fails fast; otherwise the
+            # session-scoped DELETE is the membership check
+            if membership.cached(NODE, node_id) not in (None, session_id):
+                raise ValueError('Node not found')
+            # Delete the node and its edges
+            if not await crud.delete_node(db, node_id, commit=False, session_id=session_id):
+                raise ValueError('Node not found')
+        
+        async def on_commit(_):
             # Broadcast to all clients in the session
-            room = f"session_{session_id}"
-            await sio.emit('node_deleted', {'node_id': node_id}, room=room)
-            
-            print(f'✅ Node {node_id} deleted from session {session_id}')
-            
+            await broadcast(session_id, 'node_deleted', {'node_id': node_id})
+        
+        await mutations.submit(session_id, apply, on_commit)
+        print(f'✅ Node {node_id} deleted from session {session_id}')
+        
+    except ValueError as e:
+        await sio.emit('error', {'message': str(e)}, to=sid)
     except Exception as e:
         print(f'❌ Error in node_delete: {e}')
         await sio.emit('error', {'message': str(e)}, to=sid)
@@ -306,6 +818,9 @@ async def edge_create(sid, data):
     Create a new edge
     data: {session_id, edge: {source_id, target_id}}
     """
+    if await is_rate_limited(sid, 'edge_create'):
+        return
+    
     try:
         session_id = data.get('session_id')
         edge_data = data.get('edge', {})
@@ -314,24 +829,25 @@ async def edge_create(sid, data):
             await sio.emit('error', {'message': 'session_id is required'}, to=sid)
             return
         
-        async with AsyncSessionLocal() as db:
+        if await redirect_if_elsewhere(sid, session_id):
+            return
+        
+        edge_create_schema = schemas.EdgeCreate(**edge_data)
+        
+        async def apply(db):
             # Verify session exists
-            session = await crud.get_session(db, session_id)
-            if not session:
-                await sio.emit('error', {'message': 'Session not found'}, to=sid)
-                return
-            
-            # Create edge
-            edge_create_schema = schemas.EdgeCreate(**edge_data)
-            edge = await crud.create_edge(db, session_id, edge_create_schema)
-            edge_schema = schemas.Edge.model_validate(edge)
-            
+            if not await membership.session_exists(db, session_id):
+                raise ValueError('Session not found')
+            edge = await crud.create_edge(db, session_id, edge_create_schema, commit=False)
+            return schemas.Edge.model_validate(edge).model_dump(mode='json')
+        
+        async def on_commit(edge):
             # Broadcast to all clients in the session
-            room = f"session_{session_id}"
-            await sio.emit('edge_created', {'edge': edge_schema.model_dump(mode='json')}, room=room)
-            
-            print(f'✅ Edge {edge.id} created in session {session_id}')
-            
+            await broadcast(session_id, 'edge_created', {'edge': edge})
+        
+        edge = await mutations.submit(session_id, apply, on_commit)
+        print(f'✅ Edge {edge["id"]} created in session {session_id}')
+        
     except ValueError as e:
         # Handle validation errors (duplicate edge, nodes not found, etc.)
         await sio.emit('error', {'message': str(e)}, to=sid)
@@ -346,6 +862,9 @@ async def edge_delete(sid, data):
     Delete an edge
     data: {session_id, edge_id}
     """
+    if await is_rate_limited(sid, 'edge_delete'):
+        return
+    
     try:
         session_id = data.get('session_id')
         edge_id = data.get('edge_id')
@@ -354,25 +873,26 @@ async def edge_delete(sid, data):
             await sio.emit('error', {'message': 'session_id and edge_id are required'}, to=sid)
             return
         
-        async with AsyncSessionLocal() as db:
-            # Verify edge exists and belongs to session
-            edge = await crud.get_edge(db, edge_id)
-            if not edge or edge.session_id != session_id:
-                await sio.emit('error', {'message': 'Edge not found'}, to=sid)
-                return
-            
-            # Delete edge
-            success = await crud.delete_edge(db, edge_id)
-            if not success:
-                await sio.emit('error', {'message': 'Failed to delete edge'}, to=sid)
-                return
-            
+        if await redirect_if_elsewhere(sid, session_id):
+            return
+        
+        async def apply(db):
+            # An edge cached in another session fails fast; otherwise the
+            # session-scoped DELETE is the membership check
+            if membership.cached(EDGE, edge_id) not in (None, session_id):
+                raise ValueError('Edge not found')
+            if not await crud.delete_edge(db, edge_id, commit=False, session_id=session_id):
+                raise ValueError('Edge not found')
+        
+        async def on_commit(_):
             # Broadcast to all clients in the session
-            room = f"session_{session_id}"
-            await sio.emit('edge_deleted', {'edge_id': edge_id}, room=room)
-            
-            print(f'✅ Edge {edge_id} deleted from session {session_id}')
-            
+            await broadcast(session_id, 'edge_deleted', {'edge_id': edge_id})
+        
+        await mutations.submit(session_id, apply, on_commit)
+        print(f'✅ Edge {edge_id} deleted from session {session_id}')
+        
+    except ValueError as e:
+        await sio.emit('error', {'message': str(e)}, to=sid)
     except Exception as e:
         print(f'❌ Error in edge_delete: {e}')
         await sio.emit('error', {'message': str(e)}, to=sid)
@@ -386,14 +906,17 @@ async def cursor_move(sid, data):
     Track user cursor position
     data: {session_id, user_id, user_name, x, y}
     """
+    if await is_rate_limited(sid, 'cursor_move', notify=False):
+        return
+    
     try:
         session_id = data.get('session_id')
         if not session_id:
             return
         
-        room = f"session_{session_id}"
-        # Broadcast cursor position to other users (excluding sender)
-        await sio.emit('cursor_moved', data, room=room, skip_sid=sid)
+        # Broadcast cursor position to other users (excluding sender); stale
+        # positions are merged per client and dropped first under load
+        await broadcast(session_id, 'cursor_moved', data, skip_sid=sid, merge_key=sid, droppable=True)
         
     except Exception as e:
         print(f'❌ Error in cursor_move: {e}')
@@ -402,4 +925,4 @@ async def cursor_move(sid, data):
 # Run the application
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(asgi_app, host="0.0.0.0", port=8000, log_level="info")
+    uvicorn.run(asgi_app, host="0.0.0.0", port=8000, log_level="info", ws_per_message_deflate=False)
@@ -0,0 +1,162 @@
+"""
+Read-through cache of session existence and node/edge -> session membership.
+
+Socket handlers verify that a session exists, or that a node or edge belongs
+to the session a client names, before every mutation. Ids are never reused
+and rows never move between sessions, so the answers only change when a row
+is deleted. Entries live for MEMBERSHIP_TTL seconds and are dropped when the
+row is deleted. A stale positive entry (an edge removed along with its node,
+a session archived meanwhile) is harmless: the mutation itself finds no row
+and fails. Updates and deletes only consult `cached` to reject rows known to
+be elsewhere; their session-scoped UPDATE/DELETE is the real check.
+
+With several workers, each invalidation is also handed to the callbacks
+registered with `subscribe`, as a JSON-serializable message. Deliver it to
+the other workers' `apply_invalidation` through any channel (pub/sub, ...).
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import select
+
+try:
+    from . import models
+except ImportError:
+    import models
+
+MEMBERSHIP_TTL = float(os.getenv("MEMBERSHIP_TTL", "300"))
+MEMBERSHIP_MAX_ENTRIES = int(os.getenv("MEMBERSHIP_MAX_ENTRIES", "100000"))
+
+SESSION = 'session'
+NODE = 'node'
+EDGE = 'edge'
+
+_OWNER_COLUMNS = {
+    SESSION: models.Session.id,
+    NODE: models.Node.session_id,
+    EDGE: models.Edge.session_id,
+}
+_ID_COLUMNS = {
+    SESSION: models.Session.id,
+    NODE: models.Node.id,
+    EDGE: models.Edge.id,
+}
+
+
+class MembershipCache:
+    """TTL + LRU cache of `(kind, id) -> session_id` with read-through lookups"""
+
+    def __init__(
+        self,
+        ttl: float = MEMBERSHIP_TTL,
+        max_entries: int = MEMBERSHIP_MAX_ENTRIES,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # (kind, id) -> (session_id, expires)
+        self._subscribers: List[Callable[[Dict[str, Any]], None]] = []
+        self.counters = {'hits': 0, 'misses': 0, 'invalidations': 0, 'remote_invalidations': 0}
+
+    # ==================== LOOKUPS ====================
+
+    def _get(self, kind: str, key: int) -> Optional[int]:
+        entry = self._entries.get((kind, key))
+        if entry is None:
+            return None
+        session_id, expires = entry
+        if expires <= self.clock():
+            del self._entries[(kind, key)]
+            return None
+        self._entries.move_to_end((kind, key))
+        return session_id
+
+    def cached(self, kind: str, key: int) -> Optional[int]:
+        """Session of a row if the cache knows it, without touching the database"""
+        session_id = self._get(kind, key)
+        if session_id is not None:
+            self.counters['hits'] += 1
+        return session_id
+
+    async def _lookup(self, db, kind: str, key: int) -> Optional[int]:
+        """Session id of `kind` row `key`, from the cache or the database"""
+        session_id = self._get(kind, key)
+        if session_id is not None:
+            self.counters['hits'] += 1
+            return session_id
+        self.counters['misses'] += 1
+        session_id = await db.scalar(select(_OWNER_COLUMNS[kind]).where(_ID_COLUMNS[kind] == key))
+        if session_id is not None:
+            self.remember(kind, key, session_id)
+        return session_id
+
+    async def session_exists(self, db, session_id: int) -> bool:
+        return await self._lookup(db, SESSION, session_id) is not None
+
+    async def node_session(self, db, node_id: int) -> Optional[int]:
+        """Session of a node, or None if it does not exist"""
+        return await self._lookup(db, NODE, node_id)
+
+    async def edge_session(self, db, edge_id: int) -> Optional[int]:
+        """Session of an edge, or None if it does not exist"""
+        return await self._lookup(db, EDGE, edge_id)
+
+    def remember(self, kind: str, key: int, session_id: int) -> None:
+        """Cache a row known to exist, e.g. right after creating it"""
+        self._entries[(kind, key)] = (session_id, self.clock() + self.ttl)
+        self._entries.move_to_end((kind, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # ==================== INVALIDATION ====================
+
+    def _drop(self, kind: str, key: int) -> None:
+        if kind == SESSION:
+            # The session's nodes and edges go with it
+            for entry_key in [k for k, (owner, _) in self._entries.items() if owner == key]:
+                del self._entries[entry_key]
+        self._entries.pop((kind, key), None)
+
+    def invalidate(self, kind: str, key: int) -> None:
+        """Forget a deleted row here and tell the other workers"""
+        self._drop(kind, key)
+        self.counters['invalidations'] += 1
+        message = {'kind': kind, 'id': key}
+        for callback in self._subscribers:
+            try:
+                callback(message)
+            except Exception as e:
+                print(f'⚠️  Membership invalidation hook failed: {e}')
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], None]) -> None:
+        """Register a callback that publishes invalidations to other workers"""
+        self._subscribers.append(callback)
+
+    def apply_invalidation(self, message: Dict[str, Any]) -> None:
+        """Apply an invalidation published by another worker"""
+        kind, key = message.get('kind'), message.get('id')
+        if kind in _OWNER_COLUMNS and isinstance(key, int):
+            self._drop(kind, key)
+            self.counters['remote_invalidations'] += 1
+
+    def apply_event(self, session_id: int, event: str, data: Dict[str, Any]) -> None:
+        """Keep the cache in sync with a committed broadcast event"""
+        if event == 'node_created':
+            self.remember(NODE, data['node']['id'], session_id)
+        elif event == 'edge_created':
+            self.remember(EDGE, data['edge']['id'], session_id)
+        elif event == 'node_deleted':
+            self.invalidate(NODE, data['node_id'])
+        elif event == 'edge_deleted':
+            self.invalidate(EDGE, data['edge_id'])
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counters['hits'] + self.counters['misses']
+        return {
+            'entries': len(self._entries),
+            **self.counters,
+            'hit_ratio': self.counters['hits'] / lookups if lookups else 0.0,
+        }
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, JSON, Text, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, JSON, Text, DateTime, LargeBinary
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
@@ -51,3 +51,25 @@ class Edge(Base):
     session = relationship("Session", back_populates="edges")
     source_node = relationship("Node", foreign_keys=[source_id], back_populates="source_edges")
     target_node = relationship("Node", foreign_keys=[target_id], back_populates="target_edges")
+
+
+class SessionArchive(Base):
+    """Cold session moved out of the nodes/edges tables as one compressed blob"""
+    __tablename__ = 'session_archives'
+    
+    session_id = Column(Integer, ForeignKey('sessions.id', ondelete='CASCADE'), primary_key=True)
+    # zlib-compressed JSON: {"nodes": [[id, content, x, y, width, height, style, created_at, updated_at], ...],
+    #                        "edges": [[id, source_id, target_id, created_at], ...]}
+    payload = Column(LargeBinary, nullable=False)
+    node_count = Column(Integer, nullable=False, default=0)
+    edge_count = Column(Integer, nullable=False, default=0)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class ShardInstance(Base):
+    """Backend instance taking part in session sharding (SHARD_MEMBERSHIP=db)"""
+    __tablename__ = 'shard_instances'
+    
+    instance_id = Column(String, primary_key=True)
+    url = Column(String, nullable=False, default='')
+    heartbeat_at = Column(DateTime(timezone=True), nullable=False, index=True)
@@ -0,0 +1,189 @@
+"""
+Per-session serialized mutation queue.
+
+Every mutation for a session is appended to that session's mailbox and
+executed by a single worker coroutine, so operations on one board never race
+each other while different boards still run in parallel. Consecutive queued
+operations are applied in one transaction and their `on_commit` callbacks
+(normally the room broadcast) run in submission order once it commits.
+
+An optional `fence` decides whether this process may still write a session
+(see `ShardRouter.accepts`). It is checked on submit and again right before
+each commit, so an instance that lost a session stops writing it.
+"""
+import asyncio
+import os
+from collections import deque
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Deque, Dict, Optional
+
+from pydantic import ValidationError
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+MUTATION_BATCH_SIZE = int(os.getenv("MUTATION_BATCH_SIZE", "64"))
+
+ApplyFn = Callable[["AsyncSession"], Awaitable[Any]]
+CommitFn = Callable[[Any], Awaitable[None]]
+
+
+class SessionMoved(Exception):
+    """The session is owned by another instance; nothing was written"""
+
+    def __init__(self, session_id: int):
+        super().__init__(f'Session {session_id} is served by another instance')
+        self.session_id = session_id
+
+
+class _Mutation:
+    __slots__ = ('apply', 'on_commit', 'future')
+
+    def __init__(self, apply: ApplyFn, on_commit: Optional[CommitFn], future: asyncio.Future):
+        self.apply = apply
+        self.on_commit = on_commit
+        self.future = future
+
+
+class MutationQueue:
+    """Serializes mutations per session and batches them into transactions"""
+
+    def __init__(
+        self,
+        session_factory,
+        batch_size: int = MUTATION_BATCH_SIZE,
+        fence: Optional[Callable[[int], bool]] = None,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.fence = fence
+        self._mailboxes: Dict[int, Deque[_Mutation]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self.counters = {'submitted': 0, 'transactions': 0, 'batched': 0, 'retried': 0, 'failed': 0, 'fenced': 0}
+
+    def _check_fence(self, session_id: int) -> None:
+        if self.fence is not None and not self.fence(session_id):
+            self.counters['fenced'] += 1
+            raise SessionMoved(session_id)
+
+    async def submit(self, session_id: int, apply: ApplyFn, on_commit: Optional[CommitFn] = None) -> Any:
+        """
+        Queue `apply(db)` for `session_id` and wait for its result.
+
+        `apply` must flush rather than commit; the queue owns the transaction.
+        Exceptions raised by `apply` are re-raised to the caller, and
+        SessionMoved if the fence refuses the session.
+        """
+        self._check_fence(session_id)
+        future = asyncio.get_running_loop().create_future()
+        mailbox = self._mailboxes.get(session_id)
+        if mailbox is None:
+            mailbox = self._mailboxes[session_id] = deque()
+        mailbox.append(_Mutation(apply, on_commit, future))
+        self.counters['submitted'] += 1
+
+        worker = self._workers.get(session_id)
+        if worker is None or worker.done():
+            self._workers[session_id] = asyncio.create_task(self._run(session_id, mailbox))
+        return await future
+
+    async def _run(self, session_id: int, mailbox: Deque[_Mutation]) -> None:
+        try:
+            while mailbox:
+                batch = [mailbox.popleft() for _ in range(min(self.batch_size, len(mailbox)))]
+                await self._execute(session_id, batch)
+        finally:
+            # No await between the emptiness check and the cleanup, so a
+            # concurrent submit either landed in this mailbox or starts anew
+            if not mailbox:
+                self._mailboxes.pop(session_id, None)
+                self._workers.pop(session_id, None)
+
+    async def _execute(self, session_id, batch) -> None:
+        """Apply a batch in one transaction, falling back to one per mutation"""
+        try:
+            self._check_fence(session_id)
+            outcomes = await self._transaction(session_id, batch) if len(batch) > 1 else None
+        except SessionMoved as e:
+            # Lost the session while the batch was queued: nothing was written
+            await self._settle(batch, [(False, e)] * len(batch))
+            return
+        if outcomes is not None:
+            self.counters['batched'] += len(batch)
+            await self._settle(batch, outcomes)
+            return
+        if len(batch) > 1:
+            # Something in the batch broke the transaction: isolate the
+            # failure by replaying each mutation in its own transaction
+            self.counters['retried'] += len(batch)
+
+        for mutation in batch:
+            await self._settle([mutation], [await self._attempt_alone(session_id, mutation)])
+
+    async def _transaction(self, session_id, batch):
+        """
+        Run `batch` in one transaction.
+
+        A ValueError is a validation failure raised before anything was
+        written (the crud convention), so it only fails its own mutation.
+        Pydantic's ValidationError is one too, but inside `apply` it comes
+        from reading back rows the mutation already wrote: it fails the
+        transaction, so the mutation is rolled back when replayed alone.
+        Returns None if the transaction itself failed.
+        """
+        outcomes = []
+        try:
+            async with self.session_factory() as db:
+                for mutation in batch:
+                    try:
+                        outcomes.append((True, await mutation.apply(db)))
+                    except ValidationError:
+                        raise
+                    except ValueError as e:
+                        outcomes.append((False, e))
+                self._check_fence(session_id)
+                await db.commit()
+        except SessionMoved:
+            raise
+        except Exception:
+            return None
+        self.counters['transactions'] += 1
+        return outcomes
+
+    async def _attempt_alone(self, session_id, mutation):
+        try:
+            async with self.session_factory() as db:
+                result = await mutation.apply(db)
+                self._check_fence(session_id)
+                await db.commit()
+        except Exception as e:
+            return (False, e)
+        self.counters['transactions'] += 1
+        return (True, result)
+
+    async def _settle(self, batch, outcomes) -> None:
+        for mutation, (ok, value) in zip(batch, outcomes):
+            if not ok:
+                self.counters['failed'] += 1
+                if not mutation.future.done():
+                    mutation.future.set_exception(value)
+                continue
+            if mutation.on_commit is not None:
+                try:
+                    await mutation.on_commit(value)
+                except Exception as e:
+                    print(f'❌ Error in mutation commit hook: {e}')
+            if not mutation.future.done():
+                mutation.future.set_result(value)
+
+    def depth(self, session_id: int) -> int:
+        mailbox = self._mailboxes.get(session_id)
+        return len(mailbox) if mailbox else 0
+
+    def stats(self) -> Dict[str, Any]:
+        depths = [len(m) for m in self._mailboxes.values()]
+        return {
+            'active_sessions': len(self._mailboxes),
+            'queued': sum(depths),
+            'max_depth': max(depths, default=0),
+            **self.counters,
+        }
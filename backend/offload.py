@@ -0,0 +1,200 @@
+"""
+Managed executors for work that must not run on the event loop.
+
+CPU-bound jobs go to a process pool and blocking I/O to a thread pool. Each
+pool has a bound on in-flight jobs (new jobs are rejected beyond it), every
+job has a timeout, jobs can be tied to an owner (a client sid) and cancelled
+when it disconnects, and per-job timings are kept for /metrics.
+
+Register a job with the decorator and call it through `.offload`:
+
+    @offloadable('cpu', timeout=10)
+    def encode(board): ...
+
+    data = await encode.offload(board, owner=sid)
+
+CPU jobs must be importable top-level functions with picklable arguments.
+Cancelling a job that already started only abandons its result; the worker
+still runs it to completion.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+
+OFFLOAD_PROCESS_WORKERS = int(os.getenv("OFFLOAD_PROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+OFFLOAD_THREAD_WORKERS = int(os.getenv("OFFLOAD_THREAD_WORKERS", "8"))
+OFFLOAD_MAX_PENDING = int(os.getenv("OFFLOAD_MAX_PENDING", "64"))
+OFFLOAD_TIMEOUT = float(os.getenv("OFFLOAD_TIMEOUT", "30"))
+
+CPU = 'cpu'
+IO = 'io'
+
+# name -> function of every job registered with @offloadable
+REGISTRY: Dict[str, Callable] = {}
+
+
+class OffloadError(Exception):
+    """Base class for offloaded jobs that did not produce a result"""
+
+
+class OffloadRejected(OffloadError):
+    """The pool already has its maximum number of jobs in flight"""
+
+
+class OffloadTimeout(OffloadError):
+    """The job did not finish within its timeout"""
+
+
+class OffloadCancelled(OffloadError):
+    """The job's owner went away before it finished"""
+
+
+class Offloader:
+    """Process and thread pools with bounded queues, timeouts and cancellation"""
+
+    def __init__(
+        self,
+        process_workers: int = OFFLOAD_PROCESS_WORKERS,
+        thread_workers: int = OFFLOAD_THREAD_WORKERS,
+        max_pending: int = OFFLOAD_MAX_PENDING,
+        timeout: float = OFFLOAD_TIMEOUT,
+    ):
+        self.workers = {CPU: process_workers, IO: thread_workers}
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pools: Dict[str, Executor] = {}
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._owned: Dict[Hashable, Set[asyncio.Future]] = {}
+        self._cancelled: Set[asyncio.Future] = set()
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+    def _pool(self, kind: str) -> Executor:
+        # Pools are created on first use to keep startup cheap
+        pool = self._pools.get(kind)
+        if pool is None:
+            if kind == CPU:
+                # spawn: forking a process that runs an event loop and threads is unsafe
+                pool = ProcessPoolExecutor(self.workers[CPU], mp_context=multiprocessing.get_context('spawn'))
+            elif kind == IO:
+                pool = ThreadPoolExecutor(self.workers[IO], thread_name_prefix='offload-io')
+            else:
+                raise ValueError(f"Unknown offload kind: {kind}")
+            self._pools[kind] = pool
+        return pool
+
+    async def run(
+        self,
+        kind: str,
+        fn: Callable,
+        *args: Any,
+        timeout: Optional[float] = None,
+        owner: Optional[Hashable] = None,
+        name: Optional[str] = None,
+    ) -> Any:
+        """Run `fn(*args)` in the `kind` pool and wait for its result"""
+        name = name or fn.__qualname__
+        if self._pending[kind] >= self.max_pending:
+            self.counters['rejected'] += 1
+            raise OffloadRejected(f"Too many {kind} jobs in flight")
+
+        loop = asyncio.get_running_loop()
+        job = self._pool(kind).submit(fn, *args)
+        # The slot is held until a worker is done with the job, not until we
+        # stop waiting: a job that timed out still occupies its worker
+        self._pending[kind] += 1
+        job.add_done_callback(lambda _: self._release(loop, kind))
+        future = asyncio.wrap_future(job, loop=loop)
+        self.counters['submitted'] += 1
+        if owner is not None:
+            self._owned.setdefault(owner, set()).add(future)
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(future, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            raise OffloadTimeout(f"{name} timed out") from None
+        except asyncio.CancelledError:
+            if future in self._cancelled:
+                self.counters['cancelled'] += 1
+                raise OffloadCancelled(f"{name} was cancelled") from None
+            raise
+        except Exception:
+            self.counters['failed'] += 1
+            raise
+        finally:
+            self._cancelled.discard(future)
+            owned = self._owned.get(owner)
+            if owned is not None:
+                owned.discard(future)
+                if not owned:
+                    del self._owned[owner]
+        self.counters['completed'] += 1
+        self._record(name, time.perf_counter() - started)
+        return result
+
+    def _release(self, loop: asyncio.AbstractEventLoop, kind: str) -> None:
+        # Runs in the pool's thread, or right away if the job already finished
+        try:
+            loop.call_soon_threadsafe(self._free_slot, kind)
+        except RuntimeError:
+            pass  # the loop is closed
+
+    def _free_slot(self, kind: str) -> None:
+        self._pending[kind] -= 1
+
+    def _record(self, name: str, elapsed: float) -> None:
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+        timing['count'] += 1
+        timing['total_seconds'] += elapsed
+        timing['max_seconds'] = max(timing['max_seconds'], elapsed)
+
+    def cancel_owner(self, owner: Hashable) -> int:
+        """Cancel every job started on behalf of `owner`; returns how many"""
+        futures = self._owned.pop(owner, ())
+        for future in futures:
+            if future.cancel():
+                self._cancelled.add(future)
+        return len(futures)
+
+    def shutdown(self) -> None:
+        for pool in self._pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._pools.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pending': dict(self._pending),
+            'owners': len(self._owned),
+            **self.counters,
+            'jobs': {
+                name: {**timing, 'avg_seconds': timing['total_seconds'] / timing['count']}
+                for name, timing in self.timings.items()
+            },
+        }
+
+
+# Process-wide executor used by @offloadable jobs
+offloader = Offloader()
+
+
+def offloadable(kind: str = CPU, timeout: Optional[float] = None):
+    """Register a job and give it an async `.offload(*args, owner=None)`"""
+
+    def decorator(fn: Callable) -> Callable:
+        name = f"{fn.__module__}.{fn.__qualname__}"
+        REGISTRY[name] = fn
+
+        async def offload(*args: Any, owner: Optional[Hashable] = None) -> Any:
+            return await offloader.run(kind, fn, *args, timeout=timeout, owner=owner, name=name)
+
+        fn.offload = offload
+        return fn
+
+    return decorator
@@ -0,0 +1,290 @@
+"""
+Per-client rate limiting and bounded room broadcasting for Socket.IO events.
+
+`RateLimiter` keeps one token bucket per (sid, event) pair so a single tab
+cannot flood the database, and `RoomOutbox` keeps one bounded, ordered queue
+per room so slow consumers get merged or dropped stale messages instead of an
+ever-growing backlog. `DeferredPatches` holds the latest rate-limited patch of
+each target and replays it once the sender has tokens again, so the end state
+of a burst (where a drag stopped) is never lost.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+def _limit_from_env(event: str, rate: float, burst: float) -> Tuple[float, float]:
+    """Read `RATE_LIMIT_<EVENT>=rate,burst` from the environment"""
+    raw = os.getenv(f"RATE_LIMIT_{event.upper()}")
+    if not raw:
+        return rate, burst
+    rate_str, _, burst_str = raw.partition(',')
+    return float(rate_str), float(burst_str or rate_str)
+
+
+# Default (tokens per second, bucket size) for each client event
+DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+    'cursor_move': _limit_from_env('cursor_move', 30, 60),
+    'node_update': _limit_from_env('node_update', 60, 120),
+    'node_text_edit': _limit_from_env('node_text_edit', 30, 120),
+    'node_create': _limit_from_env('node_create', 5, 20),
+    'node_delete': _limit_from_env('node_delete', 5, 20),
+    'edge_create': _limit_from_env('edge_create', 5, 20),
+    'edge_delete': _limit_from_env('edge_delete', 5, 20),
+    'join_session': _limit_from_env('join_session', 1, 5),
+}
+
+OUTBOX_MAX_QUEUE = int(os.getenv("OUTBOX_MAX_QUEUE", "256"))
+
+
+# ==================== TOKEN BUCKETS ====================
+
+class TokenBucket:
+    """Classic token bucket: refills at `rate` tokens/s up to `capacity`"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def consume(self, now: float, amount: float = 1.0) -> bool:
+        """Take `amount` tokens if available"""
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def wait_time(self, amount: float = 1.0) -> float:
+        """Seconds until `amount` tokens are available"""
+        return max(0.0, (amount - self.tokens) / self.rate) if self.rate > 0 else float('inf')
+
+
+class RateLimiter:
+    """Token-bucket rate limits keyed by client sid and event name"""
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Tuple[float, float]]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.clock = clock
+        self._buckets: Dict[str, Dict[str, TokenBucket]] = {}
+        self.limited: Dict[str, int] = defaultdict(int)
+
+    def allow(self, sid: str, event: str) -> bool:
+        """Return True if `sid` may handle another `event` right now"""
+        limit = self.limits.get(event)
+        if limit is None:
+            return True
+        now = self.clock()
+        buckets = self._buckets.setdefault(sid, {})
+        bucket = buckets.get(event)
+        if bucket is None:
+            bucket = buckets[event] = TokenBucket(limit[0], limit[1], now)
+        if bucket.consume(now):
+            return True
+        self.limited[event] += 1
+        return False
+
+    def retry_after(self, sid: str, event: str) -> float:
+        """Seconds until `sid` may handle another `event`"""
+        bucket = self._buckets.get(sid, {}).get(event)
+        if bucket is None:
+            return 0.0
+        now = self.clock()
+        return max(0.0, bucket.wait_time() - max(0.0, now - bucket.updated))
+
+    def forget(self, sid: str) -> None:
+        """Drop all buckets of a disconnected client"""
+        self._buckets.pop(sid, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'clients': len(self._buckets), 'limited': dict(self.limited)}
+
+
+# ==================== DEFERRED PATCHES ====================
+
+class DeferredPatches:
+    """
+    Rate-limited `{..., 'patch': {...}}` payloads, merged per (sid, key).
+
+    A dropped payload is kept, later drops of the same key are merged into it,
+    and it is handed to `replay` after the given delay. A payload the sender
+    gets through in the meantime takes the pending patch along (`merge_into`),
+    so an older patch is never replayed over a newer one.
+    """
+
+    def __init__(self, replay: Callable[[str, Dict[str, Any]], Awaitable[None]]):
+        self.replay = replay
+        self._pending: Dict[Tuple[str, Hashable], Dict[str, Any]] = {}
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    def defer(self, sid: str, key: Hashable, data: Dict[str, Any], delay: float) -> None:
+        pending = self._pending.get((sid, key))
+        if pending is not None:
+            pending['patch'].update(data.get('patch') or {})
+            self.counters['merged'] += 1
+            return
+        self._pending[(sid, key)] = {**data, 'patch': dict(data.get('patch') or {})}
+        self.counters['deferred'] += 1
+        asyncio.get_running_loop().call_later(delay, self._fire, sid, key)
+
+    def merge_into(self, sid: str, key: Hashable, data: Dict[str, Any]) -> Dict[str, Any]:
+        """`data` with any pending patch of the key folded in underneath"""
+        pending = self._pending.pop((sid, key), None)
+        if pending is None:
+            return data
+        self.counters['folded'] += 1
+        return {**data, 'patch': {**pending['patch'], **(data.get('patch') or {})}}
+
+    def _fire(self, sid: str, key: Hashable) -> None:
+        data = self._pending.pop((sid, key), None)
+        if data is not None:
+            asyncio.create_task(self._replay(sid, data))
+
+    async def _replay(self, sid: str, data: Dict[str, Any]) -> None:
+        self.counters['replayed'] += 1
+        try:
+            await self.replay(sid, data)
+        except Exception as e:
+            print(f'❌ Error replaying a rate-limited patch: {e}')
+
+    def forget(self, sid: str) -> None:
+        """Drop the pending patches of a disconnected client"""
+        for key in [key for key in self._pending if key[0] == sid]:
+            del self._pending[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {'pending': len(self._pending), **self.counters}
+
+
+# ==================== ROOM OUTBOX ====================
+
+class _Outgoing:
+    __slots__ = ('event', 'data', 'skip_sid', 'droppable')
+
+    def __init__(self, event: str, data: Any, skip_sid: Optional[str], droppable: bool):
+        self.event = event
+        self.data = data
+        self.skip_sid = skip_sid
+        self.droppable = droppable
+
+
+class _RoomQueue:
+    __slots__ = ('messages', 'task', 'space', 'seq')
+
+    def __init__(self):
+        self.messages: "OrderedDict[Hashable, _Outgoing]" = OrderedDict()
+        self.task: Optional[asyncio.Task] = None
+        self.space = asyncio.Event()
+        self.seq = 0
+
+
+class RoomOutbox:
+    """
+    Ordered, bounded per-room broadcast queues.
+
+    Messages with a `merge_key` replace any queued message with the same key
+    (e.g. a newer position of the same node), and `droppable` messages are the
+    first to go when a room's queue is full. Anything else applies
+    backpressure: the emitting coroutine waits until the room has drained.
+    """
+
+    def __init__(self, sio, max_queue: int = OUTBOX_MAX_QUEUE):
+        self.sio = sio
+        self.max_queue = max_queue
+        self._rooms: Dict[str, _RoomQueue] = {}
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    async def emit(
+        self,
+        event: str,
+        data: Any,
+        room: str,
+        skip_sid: Optional[str] = None,
+        merge_key: Optional[Hashable] = None,
+        droppable: bool = False,
+    ) -> None:
+        """Queue `event` for every client in `room`"""
+        message = _Outgoing(event, data, skip_sid, droppable)
+        while True:
+            queue = self._rooms.get(room)
+            if queue is None:
+                queue = self._rooms[room] = _RoomQueue()
+
+            if merge_key is not None:
+                key = (event, merge_key)
+                if key in queue.messages:
+                    queue.messages[key] = message
+                    queue.messages.move_to_end(key)
+                    self.counters['merged'] += 1
+                    return
+
+            if len(queue.messages) < self.max_queue:
+                break
+            if self._drop_oldest(queue):
+                continue
+            if droppable:
+                self.counters['dropped'] += 1
+                return
+            # Only non-droppable messages are queued: wait for the drain task
+            self.counters['backpressure_waits'] += 1
+            self._ensure_drain(room, queue)
+            queue.space.clear()
+            await queue.space.wait()
+
+        if merge_key is None:
+            queue.seq += 1
+            key = queue.seq
+        queue.messages[key] = message
+        self.counters['queued'] += 1
+        self._ensure_drain(room, queue)
+
+    def _drop_oldest(self, queue: _RoomQueue) -> bool:
+        for key, message in queue.messages.items():
+            if message.droppable:
+                del queue.messages[key]
+                self.counters['dropped'] += 1
+                return True
+        return False
+
+    def _ensure_drain(self, room: str, queue: _RoomQueue) -> None:
+        if queue.task is None or queue.task.done():
+            queue.task = asyncio.create_task(self._drain(room, queue))
+
+    async def _drain(self, room: str, queue: _RoomQueue) -> None:
+        try:
+            while queue.messages:
+                _, message = queue.messages.popitem(last=False)
+                queue.space.set()
+                try:
+                    await self.sio.emit(message.event, message.data, room=room, skip_sid=message.skip_sid)
+                    self.counters['sent'] += 1
+                except Exception as e:
+                    self.counters['send_errors'] += 1
+                    print(f'❌ Error broadcasting {message.event} to {room}: {e}')
+        finally:
+            queue.space.set()
+            if not queue.messages and self._rooms.get(room) is queue:
+                del self._rooms[room]
+
+    def depth(self, room: str) -> int:
+        queue = self._rooms.get(room)
+        return len(queue.messages) if queue else 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'rooms': len(self._rooms),
+            'queued_now': sum(len(q.messages) for q in self._rooms.values()),
+            **self.counters,
+        }
@@ -0,0 +1,217 @@
+"""
+Hot-session residency manager.
+
+Per-session in-memory structures register as `ResidentComponent`s. The manager
+loads them when a session is first joined, keeps sessions in least-recently-
+active order, and evicts sessions whose room has stayed empty past a TTL or,
+when the global memory budget is exceeded, the least recently active ones.
+Dirty components are flushed before they are evicted. Code that awaits while
+it uses a session's data holds it with `pinned`; pinned sessions are skipped
+by the sweeps.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+RESIDENT_MEMORY_BUDGET = int(float(os.getenv("RESIDENT_MEMORY_BUDGET_MB", "256")) * 1024 * 1024)
+RESIDENT_IDLE_TTL = float(os.getenv("RESIDENT_IDLE_TTL", "600"))
+RESIDENT_SWEEP_INTERVAL = float(os.getenv("RESIDENT_SWEEP_INTERVAL", "30"))
+
+
+class ResidentComponent:
+    """Base class for per-session data managed by `SessionResidency`"""
+
+    name = 'component'
+
+    async def load(self, session_id: int) -> None:
+        """Bring the session's data into memory"""
+
+    def sizeof(self, session_id: int) -> int:
+        """Approximate bytes held for the session"""
+        return 0
+
+    def is_dirty(self, session_id: int) -> bool:
+        """Whether the session holds changes not yet persisted"""
+        return False
+
+    async def flush(self, session_id: int) -> None:
+        """Persist the session's dirty state"""
+
+    def evict(self, session_id: int) -> None:
+        """Drop the session's data from memory"""
+
+
+class _Resident:
+    __slots__ = ('last_active', 'empty_since', 'lock', 'pins')
+
+    def __init__(self, now: float):
+        self.last_active = now
+        self.empty_since: Optional[float] = None
+        # Held while the session loads or is evicted
+        self.lock = asyncio.Lock()
+        self.pins = 0
+
+
+class SessionResidency:
+    """Tracks resident sessions and evicts them by idle TTL and memory budget"""
+
+    def __init__(
+        self,
+        is_occupied: Callable[[int], bool],
+        memory_budget: int = RESIDENT_MEMORY_BUDGET,
+        idle_ttl: float = RESIDENT_IDLE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.is_occupied = is_occupied
+        self.memory_budget = memory_budget
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self.components: List[ResidentComponent] = []
+        self._sessions: "OrderedDict[int, _Resident]" = OrderedDict()
+        self.counters = {'loads': 0, 'evictions_idle': 0, 'evictions_memory': 0, 'flushes': 0}
+
+    def register(self, component: ResidentComponent) -> ResidentComponent:
+        self.components.append(component)
+        return component
+
+    def is_resident(self, session_id: int) -> bool:
+        return session_id in self._sessions
+
+    def sessions(self) -> List[int]:
+        """Ids of the resident sessions, least recently active first"""
+        return list(self._sessions)
+
+    async def _acquire(self, session_id: int, pin: bool) -> _Resident:
+        while True:
+            resident = self._sessions.get(session_id)
+            loading = resident is None
+            if loading:
+                resident = self._sessions[session_id] = _Resident(self.clock())
+            # Waits for a concurrent load or eviction to finish
+            async with resident.lock:
+                if loading:
+                    try:
+                        for component in self.components:
+                            await component.load(session_id)
+                    except Exception:
+                        self._sessions.pop(session_id, None)
+                        for component in self.components:
+                            component.evict(session_id)
+                        raise
+                    self.counters['loads'] += 1
+                # Pinning under the lock means an eviction queued behind us
+                # sees the pin; if an eviction got here first, load again
+                if self._sessions.get(session_id) is resident:
+                    if pin:
+                        resident.pins += 1
+                    break
+        self.touch(session_id)
+        return resident
+
+    async def acquire(self, session_id: int) -> None:
+        """
+        Make a session resident, loading its components on first use. It is
+        only guaranteed to stay resident until the caller next awaits; use
+        `pinned` to hold it longer.
+        """
+        await self._acquire(session_id, pin=False)
+
+    @asynccontextmanager
+    async def pinned(self, session_id: int) -> AsyncIterator[None]:
+        """Make a session resident and keep it from being evicted inside the block"""
+        resident = await self._acquire(session_id, pin=True)
+        try:
+            yield
+        finally:
+            resident.pins -= 1
+
+    def is_pinned(self, session_id: int) -> bool:
+        resident = self._sessions.get(session_id)
+        return resident is not None and resident.pins > 0
+
+    def touch(self, session_id: int) -> None:
+        """Record activity on a resident session"""
+        resident = self._sessions.get(session_id)
+        if resident is not None:
+            resident.last_active = self.clock()
+            resident.empty_since = None
+            self._sessions.move_to_end(session_id)
+
+    def sizeof(self, session_id: int) -> int:
+        return sum(component.sizeof(session_id) for component in self.components)
+
+    def footprint(self) -> int:
+        return sum(self.sizeof(session_id) for session_id in self._sessions)
+
+    async def evict(self, session_id: int, force: bool = False) -> bool:
+        """
+        Flush and drop a session; returns False if it was not resident, or is
+        pinned and `force` is not set
+        """
+        resident = self._sessions.get(session_id)
+        if resident is None:
+            return False
+        async with resident.lock:
+            if self._sessions.get(session_id) is not resident:
+                return False  # evicted while we waited
+            if resident.pins and not force:
+                return False
+            for component in self.components:
+                if component.is_dirty(session_id):
+                    await component.flush(session_id)
+                    self.counters['flushes'] += 1
+            for component in self.components:
+                component.evict(session_id)
+            del self._sessions[session_id]
+        return True
+
+    async def sweep(self) -> None:
+        """Evict idle empty rooms, then least-recently-active sessions over budget"""
+        now = self.clock()
+        for session_id, resident in list(self._sessions.items()):
+            if self.is_occupied(session_id):
+                resident.empty_since = None
+            elif resident.empty_since is None:
+                resident.empty_since = now
+            elif now - resident.empty_since >= self.idle_ttl:
+                if await self.evict(session_id):
+                    self.counters['evictions_idle'] += 1
+
+        footprint = self.footprint()
+        if footprint <= self.memory_budget:
+            return
+        # Empty rooms go first, then occupied ones; both oldest activity first
+        candidates = sorted(self._sessions, key=lambda s: self.is_occupied(s))
+        for session_id in candidates:
+            if footprint <= self.memory_budget:
+                break
+            size = self.sizeof(session_id)
+            if await self.evict(session_id):
+                footprint -= size
+                self.counters['evictions_memory'] += 1
+
+    async def run(self, interval: float = RESIDENT_SWEEP_INTERVAL) -> None:
+        """Sweep forever; meant to run as a background task"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f'❌ Error in residency sweep: {e}')
+
+    async def close(self) -> None:
+        """Flush and evict everything, e.g. on shutdown"""
+        for session_id in list(self._sessions):
+            await self.evict(session_id, force=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'resident_sessions': len(self._sessions),
+            'pinned_sessions': sum(1 for resident in self._sessions.values() if resident.pins),
+            'memory_bytes': self.footprint(),
+            'memory_budget': self.memory_budget,
+            **self.counters,
+        }
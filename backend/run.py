@@ -9,6 +9,9 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
-        log_level="info"
+        log_level="info",
+        # On by default in uvicorn; deflating every tiny cursor frame costs
+        # more than it saves, and large payloads arrive gzipped already
+        ws_per_message_deflate=False,
     )
 
@@ -0,0 +1,271 @@
+"""
+Session affinity across backend instances.
+
+Every session is owned by exactly one instance, chosen by consistent hashing
+of the session id over the live instances (with SHARD_VNODES virtual nodes
+each, so load spreads evenly and a joining or leaving instance only moves
+about 1/N of the sessions). Only the owner holds a session's in-memory state;
+other instances answer its socket events with a `session_redirect` hint
+naming the owner's URL.
+
+Instances are listed statically or discovered through a heartbeat table:
+
+    SHARD_INSTANCE_ID=a SHARD_INSTANCE_URL=http://10.0.0.1:8000
+    SHARD_INSTANCES=a=http://10.0.0.1:8000,b=http://10.0.0.2:8000   # static
+    SHARD_MEMBERSHIP=db                                              # heartbeats
+
+Without either, the single instance owns every session. Hashing uses blake2b,
+so every process computes the same ring regardless of PYTHONHASHSEED.
+
+With heartbeats, instances see a ring change at slightly different times, so
+ownership is handed off in two steps (`accepts`): the old owner may finish
+writing a moved session for SHARD_HANDOFF_DRAIN seconds, the new owner only
+starts writing it SHARD_HANDOFF_GRACE seconds after it saw the change. An
+instance whose heartbeat has not gone through for SHARD_INSTANCE_TTL, and is
+therefore about to be dropped by the others, stops writing altogether.
+"""
+import asyncio
+import bisect
+import hashlib
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+SHARD_INSTANCE_ID = os.getenv("SHARD_INSTANCE_ID", "local")
+SHARD_INSTANCE_URL = os.getenv("SHARD_INSTANCE_URL", "")
+SHARD_INSTANCES = os.getenv("SHARD_INSTANCES", "")
+SHARD_MEMBERSHIP = os.getenv("SHARD_MEMBERSHIP", "static")
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "64"))
+SHARD_HEARTBEAT_INTERVAL = float(os.getenv("SHARD_HEARTBEAT_INTERVAL", "5"))
+SHARD_INSTANCE_TTL = float(os.getenv("SHARD_INSTANCE_TTL", "15"))
+SHARD_HANDOFF_DRAIN = float(os.getenv("SHARD_HANDOFF_DRAIN", str(SHARD_HEARTBEAT_INTERVAL)))
+SHARD_HANDOFF_GRACE = float(os.getenv("SHARD_HANDOFF_GRACE", str(3 * SHARD_HEARTBEAT_INTERVAL)))
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def parse_instances(spec: str) -> Dict[str, str]:
+    """`id=url,id=url` -> {id: url}"""
+    instances = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        instance_id, _, url = item.partition('=')
+        instances[instance_id.strip()] = url.strip()
+    return instances
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = SHARD_VNODES):
+        self.vnodes = vnodes
+        self.nodes = set(nodes)
+        self._hashes: List[int] = []
+        self._owners: List[str] = []
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        points = sorted(
+            (_hash(f'{node}#{i}'), node)
+            for node in self.nodes
+            for i in range(self.vnodes)
+        )
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def add(self, node: str) -> None:
+        if node not in self.nodes:
+            self.nodes.add(node)
+            self._rebuild()
+
+    def remove(self, node: str) -> None:
+        if node in self.nodes:
+            self.nodes.discard(node)
+            self._rebuild()
+
+    def owner(self, key: Any) -> Optional[str]:
+        """Node owning `key`: the first virtual node clockwise from its hash"""
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._owners[i]
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+
+class ShardRouter:
+    """Which instance owns a session, and where to send clients of other sessions"""
+
+    def __init__(
+        self,
+        instance_id: str = SHARD_INSTANCE_ID,
+        url: str = SHARD_INSTANCE_URL,
+        instances: Optional[Dict[str, str]] = None,
+        vnodes: int = SHARD_VNODES,
+        dynamic: bool = False,
+        drain: float = SHARD_HANDOFF_DRAIN,
+        grace: float = SHARD_HANDOFF_GRACE,
+        lease: float = SHARD_INSTANCE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.instance_id = instance_id
+        self.url = url
+        self.dynamic = dynamic
+        self.drain = drain
+        self.grace = grace
+        self.lease = lease
+        self.clock = clock
+        self.instances: Dict[str, str] = {}
+        self.ring = HashRing(vnodes=vnodes)
+        # Ring before the latest change and when we saw it, for the handoff
+        self._previous: Optional[HashRing] = None
+        self._changed_at = -math.inf
+        self._refreshed_at = clock()
+        self._provisional = False
+        self.counters = {'redirects': 0, 'rebalances': 0, 'released': 0}
+        self.set_instances(instances or {})
+        if dynamic:
+            # A joining instance owned nothing: whatever it gets is handed off
+            self._previous = HashRing(vnodes=vnodes)
+            self._changed_at = clock()
+            # Without a list it only knows itself until the first refresh;
+            # that solo ring is no evidence it ever owned anything
+            self._provisional = not instances
+
+    @classmethod
+    def from_env(cls) -> "ShardRouter":
+        instances = parse_instances(SHARD_INSTANCES)
+        dynamic = SHARD_MEMBERSHIP == 'db'
+        # Our own entry of a static list is as good as SHARD_INSTANCE_URL
+        url = SHARD_INSTANCE_URL or instances.get(SHARD_INSTANCE_ID, '')
+        if (dynamic or set(instances) - {SHARD_INSTANCE_ID}) and not url:
+            # Redirects to us would carry an empty URL that no client can follow
+            raise RuntimeError('SHARD_INSTANCE_URL is required when sessions are sharded')
+        return cls(url=url, instances=instances, dynamic=dynamic)
+
+    def set_instances(self, instances: Dict[str, str]) -> bool:
+        """Replace the instance list (this one is always included); True if it changed"""
+        instances = {**instances, self.instance_id: self.url}
+        if instances == self.instances:
+            return False
+        now = self.clock()
+        if self.instances and not self._provisional and (
+            self._previous is None or now - self._changed_at >= self.grace
+        ):
+            # During an unfinished handoff keep the older ring: sessions it
+            # moved must still wait out the grace period
+            self._previous = HashRing(self.instances, self.ring.vnodes)
+        self._provisional = False
+        self._changed_at = now
+        self.instances = instances
+        self.ring = HashRing(instances, self.ring.vnodes)
+        return True
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.instances) > 1
+
+    def owner(self, session_id: Any) -> str:
+        return self.ring.owner(session_id) if self.enabled else self.instance_id
+
+    def owns(self, session_id: Any) -> bool:
+        return self.owner(session_id) == self.instance_id
+
+    def _owned_before(self, session_id: Any) -> bool:
+        return self._previous is not None and self._previous.owner(session_id) == self.instance_id
+
+    def accepts(self, session_id: Any) -> bool:
+        """Whether this instance may write the session right now (the mutation fence)"""
+        if not self.dynamic:
+            return self.owns(session_id)
+        now = self.clock()
+        if now - self._refreshed_at >= self.lease:
+            # The others have dropped us, or are about to
+            return False
+        owned_now = self.owns(session_id)
+        if self._previous is None or now - self._changed_at >= self.grace:
+            return owned_now
+        owned_before = self._owned_before(session_id)
+        if owned_before == owned_now:
+            return owned_now
+        if owned_before:
+            # Moved away: finish what is in flight, then let go
+            return now - self._changed_at < self.drain
+        # Moved here: wait until the old owner has surely let go
+        return False
+
+    def handoff_delay(self, session_id: Any) -> float:
+        """Seconds until a session we now own finishes moving here, 0 if it has"""
+        if not self.dynamic or self._previous is None or not self.owns(session_id):
+            return 0.0
+        if self._owned_before(session_id):
+            return 0.0
+        return max(0.0, self._changed_at + self.grace - self.clock())
+
+    def redirect(self, session_id: Any) -> Optional[Dict[str, Any]]:
+        """Redirect hint for a session owned elsewhere, None if it is ours"""
+        owner = self.owner(session_id)
+        if owner == self.instance_id:
+            return None
+        self.counters['redirects'] += 1
+        return {'session_id': session_id, 'instance': owner, 'url': self.instances.get(owner, '')}
+
+    # ==================== HEARTBEATS ====================
+
+    async def refresh(self, session_factory) -> bool:
+        """Record our heartbeat and reload the live instances; True if they changed"""
+        # Imported here: static membership must not need the database layer
+        import crud
+
+        started = self.clock()
+        now = datetime.now(timezone.utc)
+        async with session_factory() as db:
+            await crud.heartbeat_instance(db, self.instance_id, self.url, now)
+            live = await crud.live_instances(db, now - timedelta(seconds=SHARD_INSTANCE_TTL))
+        # Our lease runs from the heartbeat the others now see
+        self._refreshed_at = started
+        changed = self.set_instances(live)
+        self._provisional = False
+        return changed
+
+    async def run(
+        self,
+        session_factory,
+        release_moved: Callable[[], Awaitable[int]],
+        interval: float = SHARD_HEARTBEAT_INTERVAL,
+    ) -> None:
+        """
+        Heartbeat forever. When instances join or leave, `release_moved` hands
+        off the sessions this instance no longer owns and returns their count.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await self.refresh(session_factory):
+                    self.counters['rebalances'] += 1
+                    print(f'🔀 Shard ring changed: {sorted(self.instances)}')
+                    self.counters['released'] += await release_moved()
+            except Exception as e:
+                print(f'❌ Error in shard heartbeat: {e}')
+
+    async def leave(self, session_factory) -> None:
+        """Drop our heartbeat so the others take over our sessions right away"""
+        import crud
+
+        async with session_factory() as db:
+            await crud.remove_instance(db, self.instance_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'instance': self.instance_id,
+            'instances': sorted(self.instances),
+            'membership': 'db' if self.dynamic else 'static',
+            **self.counters,
+        }
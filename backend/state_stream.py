@@ -0,0 +1,91 @@
+"""
+Progressive `initial_state` streaming for large boards.
+
+Instead of one monolithic message, a joining client that asks for
+`stream: true` receives ordered `initial_state_chunk` messages, nodes nearest
+its viewport first, with the event loop yielded between chunks. Clients keep
+buffering live `node_*`/`edge_*` events until the chunk marked `done` and then
+apply them on top, since every chunk is an upsert of the latest known rows.
+Text operations are not idempotent, so chunks carry the text revision of the
+nodes being edited and clients skip `node_text_edited` events up to it.
+"""
+import asyncio
+import os
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import compression
+from compact_board import CompactBoard
+from offload import CPU, offloadable
+
+INITIAL_STATE_CHUNK_SIZE = int(os.getenv("INITIAL_STATE_CHUNK_SIZE", "500"))
+# Boards at least this large are encoded in the process pool
+OFFLOAD_MIN_NODES = int(os.getenv("OFFLOAD_MIN_NODES", "2000"))
+
+Chunk = Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]
+
+
+def viewport_center(viewport: Optional[Dict[str, Any]]) -> Tuple[float, float]:
+    """Center of a `{x, y, width, height}` viewport in board coordinates"""
+    if not viewport:
+        return 0.0, 0.0
+    x = float(viewport.get('x') or 0)
+    y = float(viewport.get('y') or 0)
+    return x + float(viewport.get('width') or 0) / 2, y + float(viewport.get('height') or 0) / 2
+
+
+async def board_chunks(
+    board: CompactBoard,
+    center: Tuple[float, float],
+    chunk_size: int = INITIAL_STATE_CHUNK_SIZE,
+) -> AsyncIterator[Chunk]:
+    """
+    Yield `(nodes, edges)` chunks of a resident board, nearest nodes first.
+
+    Each edge is sent with the chunk that completes both of its endpoints.
+    Ids are snapshotted up front and rows are looked up by id when a chunk is
+    built, so mutations applied to the board mid-stream are never misread.
+    """
+    cx, cy = center
+    xs, ys = board.xs, board.ys
+    order = sorted(range(len(board.node_ids)), key=lambda row: abs(xs[row] - cx) + abs(ys[row] - cy))
+    node_ids = [board.node_ids[row] for row in order]
+    rank = {node_id: i for i, node_id in enumerate(node_ids)}
+
+    last = len(node_ids)
+    edge_order = sorted(
+        range(len(board.edge_ids)),
+        key=lambda row: max(rank.get(board.sources[row], last), rank.get(board.targets[row], last)),
+    )
+    edge_ready = [
+        (max(rank.get(board.sources[row], last), rank.get(board.targets[row], last)), board.edge_ids[row])
+        for row in edge_order
+    ]
+    await asyncio.sleep(0)
+
+    edge_pos = 0
+    for start in range(0, max(last, 1), chunk_size):
+        end = start + chunk_size
+        nodes = [board.node(board._node_rows[node_id]) for node_id in node_ids[start:end]
+                 if node_id in board._node_rows]
+        edges = []
+        while edge_pos < len(edge_ready) and (edge_ready[edge_pos][0] < end or end >= last):
+            edge_id = edge_ready[edge_pos][1]
+            row = board._edge_rows.get(edge_id)
+            if row is not None:
+                edges.append(board.edge(row))
+            edge_pos += 1
+        yield nodes, edges
+        await asyncio.sleep(0)
+
+
+@offloadable(CPU)
+def encode_board_state(
+    board: CompactBoard,
+    journal: Optional[Dict[str, Any]],
+    text_revisions: Dict[int, int],
+) -> Dict[str, Any]:
+    """Serialize and gzip a whole board as an `initial_state` payload"""
+    state = board.to_wire()
+    state['journal'] = journal
+    state['text_revisions'] = text_revisions
+    return compression.encode_payload(state, threshold=0)
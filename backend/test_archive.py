@@ -0,0 +1,157 @@
+"""
+Tests for the archive tier (cold-session search, archive/restore round trip).
+Run with: pytest test_archive.py
+"""
+import asyncio
+import json
+import os
+import sys
+import zlib
+from datetime import datetime, timedelta, timezone
+sys.path.insert(0, os.path.dirname(__file__))
+
+from archive import SessionArchiver
+
+
+class FakeMutations:
+    """Runs each submitted mutation right away, answering with `answers` in order"""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.submitted = []
+
+    async def submit(self, session_id, apply, on_commit=None):
+        self.submitted.append(session_id)
+        result = self.answers.pop(0)
+        if on_commit is not None:
+            await on_commit(result)
+        return result
+
+
+class FakeArchive:
+    node_count, edge_count, payload = 1, 0, b'x'
+
+
+def test_sessions_known_not_to_be_archived_skip_the_queue():
+    async def scenario():
+        mutations = FakeMutations(False, FakeArchive(), True, False, False)
+        archiver = SessionArchiver(None, mutations, lambda s: False, known_max=2)
+        assert not await archiver.restore(1)
+        assert not await archiver.restore(1)
+        assert mutations.submitted == [1]
+
+        # Archiving it makes the next restore go to the database again
+        assert await archiver.archive(1)
+        assert await archiver.restore(1)
+        assert not await archiver.restore(1)
+        assert mutations.submitted == [1, 1, 1]
+
+        # Only the most recently checked sessions are remembered
+        await archiver.restore(2)
+        await archiver.restore(3)
+        assert await archiver.restore(3) is False
+        assert mutations.submitted == [1, 1, 1, 2, 3]
+        stats = archiver.stats()
+        assert (stats['known_unarchived'], stats['restore_skips']) == (2, 3)
+        archiver.forget_unarchived()
+        assert archiver.stats()['known_unarchived'] == 0
+
+    asyncio.run(scenario())
+
+
+async def seed(db, title, *positions, age_days=30):
+    """A session with nodes at `positions`, an edge between the first two, all `age_days` old"""
+    import crud
+    import models
+    from sqlalchemy import update
+    from schemas import EdgeCreate, NodeCreate
+
+    session = await crud.create_session(db, title)
+    nodes = [await crud.create_node(db, session.id, NodeCreate(content=f'{title} {x}', x=x, y=y))
+             for x, y in positions]
+    edges = []
+    if len(nodes) > 1:
+        edges.append(await crud.create_edge(db, session.id, EdgeCreate(source_id=nodes[0].id, target_id=nodes[1].id)))
+    then = datetime.now(timezone.utc) - timedelta(days=age_days)
+    await db.execute(update(models.Session).where(models.Session.id == session.id).values(created_at=then, updated_at=None))
+    await db.execute(update(models.Node).where(models.Node.session_id == session.id).values(created_at=then, updated_at=None))
+    await db.execute(update(models.Edge).where(models.Edge.session_id == session.id).values(created_at=then))
+    await db.commit()
+    return session.id, [node.id for node in nodes], [edge.id for edge in edges]
+
+
+def test_find_cold_sessions(sqlite_db):
+    import crud
+    import models
+
+    async def scenario():
+        engine, session_factory = await sqlite_db()
+        async with session_factory() as db:
+            cold, _, _ = await seed(db, 'cold', (0, 0), (10, 10))
+            other_cold, _, _ = await seed(db, 'other cold', (0, 0))
+            recent, _, _ = await seed(db, 'recent', (0, 0), age_days=0)
+            await seed(db, 'empty')
+            archived, _, _ = await seed(db, 'archived', (0, 0))
+            db.add(models.SessionArchive(session_id=archived, payload=b'', node_count=0, edge_count=0))
+            await db.commit()
+
+            cutoff = datetime.now(timezone.utc) - timedelta(days=7)
+            assert await crud.find_cold_sessions(db, cutoff, 10) == [cold, other_cold]
+            assert await crud.find_cold_sessions(db, cutoff, 1) == [cold]
+            # Moving the cutoff past the recent session makes it cold too
+            later = datetime.now(timezone.utc) + timedelta(days=1)
+            assert await crud.find_cold_sessions(db, later, 10) == [cold, other_cold, recent]
+        await engine.dispose()
+
+    asyncio.run(scenario())
+
+
+def test_archived_sessions_restore_with_their_ids(sqlite_db):
+    import crud
+    import models
+    from mutation_queue import MutationQueue
+    from sqlalchemy import select
+
+    async def rows(db, session_id):
+        nodes = (await db.execute(
+            select(models.Node.id, models.Node.content, models.Node.x).where(models.Node.session_id == session_id)
+            .order_by(models.Node.id)
+        )).all()
+        edges = (await db.execute(
+            select(models.Edge.id, models.Edge.source_id, models.Edge.target_id)
+            .where(models.Edge.session_id == session_id)
+        )).all()
+        return [tuple(row) for row in nodes], [tuple(row) for row in edges]
+
+    async def scenario():
+        engine, session_factory = await sqlite_db()
+        async with session_factory() as db:
+            session_id, node_ids, edge_ids = await seed(db, 'cold', (0, 0), (10, 10))
+            active_id, _, _ = await seed(db, 'active', (0, 0))
+            before = await rows(db, session_id)
+
+        archiver = SessionArchiver(session_factory, MutationQueue(session_factory), lambda s: s == active_id, after_days=7)
+        assert await archiver.run_once() == 1
+
+        async with session_factory() as db:
+            archive = await db.get(models.SessionArchive, session_id)
+            assert (archive.node_count, archive.edge_count) == (2, 1)
+            document = json.loads(zlib.decompress(archive.payload))
+            assert [row[:3] for row in document['nodes']] == [[node_ids[0], 'cold 0', 0], [node_ids[1], 'cold 10', 10]]
+            assert [row[:3] for row in document['edges']] == [[edge_ids[0], node_ids[0], node_ids[1]]]
+            assert await rows(db, session_id) == ([], [])
+            assert await db.get(models.SessionArchive, active_id) is None
+
+            board = await crud.load_archived_board(db, session_id)
+            assert sorted(node['id'] for node in board.iter_nodes()) == node_ids
+
+        assert await archiver.restore(session_id)
+        assert not await archiver.restore(session_id)
+        async with session_factory() as db:
+            assert await rows(db, session_id) == before
+            assert await db.get(models.SessionArchive, session_id) is None
+        stats = archiver.stats()
+        assert (stats['archived_sessions'], stats['archived_nodes'], stats['restored_sessions']) == (1, 2, 1)
+        await engine.dispose()
+
+    asyncio.run(scenario())
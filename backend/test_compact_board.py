@@ -0,0 +1,126 @@
+"""
+Tests for the compact board (swap-remove and row index consistency).
+Run with: pytest test_compact_board.py
+"""
+import os
+import random
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+from compact_board import CompactBoard
+
+
+def node(node_id, **fields):
+    return {'id': node_id, 'content': f'node {node_id}', 'x': node_id, 'y': 0,
+            'width': 200, 'height': 100, 'style': {}, **fields}
+
+
+def edge(edge_id, source_id, target_id):
+    return {'id': edge_id, 'source_id': source_id, 'target_id': target_id}
+
+
+def assert_consistent(board):
+    """Every column has one entry per row and the indexes point at their rows"""
+    node_columns = (board.node_ids, board.xs, board.ys, board.widths, board.heights,
+                    board.style_refs, board.node_created, board.node_updated, board.contents)
+    assert {len(column) for column in node_columns} == {len(board.node_ids)}
+    assert board._node_rows == {node_id: row for row, node_id in enumerate(board.node_ids)}
+
+    edge_columns = (board.edge_ids, board.sources, board.targets, board.edge_created)
+    assert {len(column) for column in edge_columns} == {len(board.edge_ids)}
+    assert board._edge_rows == {edge_id: row for row, edge_id in enumerate(board.edge_ids)}
+    for source_id, target_id in zip(board.sources, board.targets):
+        assert board.has_node(source_id) and board.has_node(target_id)
+
+
+def build(node_count, edges=()):
+    board = CompactBoard(1)
+    for node_id in range(1, node_count + 1):
+        board.upsert_node(node(node_id))
+    for edge_id, source_id, target_id in edges:
+        board.upsert_edge(edge(edge_id, source_id, target_id))
+    return board
+
+
+def test_removing_a_node_moves_the_last_row_into_its_place():
+    board = build(4)
+    assert board.remove_node(2)
+    assert list(board.node_ids) == [1, 4, 3]
+    assert board.node(board._node_rows[4])['content'] == 'node 4'
+    assert board.node(board._node_rows[4])['x'] == 4
+    assert not board.remove_node(2)
+    assert_consistent(board)
+
+    # Removing the last row needs no swap
+    assert board.remove_node(3)
+    assert list(board.node_ids) == [1, 4]
+    assert_consistent(board)
+
+
+def test_removing_a_node_removes_its_edges():
+    board = build(4, [(10, 1, 2), (11, 2, 3), (12, 3, 4), (13, 4, 1)])
+    board.remove_node(2)
+    assert sorted(board.edge_ids) == [12, 13]
+    assert {e['id']: (e['source_id'], e['target_id']) for e in board.iter_edges()} == {12: (3, 4), 13: (4, 1)}
+    assert_consistent(board)
+
+    assert board.remove_edge(12)
+    assert list(board.edge_ids) == [13]
+    assert not board.remove_edge(12)
+    assert_consistent(board)
+
+
+def test_upserts_after_removes_update_the_moved_row():
+    board = build(3)
+    board.remove_node(1)
+    board.upsert_node(node(3, content='moved', x=50))
+    board.upsert_node(node(5))
+    assert board.content(3) == 'moved'
+    assert board.node(board._node_rows[3])['x'] == 50
+    assert board.content(2) == 'node 2'
+    assert list(board.node_ids) == [3, 2, 5]
+    assert_consistent(board)
+
+
+def test_events_keep_the_indexes_consistent():
+    rng = random.Random(7)
+    board = CompactBoard(1)
+    expected_nodes, expected_edges = {}, {}
+    next_id = 1
+    for _ in range(500):
+        choice = rng.random()
+        if choice < 0.35 or not expected_nodes:
+            data = node(next_id)
+            board.apply_event('node_created', {'node': data})
+            expected_nodes[next_id] = data
+            next_id += 1
+        elif choice < 0.5:
+            node_id = rng.choice(list(expected_nodes))
+            data = node(node_id, content=f'edit {next_id}', x=rng.randrange(1000))
+            board.apply_event('node_updated', {'node': data})
+            expected_nodes[node_id] = data
+        elif choice < 0.65:
+            node_id = rng.choice(list(expected_nodes))
+            board.apply_event('node_deleted', {'node_id': node_id})
+            del expected_nodes[node_id]
+            expected_edges = {k: v for k, v in expected_edges.items() if node_id not in v}
+        elif choice < 0.85:
+            source_id, target_id = rng.choice(list(expected_nodes)), rng.choice(list(expected_nodes))
+            board.apply_event('edge_created', {'edge': edge(next_id, source_id, target_id)})
+            expected_edges[next_id] = (source_id, target_id)
+            next_id += 1
+        elif expected_edges:
+            edge_id = rng.choice(list(expected_edges))
+            board.apply_event('edge_deleted', {'edge_id': edge_id})
+            del expected_edges[edge_id]
+        assert_consistent(board)
+
+    assert {n['id']: (n['content'], n['x']) for n in board.iter_nodes()} == {
+        node_id: (data['content'], data['x']) for node_id, data in expected_nodes.items()
+    }
+    assert {e['id']: (e['source_id'], e['target_id']) for e in board.iter_edges()} == expected_edges
+
+    copy = board.snapshot()
+    copy.remove_node(next(iter(expected_nodes)))
+    assert_consistent(copy)
+    assert board.to_wire()['nodes'] != copy.to_wire()['nodes']
@@ -0,0 +1,51 @@
+"""
+Tests for Socket.IO payload compression.
+Run with: pytest test_compression.py
+"""
+import gzip
+import json
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+from compression import accepts_gzip, decode_payload, encode_payload
+
+
+def state(nodes):
+    return {'nodes': [{'id': i, 'content': f'node {i}', 'x': i, 'y': i} for i in range(nodes)], 'edges': []}
+
+
+def test_gzip_is_only_used_when_the_client_asks_for_it():
+    assert accepts_gzip(['gzip'])
+    assert accepts_gzip(['br', 'gzip'])
+    assert accepts_gzip('gzip')
+    assert not accepts_gzip(None)
+    assert not accepts_gzip([])
+    assert not accepts_gzip(['br'])
+    assert not accepts_gzip('gzip, br')  # one encoding per entry, not a header
+
+
+def test_payloads_below_the_threshold_are_sent_as_is():
+    small = {'user_id': 'u', 'x': 1, 'y': 2}
+    size = len(json.dumps(small, separators=(',', ':')))
+    assert encode_payload(small, threshold=size + 1) is small
+    assert decode_payload(small) is small
+    assert encode_payload(small, threshold=size)['encoding'] == 'gzip'
+
+
+def test_large_payloads_round_trip_through_gzip():
+    data = state(500)
+    payload = encode_payload(data, threshold=1024)
+    assert payload['encoding'] == 'gzip' and isinstance(payload['data'], bytes)
+    assert len(payload['data']) < len(json.dumps(data)) / 4
+    assert json.loads(gzip.decompress(payload['data'])) == data
+    assert decode_payload(payload) == data
+
+
+def test_compression_level_is_applied():
+    data = state(500)
+    fast = encode_payload(data, threshold=0, level=1)['data']
+    best = encode_payload(data, threshold=0, level=9)['data']
+    # The gzip header's XFL byte records the compressor setting
+    assert (fast[8], best[8]) == (4, 2)
+    assert decode_payload({'encoding': 'gzip', 'data': fast}) == data
@@ -0,0 +1,192 @@
+"""
+Tests for the per-session change journal (ring buffer and file mirror).
+Run with: pytest test_journal.py
+"""
+import asyncio
+import json
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+from journal import ChangeJournal, JournalStore
+
+
+def fill(journal, count, start=0):
+    return [journal.append('node_updated', {'node_id': i}) for i in range(start, start + count)]
+
+
+def test_sequence_numbers_start_at_one():
+    journal = ChangeJournal(capacity=4)
+    assert journal.last_seq == 0
+    assert fill(journal, 3) == [1, 2, 3]
+    assert [e['seq'] for e in journal.since(0)] == [1, 2, 3]
+    assert journal.since(3) == []
+
+
+def test_wraparound_keeps_newest_entries():
+    journal = ChangeJournal(capacity=4)
+    fill(journal, 10)
+    assert len(journal) == 4
+    assert journal.first_seq == 7
+    events = journal.since(6)
+    assert [e['seq'] for e in events] == [7, 8, 9, 10]
+    assert [e['data']['node_id'] for e in events] == [6, 7, 8, 9]
+    assert journal.since(8) == journal.since(6)[2:]
+
+
+def test_truncated_or_unknown_positions_require_reload():
+    journal = ChangeJournal(capacity=4)
+    fill(journal, 10)
+    assert journal.since(5) is None   # seq 6 was overwritten
+    assert journal.since(11) is None  # never handed out
+
+
+def test_byte_budget_truncates_before_capacity():
+    journal = ChangeJournal(capacity=100, max_bytes=300)
+    fill(journal, 20)
+    assert 0 < len(journal) < 20
+    assert journal.nbytes() - 8 * 100 <= 300
+    assert journal.since(journal.first_seq - 1)[-1]['seq'] == 20
+    assert journal.since(journal.first_seq - 2) is None
+
+
+def test_file_mirror_survives_restart(tmp_path):
+    path = str(tmp_path / 'session_1.journal')
+    journal = ChangeJournal.open(path, capacity=4)
+    fill(journal, 6)
+    epoch = journal.epoch
+    journal.mirror.close(journal.take_writes())
+
+    restored = ChangeJournal.open(path, capacity=4)
+    assert restored.epoch == epoch
+    assert restored.last_seq == 6
+    assert [e['seq'] for e in restored.since(2)] == [3, 4, 5, 6]
+    assert restored.append('node_deleted', {'node_id': 1}) == 7
+    restored.mirror.close(restored.take_writes())
+
+
+def test_file_mirror_ignores_torn_tail(tmp_path):
+    path = str(tmp_path / 'session_1.journal')
+    journal = ChangeJournal.open(path, capacity=8)
+    fill(journal, 3)
+    journal.mirror.close(journal.take_writes())
+    with open(path, 'ab') as f:
+        f.write(b'{"seq":4,"event":"node_upd')
+
+    restored = ChangeJournal.open(path, capacity=8)
+    assert restored.last_seq == 3
+    assert restored.append('node_deleted', {'node_id': 1}) == 4
+    restored.mirror.close(restored.take_writes())
+
+
+def test_store_checks_epoch_and_event_types(tmp_path):
+    async def scenario():
+        store = JournalStore(directory=str(tmp_path), capacity=8)
+        await store.load(1)
+        assert store.append(1, 'cursor_moved', {}) is None
+        assert store.append(2, 'node_created', {}) is None  # not resident
+        assert store.append(1, 'node_created', {'node': {'id': 1}}) == 1
+
+        position = store.position(1)
+        assert store.since(1, position['epoch'], 0)[0]['event'] == 'node_created'
+        assert store.since(1, 'another-process', 0) is None
+
+        assert store.is_dirty(1)
+        await store.flush(1)
+        assert not store.is_dirty(1)
+        store.evict(1)
+        assert store.get(1) is None
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_store_writes_behind_and_reloads_in_the_same_epoch(tmp_path):
+    async def scenario():
+        store = JournalStore(directory=str(tmp_path), capacity=8)
+        await store.load(1)
+        for i in range(5):
+            store.append(1, 'node_updated', {'node_id': i})
+        position = store.position(1)
+        store.evict(1)
+
+        await store.load(1)
+        assert store.position(1) == position
+        assert [e['seq'] for e in store.since(1, position['epoch'], 2)] == [3, 4, 5]
+        store.evict(1)
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_events_missed_while_evicted_start_a_new_epoch(tmp_path):
+    async def scenario():
+        store = JournalStore(directory=str(tmp_path), capacity=8)
+        await store.load(1)
+        store.append(1, 'node_created', {'node': {'id': 1}})
+        position = store.position(1)
+        store.evict(1)
+
+        # Committed while the session was not resident: not journaled
+        assert store.append(1, 'node_deleted', {'node_id': 1}) is None
+        await store.load(1)
+        assert store.position(1)['epoch'] != position['epoch']
+        assert store.since(1, position['epoch'], position['seq']) is None
+        store.evict(1)
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_file_mirror_is_compacted(tmp_path):
+    path = str(tmp_path / 'session_1.journal')
+    journal = ChangeJournal.open(path, capacity=4, max_bytes=500)
+    for i in range(200):
+        fill(journal, 1, start=i)
+        # What the store's write-behind task does after each append
+        journal.mirror.write(journal.take_writes())
+    assert os.path.getsize(path) < 4 * 500 + 200
+    journal.mirror.close(journal.take_writes())
+
+    restored = ChangeJournal.open(path, capacity=4, max_bytes=500)
+    assert restored.last_seq == 200
+    assert [e['seq'] for e in restored.since(196)] == [197, 198, 199, 200]
+    restored.mirror.close(restored.take_writes())
+
+
+def test_events_committed_during_a_load_start_a_new_epoch(tmp_path):
+    async def scenario():
+        store = JournalStore(directory=str(tmp_path), capacity=8)
+        await store.load(1)
+        store.append(1, 'node_created', {'node': {'id': 1}})
+        epoch = store.position(1)['epoch']
+        store.evict(1)
+
+        loading = asyncio.create_task(store.load(1))
+        await asyncio.sleep(0)
+        assert store.append(1, 'node_deleted', {'node_id': 1}) is None
+        await loading
+        assert store.position(1)['epoch'] != epoch
+        store.evict(1)
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_appends_racing_the_write_behind_reach_the_file_once(tmp_path):
+    async def scenario():
+        store = JournalStore(directory=str(tmp_path), capacity=1000)
+        await store.load(1)
+        for i in range(300):
+            store.append(1, 'node_updated', {'node_id': i})
+            if i % 7 == 0:
+                await asyncio.sleep(0)  # lets the write-behind take what is there
+            if i % 50 == 0:
+                await store.flush(1)
+        store.evict(1)
+        await store.close()
+
+    asyncio.run(scenario())
+    with open(tmp_path / 'session_1.journal', 'rb') as f:
+        lines = f.read().splitlines()[1:]
+    assert [json.loads(line)['seq'] for line in lines] == list(range(1, 301))
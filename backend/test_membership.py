@@ -0,0 +1,62 @@
+"""
+Tests for the session membership cache (TTL expiry and invalidation).
+Run with: pytest test_membership.py
+"""
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pytest
+
+pytest.importorskip('sqlalchemy')
+
+from conftest import FakeDb
+from membership import EDGE, NODE, SESSION, MembershipCache
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = MembershipCache(ttl=10, clock=clock)
+    db = FakeDb(answer=7)
+
+    async def scenario():
+        assert await cache.node_session(db, 1) == 7
+        assert await cache.node_session(db, 1) == 7
+        assert db.queries == 1
+        clock.now = 9.9
+        assert cache.cached(NODE, 1) == 7
+        clock.now = 10
+        assert cache.cached(NODE, 1) is None
+        assert await cache.node_session(db, 1) == 7
+        assert db.queries == 2
+
+    asyncio.run(scenario())
+    assert cache.stats()['misses'] == 2
+
+
+def test_deletes_invalidate_here_and_on_other_workers():
+    cache = MembershipCache()
+    other = MembershipCache()
+    cache.subscribe(other.apply_invalidation)
+    for c in (cache, other):
+        c.apply_event(7, 'node_created', {'node': {'id': 1}})
+        c.apply_event(7, 'edge_created', {'edge': {'id': 2}})
+
+    cache.apply_event(7, 'edge_deleted', {'edge_id': 2})
+    assert cache.cached(EDGE, 2) is None and other.cached(EDGE, 2) is None
+    assert cache.cached(NODE, 1) == 7
+
+    cache.apply_event(7, 'node_deleted', {'node_id': 1})
+    assert cache.cached(NODE, 1) is None and other.cached(NODE, 1) is None
+    assert other.stats()['remote_invalidations'] == 2
+
+
+def test_deleting_a_session_forgets_its_rows():
+    cache = MembershipCache()
+    cache.remember(SESSION, 7, 7)
+    cache.remember(NODE, 1, 7)
+    cache.remember(NODE, 2, 8)
+    cache.invalidate(SESSION, 7)
+    assert cache.cached(SESSION, 7) is None
+    assert cache.cached(NODE, 1) is None
+    assert cache.cached(NODE, 2) == 8
@@ -0,0 +1,168 @@
+"""
+Tests for the per-session mutation queue (batched commits and fallback).
+Run with: pytest test_mutation_queue.py
+"""
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pytest
+
+from mutation_queue import MutationQueue
+
+
+def mutation(name, error=None):
+    async def apply(db):
+        db.applied.append(name)
+        if error is not None:
+            raise error
+        return name
+    return apply
+
+
+def submit_all(queue, session_id, mutations, committed):
+    """Submit everything before the worker runs, so it forms one batch"""
+    async def on_commit(result):
+        committed.append(result)
+
+    return asyncio.gather(
+        *(queue.submit(session_id, apply, on_commit) for apply in mutations),
+        return_exceptions=True,
+    )
+
+
+def test_queued_mutations_commit_in_one_transaction(fake_db, db_log):
+    async def scenario():
+        committed = []
+        queue = MutationQueue(fake_db)
+        results = await submit_all(queue, 1, [mutation('a'), mutation('b'), mutation('c')], committed)
+        assert results == ['a', 'b', 'c']
+        assert db_log == [('commit', ['a', 'b', 'c'])]
+        assert committed == ['a', 'b', 'c']
+        stats = queue.stats()
+        assert (stats['transactions'], stats['batched'], stats['retried']) == (1, 3, 0)
+        assert stats['active_sessions'] == 0
+
+    asyncio.run(scenario())
+
+
+def test_batches_are_capped_at_the_batch_size(fake_db, db_log):
+    async def scenario():
+        committed = []
+        queue = MutationQueue(fake_db, batch_size=2)
+        await submit_all(queue, 1, [mutation(n) for n in 'abcde'], committed)
+        assert [applied for _, applied in db_log] == [['a', 'b'], ['c', 'd'], ['e']]
+        assert committed == list('abcde')
+
+    asyncio.run(scenario())
+
+
+def test_validation_errors_fail_only_their_own_mutation(fake_db, db_log):
+    async def scenario():
+        committed = []
+        queue = MutationQueue(fake_db)
+        results = await submit_all(
+            queue, 1, [mutation('a'), mutation('bad', ValueError('Node not found')), mutation('c')], committed,
+        )
+        assert results[0] == 'a' and results[2] == 'c'
+        assert isinstance(results[1], ValueError)
+        assert db_log == [('commit', ['a', 'bad', 'c'])]
+        assert committed == ['a', 'c']
+        stats = queue.stats()
+        assert (stats['transactions'], stats['retried'], stats['failed']) == (1, 0, 1)
+
+    asyncio.run(scenario())
+
+
+def test_a_broken_batch_is_replayed_one_mutation_per_transaction(fake_db, db_log):
+    async def scenario():
+        committed = []
+        queue = MutationQueue(fake_db)
+        results = await submit_all(
+            queue, 1, [mutation('a'), mutation('bad', RuntimeError('constraint')), mutation('c')], committed,
+        )
+        assert results[0] == 'a' and results[2] == 'c'
+        assert isinstance(results[1], RuntimeError)
+        assert db_log == [
+            ('rollback', ['a', 'bad']),
+            ('commit', ['a']),
+            ('rollback', ['bad']),
+            ('commit', ['c']),
+        ]
+        assert committed == ['a', 'c']
+        stats = queue.stats()
+        assert (stats['transactions'], stats['batched'], stats['retried'], stats['failed']) == (2, 0, 3, 1)
+
+    asyncio.run(scenario())
+
+
+def test_a_single_failing_mutation_raises_to_its_caller(fake_db, db_log):
+    async def scenario():
+        queue = MutationQueue(fake_db)
+        with pytest.raises(RuntimeError):
+            await queue.submit(1, mutation('bad', RuntimeError('constraint')))
+        assert await queue.submit(1, mutation('next')) == 'next'
+        assert db_log == [('rollback', ['bad']), ('commit', ['next'])]
+        assert queue.stats()['retried'] == 0
+
+    asyncio.run(scenario())
+
+
+def test_a_validation_error_after_writing_fails_the_batch(fake_db, db_log):
+    from pydantic import BaseModel
+
+    class Row(BaseModel):
+        width: int
+
+    async def scenario():
+        async def read_back(db):
+            db.applied.append('bad')
+            return Row.model_validate({'width': 'notanumber'})
+
+        queue = MutationQueue(fake_db)
+        results = await submit_all(queue, 1, [mutation('a'), read_back, mutation('c')], [])
+        assert results[0] == 'a' and results[2] == 'c'
+        assert isinstance(results[1], ValueError)
+        assert db_log == [
+            ('rollback', ['a', 'bad']),
+            ('commit', ['a']),
+            ('rollback', ['bad']),
+            ('commit', ['c']),
+        ]
+
+    asyncio.run(scenario())
+
+
+def test_an_invalid_patch_in_a_batch_is_not_committed(sqlite_db):
+    import crud
+    import schemas
+
+    async def scenario():
+        engine, session_factory = await sqlite_db()
+        async with session_factory() as db:
+            session = await crud.create_session(db, 'Batch')
+            node = await crud.create_node(db, session.id, schemas.NodeCreate(content='Root'))
+
+        def update(patch):
+            async def apply(db):
+                updated = await crud.update_node_partial(db, node.id, patch, commit=False, session_id=session.id)
+                return schemas.Node.model_validate(updated).model_dump(mode='json')
+            return apply
+
+        queue = MutationQueue(session_factory)
+        committed = []
+        results = await submit_all(
+            queue, session.id, [update({'x': 5}), update({'width': 'notanumber'}), update({'y': 7})], committed,
+        )
+        assert isinstance(results[1], ValueError)
+        assert [(n['x'], n['y'], n['width']) for n in committed] == [(5, 100, 200), (5, 7, 200)]
+
+        async with session_factory() as db:
+            stored = await crud.get_node(db, node.id)
+            assert (stored.x, stored.y, stored.width) == (5, 7, 200)
+            board = await crud.load_compact_board(db, session.id)
+            assert board.to_wire()['nodes'][0]['width'] == 200
+        await engine.dispose()
+
+    asyncio.run(scenario())
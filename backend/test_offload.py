@@ -0,0 +1,100 @@
+"""
+Tests for the offload pools (pending bound, timeouts, cancellation, timings).
+Run with: pytest test_offload.py
+"""
+import asyncio
+import os
+import sys
+import threading
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pytest
+
+from offload import IO, Offloader, OffloadCancelled, OffloadRejected, OffloadTimeout
+
+
+def blocked(gate):
+    gate.wait(5)
+    return 'done'
+
+
+async def settle(offloader, kind=IO):
+    """Wait until the pool reports no jobs in flight"""
+    for _ in range(100):
+        if offloader.stats()['pending'].get(kind) == 0:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError('jobs still pending')
+
+
+def test_jobs_beyond_the_bound_are_rejected():
+    async def scenario():
+        offloader = Offloader(thread_workers=2, max_pending=1)
+        gate = threading.Event()
+        job = asyncio.create_task(offloader.run(IO, blocked, gate))
+        await asyncio.sleep(0)
+        with pytest.raises(OffloadRejected):
+            await offloader.run(IO, blocked, gate)
+        gate.set()
+        assert await job == 'done'
+        await settle(offloader)
+        assert offloader.stats()['rejected'] == 1
+        offloader.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_timed_out_jobs_keep_their_slot_until_they_finish():
+    async def scenario():
+        offloader = Offloader(thread_workers=2, max_pending=1)
+        gate = threading.Event()
+        with pytest.raises(OffloadTimeout):
+            await offloader.run(IO, blocked, gate, timeout=0.05)
+        # The worker is still busy with it
+        assert offloader.stats()['pending'] == {IO: 1}
+        with pytest.raises(OffloadRejected):
+            await offloader.run(IO, blocked, gate)
+        gate.set()
+        await settle(offloader)
+        assert await offloader.run(IO, blocked, gate) == 'done'
+        assert offloader.stats()['timeouts'] == 1
+        offloader.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_jobs_are_cancelled_with_their_owner():
+    async def scenario():
+        offloader = Offloader(thread_workers=2)
+        gate = threading.Event()
+        mine = asyncio.create_task(offloader.run(IO, blocked, gate, owner='sid-1'))
+        other = asyncio.create_task(offloader.run(IO, blocked, gate, owner='sid-2'))
+        await asyncio.sleep(0)
+        assert offloader.cancel_owner('sid-1') == 1
+        with pytest.raises(OffloadCancelled):
+            await mine
+        gate.set()
+        assert await other == 'done'
+        await settle(offloader)
+        stats = offloader.stats()
+        assert (stats['cancelled'], stats['completed'], stats['owners']) == (1, 1, 0)
+        offloader.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_completed_jobs_are_timed_by_name():
+    async def scenario():
+        offloader = Offloader(thread_workers=1)
+        for value in (1, 2):
+            assert await offloader.run(IO, abs, -value, name='abs') == value
+        with pytest.raises(TypeError):
+            await offloader.run(IO, abs, 'x', name='abs')
+        timing = offloader.stats()['jobs']['abs']
+        assert timing['count'] == 2
+        assert timing['avg_seconds'] == timing['total_seconds'] / 2
+        assert 0 <= timing['max_seconds'] <= timing['total_seconds']
+        assert offloader.stats()['failed'] == 1
+        offloader.shutdown()
+
+    asyncio.run(scenario())
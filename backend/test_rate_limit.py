@@ -0,0 +1,151 @@
+"""
+Tests for rate limiting, rate-limited patch replay, the room outbox and broadcast.
+Run with: pytest test_rate_limit.py
+"""
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pytest
+
+from rate_limit import DeferredPatches, RateLimiter, RoomOutbox
+
+
+class FakeSio:
+    """Records what the outbox sends, in order"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def emit(self, event, data, room=None, skip_sid=None):
+        self.sent.append((event, data))
+
+
+def drain(outbox, room='room'):
+    queue = outbox._rooms.get(room)
+    return queue.task if queue is not None else asyncio.sleep(0)
+
+
+# ==================== RATE LIMITER ====================
+
+def test_bucket_refills_and_reports_when_to_retry(clock):
+    limiter = RateLimiter({'node_update': (10, 2)}, clock=clock)
+    assert limiter.allow('a', 'node_update') and limiter.allow('a', 'node_update')
+    assert not limiter.allow('a', 'node_update')
+    assert limiter.retry_after('a', 'node_update') == 0.1
+    assert limiter.allow('b', 'node_update')  # buckets are per client
+    clock.now = 0.1
+    assert limiter.allow('a', 'node_update')
+    assert limiter.stats()['limited'] == {'node_update': 1}
+
+
+def test_dropped_patches_are_merged_and_replayed():
+    async def scenario():
+        replayed = []
+
+        async def replay(sid, data):
+            replayed.append((sid, data))
+
+        deferred = DeferredPatches(replay)
+        deferred.defer('a', 1, {'node_id': 1, 'patch': {'x': 1, 'y': 1}}, 0.01)
+        deferred.defer('a', 1, {'node_id': 1, 'patch': {'x': 2}}, 0.01)
+        deferred.defer('a', 2, {'node_id': 2, 'patch': {'x': 5}}, 0.01)
+        # An update that got through takes node 2's pending patch along
+        assert deferred.merge_into('a', 2, {'node_id': 2, 'patch': {'y': 6}}) == {'node_id': 2, 'patch': {'x': 5, 'y': 6}}
+        await asyncio.sleep(0.05)
+        assert replayed == [('a', {'node_id': 1, 'patch': {'x': 2, 'y': 1}})]
+        assert deferred.stats()['pending'] == 0
+
+        deferred.defer('a', 1, {'node_id': 1, 'patch': {'x': 3}}, 0.01)
+        deferred.forget('a')
+        await asyncio.sleep(0.05)
+        assert len(replayed) == 1
+
+    asyncio.run(scenario())
+
+
+# ==================== ROOM OUTBOX ====================
+
+def test_merged_messages_keep_the_latest_data_at_the_back():
+    async def scenario():
+        sio = FakeSio()
+        outbox = RoomOutbox(sio)
+        await outbox.emit('node_updated', {'x': 1}, room='room', merge_key=1)
+        await outbox.emit('node_created', {'id': 2}, room='room')
+        await outbox.emit('node_updated', {'x': 3}, room='room', merge_key=1)
+        await drain(outbox)
+        assert sio.sent == [('node_created', {'id': 2}), ('node_updated', {'x': 3})]
+        assert outbox.stats()['merged'] == 1
+
+    asyncio.run(scenario())
+
+
+def test_full_rooms_drop_the_oldest_droppable_message_first():
+    async def scenario():
+        sio = FakeSio()
+        outbox = RoomOutbox(sio, max_queue=3)
+        await outbox.emit('cursor', 1, room='room', droppable=True)
+        await outbox.emit('cursor', 2, room='room', droppable=True)
+        await outbox.emit('node_created', 'a', room='room')
+        await outbox.emit('node_created', 'b', room='room')  # drops cursor 1
+        await outbox.emit('node_created', 'c', room='room')  # drops cursor 2
+        await outbox.emit('cursor', 3, room='room', droppable=True)  # nothing left to drop
+        await drain(outbox)
+        assert sio.sent == [('node_created', 'a'), ('node_created', 'b'), ('node_created', 'c')]
+        assert outbox.stats()['dropped'] == 3
+
+    asyncio.run(scenario())
+
+
+def test_full_rooms_hold_back_messages_that_cannot_be_dropped():
+    async def scenario():
+        sio = FakeSio()
+        outbox = RoomOutbox(sio, max_queue=1)
+        await outbox.emit('node_created', 'a', room='room')
+        await outbox.emit('node_created', 'b', room='room')  # waits for 'a' to go out
+        await outbox.emit('node_created', 'c', room='room')
+        await drain(outbox)
+        assert sio.sent == [('node_created', 'a'), ('node_created', 'b'), ('node_created', 'c')]
+        assert outbox.stats()['backpressure_waits'] == 2
+        assert outbox.depth('room') == 0
+
+    asyncio.run(scenario())
+
+
+class Recorder:
+    """Stands in for one of main's per-session components, logging every call"""
+
+    def __init__(self, name, log):
+        self.name = name
+        self.log = log
+
+    def __getattr__(self, method):
+        def call(session_id, *args):
+            self.log.append((self.name, method))
+            return 7 if method == 'append' else None
+        return call
+
+
+def test_only_state_changes_reach_the_session_components(monkeypatch):
+    pytest.importorskip('fastapi')
+    import main
+
+    log = []
+    for name in ('residency', 'journals', 'boards', 'texts', 'membership', 'thumbnails'):
+        monkeypatch.setattr(main, name, Recorder(name, log))
+    sio = FakeSio()
+    outbox = RoomOutbox(sio)
+    monkeypatch.setattr(main, 'outbox', outbox)
+
+    async def scenario():
+        for i in range(30):
+            await main.broadcast(1, 'cursor_moved', {'x': i}, skip_sid='a', merge_key='a', droppable=True)
+        assert log == []
+        await main.broadcast(1, 'node_deleted', {'node_id': 3})
+        await drain(outbox, 'session_1')
+
+    asyncio.run(scenario())
+    assert [name for name, _ in log] == ['residency', 'journals', 'boards', 'texts', 'membership', 'thumbnails']
+    assert sio.sent[-1] == ('node_deleted', {'node_id': 3, 'seq': 7})
+    assert [event for event, _ in sio.sent].count('cursor_moved') >= 1
@@ -0,0 +1,167 @@
+"""
+Tests for the hot-session residency manager.
+Run with: pytest test_residency.py
+"""
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+from residency import ResidentComponent, SessionResidency
+
+
+class Component(ResidentComponent):
+    """Records loads, flushes and evictions; loads and flushes can be held up"""
+
+    def __init__(self, size=0):
+        self.size = size
+        self.loaded = set()
+        self.dirty = set()
+        self.log = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def load(self, session_id):
+        self.log.append(('load', session_id))
+        await self.gate.wait()
+        self.loaded.add(session_id)
+
+    def sizeof(self, session_id):
+        return self.size if session_id in self.loaded else 0
+
+    def is_dirty(self, session_id):
+        return session_id in self.dirty
+
+    async def flush(self, session_id):
+        self.log.append(('flush', session_id))
+        await self.gate.wait()
+        self.dirty.discard(session_id)
+
+    def evict(self, session_id):
+        self.log.append(('evict', session_id))
+        self.loaded.discard(session_id)
+
+
+def test_acquire_waiting_on_an_eviction_loads_the_session_again():
+    async def scenario():
+        residency = SessionResidency(lambda s: False)
+        component = residency.register(Component())
+        await residency.acquire(1)
+        component.dirty.add(1)
+
+        component.gate.clear()
+        evicting = asyncio.create_task(residency.evict(1))
+        await asyncio.sleep(0)  # the eviction holds the lock, flushing
+        acquiring = asyncio.create_task(residency.acquire(1))
+        await asyncio.sleep(0)
+        component.gate.set()
+        assert await evicting
+        await acquiring
+
+        assert residency.is_resident(1) and 1 in component.loaded
+        assert residency.stats()['loads'] == 2
+
+    asyncio.run(scenario())
+
+
+def test_pinned_sessions_survive_sweeps_until_released(clock):
+    async def scenario():
+        residency = SessionResidency(lambda s: False, memory_budget=0, idle_ttl=1, clock=clock)
+        component = residency.register(Component(size=100))
+
+        component.gate.clear()
+        inside = asyncio.Event()
+        leave = asyncio.Event()
+
+        async def use():
+            async with residency.pinned(1):
+                inside.set()
+                await leave.wait()
+
+        user = asyncio.create_task(use())
+        await asyncio.sleep(0)  # loading
+        # An eviction queued behind the load must not undo it
+        evicting = asyncio.create_task(residency.evict(1))
+        await asyncio.sleep(0)
+        component.gate.set()
+        await inside.wait()
+        assert not await evicting
+        assert residency.is_pinned(1)
+
+        for clock.now in (1, 2, 3):
+            await residency.sweep()
+        assert residency.is_resident(1) and 1 in component.loaded
+
+        leave.set()
+        await user
+        assert not residency.is_pinned(1)
+        await residency.sweep()
+        assert not residency.is_resident(1)
+
+    asyncio.run(scenario())
+
+
+def test_forced_evictions_ignore_pins():
+    async def scenario():
+        residency = SessionResidency(lambda s: False)
+        residency.register(Component())
+        async with residency.pinned(1):
+            assert not await residency.evict(1)
+            assert await residency.evict(1, force=True)
+        assert not residency.is_resident(1)
+
+    asyncio.run(scenario())
+
+
+def test_empty_rooms_are_evicted_once_idle_past_the_ttl(clock):
+    async def scenario():
+        occupied = {2}
+        residency = SessionResidency(lambda s: s in occupied, idle_ttl=10, clock=clock)
+        component = residency.register(Component())
+        component.dirty.add(1)
+        for session_id in (1, 2):
+            await residency.acquire(session_id)
+
+        await residency.sweep()  # notices room 1 is empty
+        clock.now = 9.9
+        await residency.sweep()
+        assert residency.is_resident(1)
+
+        clock.now = 10
+        await residency.sweep()
+        assert residency.sessions() == [2]
+        assert component.log[-2:] == [('flush', 1), ('evict', 1)]
+
+        # Activity resets the idle clock
+        occupied.clear()
+        await residency.sweep()
+        clock.now = 15
+        residency.touch(2)
+        await residency.sweep()
+        clock.now = 24.9
+        await residency.sweep()
+        assert residency.is_resident(2)
+        assert residency.stats()['evictions_idle'] == 1
+
+    asyncio.run(scenario())
+
+
+def test_over_budget_evicts_empty_rooms_then_least_recently_active(clock):
+    async def scenario():
+        occupied = {1, 2, 4}
+        residency = SessionResidency(lambda s: s in occupied, memory_budget=250, idle_ttl=1000, clock=clock)
+        residency.register(Component(size=100))
+        for session_id in (1, 2, 3, 4):
+            clock.now += 1
+            await residency.acquire(session_id)
+        clock.now += 1
+        residency.touch(1)
+        assert residency.sessions() == [2, 3, 4, 1]
+
+        # 400 bytes: the empty room 3 goes first, then 2 as the oldest
+        await residency.sweep()
+        assert residency.sessions() == [4, 1]
+        assert residency.footprint() == 200
+        assert residency.stats()['evictions_memory'] == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,206 @@
+"""
+Tests for session sharding (consistent hash ring and instance routing).
+Run with: pytest test_sharding.py
+"""
+import asyncio
+import multiprocessing
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pytest
+
+import sharding
+from mutation_queue import MutationQueue, SessionMoved
+from sharding import HashRing, ShardRouter, parse_instances
+
+INSTANCES = {name: f'http://{name}:8000' for name in ('a', 'b', 'c', 'd')}
+SESSIONS = range(1, 1001)
+
+
+def owned_sessions(instance_id, instances):
+    """Sessions an instance claims; run in a separate process per instance"""
+    router = ShardRouter(instance_id, instances[instance_id], instances)
+    return instance_id, [s for s in SESSIONS if router.owns(s)]
+
+
+def claims(instances):
+    """Ask one process per instance which sessions it owns"""
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(len(instances)) as pool:
+        return dict(pool.starmap(owned_sessions, [(i, instances) for i in instances]))
+
+
+def test_ring_spreads_keys_evenly():
+    ring = HashRing(INSTANCES, vnodes=64)
+    counts = {}
+    for key in range(10000):
+        counts[ring.owner(key)] = counts.get(ring.owner(key), 0) + 1
+    assert set(counts) == set(INSTANCES)
+    assert max(counts.values()) < 2 * min(counts.values())
+
+
+def test_ring_changes_only_move_keys_of_the_changed_instance():
+    ring = HashRing(INSTANCES)
+    before = {key: ring.owner(key) for key in range(10000)}
+
+    ring.add('e')
+    after = {key: ring.owner(key) for key in range(10000)}
+    moved = [key for key in before if before[key] != after[key]]
+    assert all(after[key] == 'e' for key in moved)
+    assert 0 < len(moved) < 10000 * 0.35
+
+    ring.remove('e')
+    assert {key: ring.owner(key) for key in range(10000)} == before
+
+
+def test_router_redirects_sessions_it_does_not_own():
+    router = ShardRouter('a', INSTANCES['a'], INSTANCES)
+    hints = {s: router.redirect(s) for s in SESSIONS}
+    assert any(hint is None for hint in hints.values())
+    for s, hint in hints.items():
+        if hint is not None:
+            assert hint['session_id'] == s
+            assert hint['url'] == INSTANCES[hint['instance']]
+            assert not router.owns(s)
+    assert router.stats()['redirects'] == sum(hint is not None for hint in hints.values())
+
+
+def test_single_instance_owns_everything():
+    router = ShardRouter('solo', '', {})
+    assert not router.enabled
+    assert all(router.owns(s) for s in SESSIONS)
+    assert router.set_instances({'other': 'http://other:8000'})
+    assert router.enabled
+    assert not router.set_instances({'other': 'http://other:8000'})
+
+
+def test_parse_instances():
+    assert parse_instances('a=http://a:8000, b=http://b:8000,') == {'a': 'http://a:8000', 'b': 'http://b:8000'}
+    assert parse_instances('') == {}
+
+
+def test_processes_agree_on_ownership():
+    owned = claims(INSTANCES)
+    # Every session is owned by exactly one instance
+    all_claims = sorted(s for sessions in owned.values() for s in sessions)
+    assert all_claims == list(SESSIONS)
+
+    # When an instance leaves, only its sessions change hands
+    remaining = {k: v for k, v in INSTANCES.items() if k != 'd'}
+    owned_after = claims(remaining)
+    assert sorted(s for sessions in owned_after.values() for s in sessions) == list(SESSIONS)
+    for instance in remaining:
+        assert set(owned[instance]) <= set(owned_after[instance])
+
+
+def test_ownership_is_handed_off_without_overlap(clock):
+    old = {'a': INSTANCES['a'], 'b': INSTANCES['b']}
+    new = {**old, 'c': INSTANCES['c']}
+    a = ShardRouter('a', old['a'], old, dynamic=True, drain=1, grace=3, clock=clock)
+    c = ShardRouter('c', new['c'], new, dynamic=True, drain=1, grace=3, clock=clock)
+    moved = [s for s in SESSIONS if a.owns(s) and c.owner(s) == 'c']
+    kept = [s for s in SESSIONS if a.owns(s) and c.owner(s) == 'a']
+    assert moved and kept
+
+    # A joining instance takes nothing over until the grace period is up
+    assert not any(c.accepts(s) for s in moved)
+    assert c.handoff_delay(moved[0]) == 3
+    clock.now = 3
+    assert a.accepts(moved[0])
+
+    a.set_instances(new)
+    assert all(a.accepts(s) for s in moved + kept)  # draining
+    clock.now = 4
+    assert not any(a.accepts(s) for s in moved)
+    assert all(a.accepts(s) for s in kept)
+    assert c.accepts(moved[0]) and c.handoff_delay(moved[0]) == 0
+
+
+def test_late_first_membership_still_waits_for_the_grace_period(clock):
+    b = ShardRouter('b', INSTANCES['b'], dynamic=True, drain=1, grace=3, clock=clock)
+    # The first refresh arrives after the grace period, e.g. the database was slow
+    clock.now = 3
+    b.set_instances({'a': INSTANCES['a'], 'b': INSTANCES['b']})
+    moved = [s for s in SESSIONS if b.owns(s)]
+    assert moved and not any(b.accepts(s) for s in moved)
+    assert b.handoff_delay(moved[0]) == 3
+    clock.now = 6
+    assert all(b.accepts(s) for s in moved)
+
+
+def test_instance_stops_writing_when_its_heartbeat_lapses(clock):
+    router = ShardRouter('a', INSTANCES['a'], INSTANCES, dynamic=True, grace=0, lease=15, clock=clock)
+    owned = [s for s in SESSIONS if router.owns(s)]
+    assert router.accepts(owned[0])
+    clock.now = 15
+    assert not router.accepts(owned[0])
+    # Static membership never changes, so it needs no lease
+    static = ShardRouter('a', INSTANCES['a'], INSTANCES, clock=clock)
+    assert static.accepts(owned[0])
+
+
+def test_sharded_instance_needs_a_url(monkeypatch):
+    monkeypatch.setattr(sharding, 'SHARD_INSTANCE_ID', 'a')
+    monkeypatch.setattr(sharding, 'SHARD_INSTANCE_URL', '')
+    monkeypatch.setattr(sharding, 'SHARD_INSTANCES', 'a=http://a:8000,b=http://b:8000')
+    assert ShardRouter.from_env().url == 'http://a:8000'
+    monkeypatch.setattr(sharding, 'SHARD_INSTANCES', 'b=http://b:8000')
+    with pytest.raises(RuntimeError):
+        ShardRouter.from_env()
+    monkeypatch.setattr(sharding, 'SHARD_INSTANCES', '')
+    assert ShardRouter.from_env().url == ''
+
+
+def test_mutation_queue_refuses_sessions_it_lost(fake_db, db_log):
+    async def scenario():
+        owned = {1}
+        queue = MutationQueue(fake_db, fence=lambda s: s in owned)
+
+        async def apply(db):
+            # Ownership moves while the mutation runs
+            owned.discard(1)
+            return 'written'
+
+        with pytest.raises(SessionMoved):
+            await queue.submit(1, apply)
+        with pytest.raises(SessionMoved):
+            await queue.submit(1, apply)
+        assert db_log == [('rollback', [])]  # nothing was committed
+        assert queue.stats()['fenced'] == 2
+
+    asyncio.run(scenario())
+
+
+def test_two_routers_rebalance_over_one_database(sqlite_db, clock):
+    async def scenario():
+        engine, session_factory = await sqlite_db('shards.db')
+        a = ShardRouter('a', INSTANCES['a'], dynamic=True, drain=1, grace=3, clock=clock)
+        b = ShardRouter('b', INSTANCES['b'], dynamic=True, drain=1, grace=3, clock=clock)
+
+        await a.refresh(session_factory)
+        clock.now = 3
+        assert all(a.accepts(s) for s in SESSIONS)
+
+        # b joins; a learns about it on its next heartbeat
+        await b.refresh(session_factory)
+        assert await a.refresh(session_factory)
+        assert a.instances == b.instances == {'a': INSTANCES['a'], 'b': INSTANCES['b']}
+        assert all(a.owns(s) != b.owns(s) for s in SESSIONS)
+        moved = [s for s in SESSIONS if b.owns(s)]
+        assert moved
+        clock.now = 4
+        assert not any(a.accepts(s) or b.accepts(s) for s in moved)
+        clock.now = 6
+        assert all(b.accepts(s) and not a.accepts(s) for s in moved)
+
+        # b leaves; its sessions go back to a after the grace period
+        await b.leave(session_factory)
+        assert await a.refresh(session_factory)
+        assert all(a.owns(s) for s in SESSIONS)
+        assert not any(a.accepts(s) for s in moved)
+        clock.now = 9
+        assert all(a.accepts(s) for s in SESSIONS)
+        await engine.dispose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,128 @@
+"""
+Tests for streamed initial state (viewport order, edge placement, chunk framing).
+Run with: pytest test_state_stream.py
+"""
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pytest
+
+import state_stream
+from compact_board import CompactBoard
+from journal import JournalStore
+from residency import ResidentComponent, SessionResidency
+
+
+def board_at(*positions, edges=()):
+    """Nodes 1..n at `positions`, and edges given as (id, source, target)"""
+    rows = [(i, f'n{i}', x, y, 10, 10, {}, None, None) for i, (x, y) in enumerate(positions, 1)]
+    return CompactBoard.from_rows(1, rows, [(edge_id, s, t, None) for edge_id, s, t in edges])
+
+
+async def collect(chunks):
+    return [([n['id'] for n in nodes], [e['id'] for e in edges]) async for nodes, edges in chunks]
+
+
+def test_board_chunks_start_at_the_viewport():
+    board = board_at((2000, 0), (0, 0), (50, 50), (500, 500), (10, 0),
+                     edges=[(10, 2, 5), (11, 2, 1), (12, 3, 4)])
+    chunks = asyncio.run(collect(state_stream.board_chunks(board, (0, 0), chunk_size=2)))
+    # Each edge comes with the chunk that completes both of its endpoints
+    assert chunks == [([2, 5], [10]), ([3, 4], [12]), ([1], [11])]
+
+
+def test_board_chunks_skip_rows_deleted_mid_stream():
+    board = board_at((0, 0), (10, 0), (20, 0), (30, 0), edges=[(10, 3, 4)])
+
+    async def scenario():
+        chunks = state_stream.board_chunks(board, (0, 0), chunk_size=2)
+        first = await chunks.__anext__()
+        board.remove_node(4)
+        return [[n['id'] for n in first[0]]] + [ids for ids, _ in await collect(chunks)]
+
+    assert asyncio.run(scenario()) == [[1, 2], [3]]
+
+
+def test_empty_boards_stream_one_empty_chunk():
+    assert asyncio.run(collect(state_stream.board_chunks(CompactBoard(1), (0, 0)))) == [([], [])]
+
+
+def test_viewport_center():
+    assert state_stream.viewport_center(None) == (0.0, 0.0)
+    assert state_stream.viewport_center({'x': 10, 'y': -20, 'width': 100, 'height': 40}) == (60.0, 0.0)
+
+
+class FakeSio:
+    def __init__(self):
+        self.sent = []
+
+    async def emit(self, event, data, to=None, **kwargs):
+        self.sent.append((event, data))
+
+
+def test_chunks_are_numbered_and_the_last_is_done(monkeypatch):
+    pytest.importorskip('fastapi')
+    import main
+
+    sio = FakeSio()
+    monkeypatch.setattr(main, 'sio', sio)
+
+    async def chunks(count):
+        for i in range(count):
+            yield [{'id': i}], []
+
+    async def scenario():
+        await main.send_initial_state_chunks('sid', 1, chunks(3), 3, 0, journal={'epoch': 'e', 'seq': 4})
+        await main.send_initial_state_chunks('sid', 1, chunks(0), 0, 0)
+
+    asyncio.run(scenario())
+    framing = [(d['seq'], [n['id'] for n in d['nodes']], d['done']) for _, d in sio.sent]
+    assert framing == [(0, [0], False), (1, [1], False), (2, [2], True), (0, [], True)]
+    assert all(event == 'initial_state_chunk' for event, _ in sio.sent)
+    assert sio.sent[0][1]['journal'] == {'epoch': 'e', 'seq': 4}
+    assert sio.sent[0][1]['total_nodes'] == 3
+
+
+def test_database_stream_sends_nodes_nearest_first_then_edges(sqlite_db):
+    import crud
+    from schemas import EdgeCreate, NodeCreate
+
+    async def scenario():
+        engine, session_factory = await sqlite_db()
+        async with session_factory() as db:
+            session = await crud.create_session(db, 'Stream')
+            far = await crud.create_node(db, session.id, NodeCreate(content='far', x=900, y=900))
+            near = await crud.create_node(db, session.id, NodeCreate(content='near', x=110, y=90))
+            mid = await crud.create_node(db, session.id, NodeCreate(content='mid', x=300, y=100))
+            edge = await crud.create_edge(db, session.id, EdgeCreate(source_id=near.id, target_id=far.id))
+            other = await crud.create_session(db, 'Other')
+            await crud.create_node(db, other.id, NodeCreate(content='elsewhere', x=100, y=100))
+
+        async with session_factory() as db:
+            assert await crud.count_session_rows(db, session.id) == (3, 1)
+            chunks = await collect(crud.stream_session_state(db, session.id, (100, 100), 2))
+        assert chunks == [([near.id, mid.id], []), ([far.id], []), ([], [edge.id])]
+        await engine.dispose()
+
+    asyncio.run(scenario())
+
+
+class FailingLoad(ResidentComponent):
+    async def load(self, session_id):
+        raise RuntimeError('database unavailable')
+
+
+def test_a_journal_loaded_ahead_is_dropped_when_the_session_fails_to_load():
+    async def scenario():
+        residency = SessionResidency(lambda s: False)
+        journals = residency.register(JournalStore(directory=None))
+        residency.register(FailingLoad())
+        # What a streamed join does before warming the session
+        await journals.load(1)
+        with pytest.raises(RuntimeError):
+            await residency.acquire(1)
+        assert journals.get(1) is None and not residency.is_resident(1)
+
+    asyncio.run(scenario())
@@ -0,0 +1,112 @@
+"""
+Tests for the storage backends (URL handling and SQLite connection setup).
+Run with: pytest test_storage.py
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pytest
+
+from storage import PostgresBackend, SQLiteBackend, get_backend
+
+
+def test_backend_is_chosen_by_scheme():
+    assert isinstance(get_backend('postgresql://u:p@localhost/db'), PostgresBackend)
+    assert isinstance(get_backend('postgresql+asyncpg://u:p@localhost/db'), PostgresBackend)
+    assert isinstance(get_backend('sqlite:///./mindmap.db'), SQLiteBackend)
+    assert isinstance(get_backend('sqlite+aiosqlite:///:memory:'), SQLiteBackend)
+    with pytest.raises(ValueError):
+        get_backend('mysql://localhost/db')
+
+
+def test_urls_get_the_async_driver():
+    assert PostgresBackend().normalize_url('postgresql://u:p@h/db') == 'postgresql+asyncpg://u:p@h/db'
+    assert PostgresBackend().normalize_url('postgres://u:p@h/db') == 'postgresql+asyncpg://u:p@h/db'
+    assert PostgresBackend().normalize_url('postgresql+asyncpg://u:p@h/db') == 'postgresql+asyncpg://u:p@h/db'
+    assert SQLiteBackend().normalize_url('sqlite:///./x.db') == 'sqlite+aiosqlite:///./x.db'
+    assert SQLiteBackend().normalize_url('sqlite+aiosqlite:///./x.db') == 'sqlite+aiosqlite:///./x.db'
+
+
+def test_sqlite_file_connections_are_tuned(tmp_path):
+    path = tmp_path / 'mindmap.db'
+    connection = sqlite3.connect(path)
+    SQLiteBackend().apply_pragmas(connection, f'sqlite+aiosqlite:///{path}')
+    pragma = lambda name: connection.execute(f'PRAGMA {name}').fetchone()[0]
+    assert pragma('journal_mode') == 'wal'
+    assert pragma('foreign_keys') == 1
+    assert pragma('synchronous') == 1  # NORMAL
+    assert pragma('temp_store') == 2  # MEMORY
+    connection.close()
+
+
+def test_sqlite_memory_databases_skip_file_pragmas():
+    backend = SQLiteBackend()
+    assert backend.is_memory('sqlite+aiosqlite:///:memory:')
+    assert backend.is_memory('sqlite+aiosqlite://')
+    assert not backend.is_memory('sqlite+aiosqlite:///./mindmap.db')
+    names = [name for name, _ in backend.pragmas('sqlite+aiosqlite:///:memory:')]
+    assert 'foreign_keys' in names and 'journal_mode' not in names
+
+
+def test_alembic_mode_finds_the_migration_head():
+    # alembic.config, not alembic: the local migrations directory is importable as `alembic`
+    pytest.importorskip('alembic.config')
+    import database
+    assert database._alembic_heads() == {'0001'}
+
+
+def test_crud_round_trip_on_sqlite(sqlite_db):
+    from datetime import timezone
+    import crud
+    from schemas import EdgeCreate, NodeCreate
+
+    async def scenario():
+        engine, session_factory = await sqlite_db('crud.db')
+        async with session_factory() as db:
+            session = await crud.create_session(db, 'Round trip')
+            root = await crud.create_node(db, session.id, NodeCreate(content='Root', x=10, y=20, style={'color': '#fff'}))
+            child = await crud.create_node(db, session.id, NodeCreate(content='Child', x=30, y=40))
+            edge = await crud.create_edge(db, session.id, EdgeCreate(source_id=root.id, target_id=child.id))
+
+        async with session_factory() as db:
+            assert (await crud.get_session(db, session.id)).title == 'Round trip'
+            state = await crud.get_session_state(db, session.id)
+            assert sorted((n.content, n.x, n.y) for n in state.nodes) == [('Child', 30, 40), ('Root', 10, 20)]
+            assert [(e.source_id, e.target_id) for e in state.edges] == [(root.id, child.id)]
+            stored = await crud.get_node(db, root.id)
+
+            # The compact board reads the same rows; SQLite's naive times are UTC
+            board = (await crud.load_compact_board(db, session.id)).to_wire()
+            wire_root = next(n for n in board['nodes'] if n['id'] == root.id)
+            assert wire_root['content'] == 'Root' and wire_root['style'] == {'color': '#fff'}
+            expected = stored.created_at.replace(tzinfo=stored.created_at.tzinfo or timezone.utc)
+            assert wire_root['created_at'] == expected.isoformat().replace('+00:00', 'Z')
+            assert [e['id'] for e in board['edges']] == [edge.id]
+
+            # Updates and deletes are scoped to the session they name
+            assert await crud.update_node_partial(db, root.id, {'x': 50}, session_id=session.id + 1) is None
+            assert not await crud.delete_edge(db, edge.id, session_id=session.id + 1)
+            assert not await crud.delete_node(db, child.id, session_id=session.id + 1)
+            moved = await crud.update_node_partial(db, root.id, {'x': 50, 'session_id': 99}, session_id=session.id)
+            assert (moved.x, moved.session_id) == (50, session.id)
+
+            assert await crud.delete_edge(db, edge.id, session_id=session.id)
+            assert await crud.delete_node(db, child.id, session_id=session.id)
+            assert [n.id for n in await crud.get_nodes_by_session(db, session.id)] == [root.id]
+        await engine.dispose()
+
+    asyncio.run(scenario())
+
+
+def test_naive_sqlite_times_are_read_as_utc():
+    from datetime import datetime, timezone
+    from compact_board import CompactBoard
+
+    naive = datetime(2026, 1, 2, 3, 4, 5)
+    board = CompactBoard.from_rows(1, [(1, 'a', 0, 0, 10, 10, {}, naive, '2026-01-02 03:04:05')], [])
+    node = board.to_wire()['nodes'][0]
+    assert node['created_at'] == node['updated_at'] == '2026-01-02T03:04:05Z'
+    assert board.node_created[0] == naive.replace(tzinfo=timezone.utc).timestamp()
@@ -0,0 +1,169 @@
+"""
+Tests for collaborative node text (operations, transformation, documents).
+Run with: pytest test_text_sync.py
+"""
+import asyncio
+import os
+import random
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pytest
+
+from compact_board import CompactBoard
+from text_sync import TextDocument, TextDocuments, apply, normalize, replace, transform
+
+
+def random_op(text, rng):
+    """A random valid operation over `text`"""
+    op = []
+    remaining = len(text)
+    while remaining:
+        n = rng.randint(1, remaining)
+        kind = rng.random()
+        if kind < 0.4:
+            op.append(n)
+        elif kind < 0.7:
+            op.append(-n)
+        else:
+            op.append(rng.choice(['a', 'bc', 'xyz']))
+            continue
+        remaining -= n
+    if rng.random() < 0.5:
+        op.append('end')
+    return normalize(op)
+
+
+def test_apply_retain_insert_delete():
+    assert apply('hello world', [6, -5, 'there']) == 'hello there'
+    assert apply('', ['abc']) == 'abc'
+    with pytest.raises(ValueError):
+        apply('short', [10])
+
+
+def test_normalize_merges_and_rejects():
+    assert normalize([2, 3, 'a', 'b', -1, -1, 0]) == [5, 'ab', -2]
+    with pytest.raises(ValueError):
+        normalize([1.5])
+    with pytest.raises(ValueError):
+        normalize('not a list')
+
+
+def test_positions_count_utf16_units():
+    # An emoji is two UTF-16 code units, as in JavaScript
+    assert apply('a😀b', [4, '!']) == 'a😀b!'
+    assert apply('a😀b', [1, -2, 1]) == 'ab'
+    assert replace('a😀b', 'a😀c') == [3, 'c', -1]
+
+
+def test_replace_builds_minimal_edit():
+    assert replace('hello world', 'hello there world') == [6, 'there ', 5]
+    assert apply('abcdef', replace('abcdef', 'abXYef')) == 'abXYef'
+    assert replace('same', 'same') == [4]
+
+
+def test_concurrent_inserts_at_same_position_converge():
+    a, b = ['X', 3], ['Y', 3]
+    a2, b2 = transform(a, b)
+    assert apply(apply('abc', a), b2) == apply(apply('abc', b), a2) == 'XYabc'
+
+
+def test_transform_converges_on_random_operations():
+    rng = random.Random(42)
+    for _ in range(500):
+        text = ''.join(rng.choice('abcdef') for _ in range(rng.randint(0, 12)))
+        a, b = random_op(text, rng), random_op(text, rng)
+        a2, b2 = transform(a, b)
+        assert apply(apply(text, a), b2) == apply(apply(text, b), a2)
+
+
+def test_document_transforms_stale_edits():
+    doc = TextDocument('hello')
+    # Two clients both based on revision 0
+    doc.receive(0, [5, ' world'])
+    applied = doc.receive(0, ['oh, ', 5])
+    assert doc.text == 'oh, hello world'
+    assert doc.revision == 2
+    assert applied == ['oh, ', 11]
+    assert doc.dirty
+
+
+def test_document_rejects_revisions_outside_history():
+    doc = TextDocument('', history=2)
+    for i in range(3):
+        doc.receive(i, normalize([i, 'x']))
+    with pytest.raises(ValueError):
+        doc.receive(0, ['y', 3])  # revision 1's op was dropped
+    with pytest.raises(ValueError):
+        doc.receive(4, ['y', 3])  # never handed out
+
+
+def test_many_clients_converge_through_server():
+    rng = random.Random(7)
+    doc = TextDocument('collaborate')
+    # Each client edits its own copy based on the revision it last saw
+    clients = [{'revision': 0, 'text': doc.text} for _ in range(4)]
+    for _ in range(200):
+        client = rng.choice(clients)
+        op = random_op(client['text'], rng)
+        doc.receive(client['revision'], op)
+        if rng.random() < 0.5:
+            client['revision'], client['text'] = doc.revision, doc.text
+    assert doc.revision == 200
+
+
+class FakeMutations:
+    def __init__(self):
+        self.written = {}
+
+    async def submit(self, session_id, apply, on_commit=None):
+        result = await apply(self.written)
+        if on_commit is not None:
+            await on_commit(result)
+        return result
+
+
+class FakeBoards:
+    def __init__(self, board):
+        self.board = board
+
+    def get(self, session_id):
+        return self.board
+
+
+def test_store_materializes_dirty_documents():
+    board = CompactBoard.from_rows(1, [(10, 'draft', 0, 0, 200, 100, {}, None, None)], [])
+    mutations = FakeMutations()
+
+    async def update_content(db, node_id, content):
+        db[node_id] = content
+
+    texts = TextDocuments(mutations, FakeBoards(board), update_content)
+    revision, op = texts.edit(1, 10, 0, [5, ' v2'])
+    board.apply_event('node_text_edited', {'node_id': 10, 'revision': revision, 'op': op})
+    assert board.content(10) == 'draft v2'
+    assert texts.is_dirty(1)
+
+    asyncio.run(texts.flush(1))
+    assert mutations.written == {10: 'draft v2'}
+    assert not texts.is_dirty(1)
+
+    texts.apply_event(1, 'node_deleted', {'node_id': 10})
+    assert texts.get(1, 10) is None
+    with pytest.raises(ValueError):
+        texts.edit(1, 99, 0, ['x'])
+
+
+def test_stamp_puts_live_text_and_revisions_on_nodes():
+    board = CompactBoard.from_rows(1, [(10, 'draft', 0, 0, 200, 100, {}, None, None),
+                                       (11, 'other', 0, 0, 200, 100, {}, None, None)], [])
+    texts = TextDocuments(FakeMutations(), FakeBoards(board), None)
+    # Rows read before the edits, as a streamed chunk may be
+    nodes = list(board.iter_nodes())
+    texts.edit(1, 10, 0, [5, '!'])
+    texts.edit(1, 10, 1, [6, '?'])
+
+    assert texts.stamp(1, nodes) == {10: 2}
+    assert [node['content'] for node in nodes] == ['draft!?', 'other']
+    assert texts.revisions(1) == {10: 2}
+    assert texts.stamp(2, nodes) == {}
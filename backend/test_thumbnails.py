@@ -0,0 +1,123 @@
+"""
+Tests for board thumbnails (colour sanitization, caching and the ETag path).
+Run with: pytest test_thumbnails.py
+"""
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pytest
+
+from compact_board import CompactBoard
+from thumbnails import ThumbnailCache, render_thumbnail
+
+
+def board_with(*styles):
+    rows = [(i, 'n', i * 300, 0, 200, 100, style, None, None) for i, style in enumerate(styles, 1)]
+    return CompactBoard.from_rows(1, rows, [(10, 1, len(styles), None)])
+
+
+@pytest.fixture
+def inline_render(monkeypatch):
+    """Render in the test process instead of the process pool"""
+    async def offload(board):
+        return render_thumbnail(board)
+
+    monkeypatch.setattr(render_thumbnail, 'offload', offload)
+
+
+def test_only_hex_colours_reach_the_markup():
+    svg = render_thumbnail(board_with(
+        {'backgroundColor': '#abc'},
+        {'color': '#12ab34cc'},
+        {'color': 'red'},
+        {'backgroundColor': '#fff" onload="alert(1)'},
+        {'color': '"/><script>alert(1)</script>'},
+    ))
+    assert 'fill="#abc"' in svg and 'fill="#12ab34cc"' in svg
+    assert 'red' not in svg and 'onload' not in svg and '<script' not in svg
+    assert svg.count('<rect x=') == 5 and svg.count('<line ') == 1
+
+
+def test_empty_boards_render_a_blank_image():
+    svg = render_thumbnail(CompactBoard(1), width=32, height=20)
+    assert svg.startswith('<svg') and svg.endswith('</svg>') and '<rect x=' not in svg
+
+
+def test_stale_thumbnails_are_rerendered_after_the_debounce(clock, inline_render):
+    async def scenario():
+        loads = []
+        board = board_with({})
+
+        async def load_board(session_id):
+            loads.append(session_id)
+            return board.snapshot()
+
+        cache = ThumbnailCache(debounce=5, clock=clock)
+        etag, svg = await cache.get(1, load_board)
+        assert await cache.get(1, load_board) == (etag, svg)
+
+        board.upsert_node({'id': 9, 'content': '', 'x': 0, 'y': 500, 'width': 10, 'height': 10})
+        cache.invalidate(1)
+        clock.now = 4.9
+        assert await cache.get(1, load_board) == (etag, svg)  # stale, inside the debounce window
+        clock.now = 5
+        new_etag, new_svg = await cache.get(1, load_board)
+        assert new_etag != etag and new_svg != svg
+        assert loads == [1, 1]
+        stats = cache.stats()
+        assert (stats['hits'], stats['stale_hits'], stats['renders']) == (1, 1, 2)
+
+    asyncio.run(scenario())
+
+
+def test_versions_are_only_kept_for_cached_sessions(inline_render):
+    async def scenario():
+        async def load_board(session_id):
+            return None if session_id == 404 else board_with({})
+
+        cache = ThumbnailCache(max_entries=2)
+        for session_id in range(100):
+            cache.invalidate(session_id)
+        assert cache.stats()['versions'] == 0
+
+        for session_id in (1, 2, 3):
+            await cache.get(session_id, load_board)
+            cache.invalidate(session_id)
+        assert await cache.get(404, load_board) is None
+        stats = cache.stats()
+        assert (stats['cached'], stats['versions']) == (2, 2)
+        assert cache.version(1) == 0 and cache.version(3) == 1
+
+    asyncio.run(scenario())
+
+
+class FakeRequest:
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+
+
+def test_thumbnail_route_answers_304_for_a_matching_etag(monkeypatch, inline_render):
+    pytest.importorskip('fastapi')
+    import main
+
+    async def load_board(session_id):
+        return board_with({'color': '#123456'})
+
+    monkeypatch.setattr(main, 'thumbnails', ThumbnailCache())
+    monkeypatch.setattr(main, 'load_thumbnail_board', load_board)
+
+    async def scenario():
+        response = await main.get_session_thumbnail(1, FakeRequest())
+        etag = response.headers['etag']
+        assert response.status_code == 200 and response.media_type == 'image/svg+xml'
+        assert b'#123456' in response.body
+
+        cached = await main.get_session_thumbnail(1, FakeRequest({'if-none-match': etag}))
+        assert cached.status_code == 304 and cached.body == b''
+        assert cached.headers['etag'] == etag
+        other = await main.get_session_thumbnail(1, FakeRequest({'if-none-match': '"other"'}))
+        assert other.status_code == 200
+
+    asyncio.run(scenario())
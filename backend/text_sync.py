@@ -0,0 +1,331 @@
+"""
+Collaborative editing of node content with operational transformation.
+
+An edit is a compact operation over the current text, a list of components:
+a positive int retains that many characters, a negative int deletes that many
+and a string inserts itself. Changing one word of a long note is therefore
+something like `[120, -5, "hello", 300]`, not the whole content. Positions
+count UTF-16 code units so they match JavaScript string indices.
+
+The server keeps one `TextDocument` per node being edited. A client sends its
+operation together with the revision it was based on; the server transforms
+it against everything committed since, applies it and broadcasts the result
+with the new revision. Documents are materialized to `Node.content` in the
+background (TEXT_MATERIALIZE_INTERVAL) and before their session is evicted,
+so database writes follow the edit rate of a node, not its keystrokes.
+"""
+import asyncio
+import os
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from residency import ResidentComponent
+
+TEXT_HISTORY = int(os.getenv("TEXT_HISTORY", "256"))
+TEXT_MAX_LENGTH = int(os.getenv("TEXT_MAX_LENGTH", "100000"))
+TEXT_MATERIALIZE_INTERVAL = float(os.getenv("TEXT_MATERIALIZE_INTERVAL", "5"))
+
+Component = Union[int, str]
+Operation = List[Component]
+
+
+# ==================== OPERATIONS ====================
+
+def _units(text: str) -> int:
+    """Length in UTF-16 code units"""
+    return len(text.encode('utf-16-le', 'surrogatepass')) // 2
+
+
+def _is_retain(c) -> bool:
+    return isinstance(c, int) and not isinstance(c, bool) and c > 0
+
+
+def _is_delete(c) -> bool:
+    return isinstance(c, int) and not isinstance(c, bool) and c < 0
+
+
+def _is_insert(c) -> bool:
+    return isinstance(c, str)
+
+
+def _push(op: Operation, c: Component) -> None:
+    """Append a component, merging it with the previous one of the same kind"""
+    if c == 0 or c == '':
+        return
+    if op:
+        last = op[-1]
+        if (_is_retain(last) and _is_retain(c)) or (_is_delete(last) and _is_delete(c)) \
+                or (_is_insert(last) and _is_insert(c)):
+            op[-1] = last + c
+            return
+        # Keep inserts ahead of deletes so equal edits have one representation
+        if _is_delete(last) and _is_insert(c):
+            if len(op) > 1 and _is_insert(op[-2]):
+                op[-2] += c
+            else:
+                op.insert(len(op) - 1, c)
+            return
+    op.append(c)
+
+
+def normalize(op: Any) -> Operation:
+    """Validate an operation received from a client and merge its components"""
+    if not isinstance(op, list):
+        raise ValueError('Text operation must be a list')
+    result: Operation = []
+    for c in op:
+        if not (_is_retain(c) or _is_delete(c) or _is_insert(c) or c == 0):
+            raise ValueError('Invalid text operation component')
+        _push(result, c)
+    return result
+
+
+def base_length(op: Operation) -> int:
+    """Length of the text the operation applies to"""
+    return sum(abs(c) for c in op if not _is_insert(c))
+
+
+def target_length(op: Operation) -> int:
+    """Length of the text the operation produces"""
+    return sum(c if _is_retain(c) else _units(c) for c in op if not _is_delete(c))
+
+
+def apply(text: str, op: Operation) -> str:
+    """Apply an operation to `text`"""
+    data = text.encode('utf-16-le', 'surrogatepass')
+    if base_length(op) * 2 != len(data):
+        raise ValueError('Text operation does not match the document length')
+    parts = []
+    pos = 0
+    for c in op:
+        if _is_retain(c):
+            parts.append(data[pos:pos + 2 * c])
+            pos += 2 * c
+        elif _is_delete(c):
+            pos -= 2 * c
+        else:
+            parts.append(c.encode('utf-16-le', 'surrogatepass'))
+    return b''.join(parts).decode('utf-16-le', 'surrogatepass')
+
+
+def transform(a: Operation, b: Operation) -> Tuple[Operation, Operation]:
+    """
+    Transform two concurrent operations on the same text into `(a', b')` so
+    that applying a then b' equals applying b then a'. When both insert at the
+    same position, a's insert goes first.
+    """
+    if base_length(a) != base_length(b):
+        raise ValueError('Concurrent text operations have different base lengths')
+    a_prime: Operation = []
+    b_prime: Operation = []
+    ia, ib = iter(a), iter(b)
+    ca, cb = next(ia, None), next(ib, None)
+    while ca is not None or cb is not None:
+        if ca is not None and _is_insert(ca):
+            _push(a_prime, ca)
+            _push(b_prime, _units(ca))
+            ca = next(ia, None)
+            continue
+        if cb is not None and _is_insert(cb):
+            _push(a_prime, _units(cb))
+            _push(b_prime, cb)
+            cb = next(ib, None)
+            continue
+        # Both are retains or deletes over the same stretch of the base text
+        la, lb = abs(ca), abs(cb)
+        n = min(la, lb)
+        if _is_retain(ca) and _is_retain(cb):
+            _push(a_prime, n)
+            _push(b_prime, n)
+        elif _is_delete(ca) and _is_retain(cb):
+            _push(a_prime, -n)
+        elif _is_retain(ca) and _is_delete(cb):
+            _push(b_prime, -n)
+        # Both delete it: nothing left to do on either side
+        ca = None if la == n else (ca - n if ca > 0 else ca + n)
+        cb = None if lb == n else (cb - n if cb > 0 else cb + n)
+        if ca is None:
+            ca = next(ia, None)
+        if cb is None:
+            cb = next(ib, None)
+    return a_prime, b_prime
+
+
+def replace(old: str, new: str) -> Operation:
+    """Smallest single-stretch operation turning `old` into `new`"""
+    a = old.encode('utf-16-le', 'surrogatepass')
+    b = new.encode('utf-16-le', 'surrogatepass')
+    prefix = 0
+    limit = min(len(a), len(b)) // 2
+    while prefix < limit and a[2 * prefix:2 * prefix + 2] == b[2 * prefix:2 * prefix + 2]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and a[len(a) - 2 * suffix - 2:len(a) - 2 * suffix] == b[len(b) - 2 * suffix - 2:len(b) - 2 * suffix]:
+        suffix += 1
+    op: Operation = []
+    _push(op, prefix)
+    _push(op, b[2 * prefix:len(b) - 2 * suffix].decode('utf-16-le', 'surrogatepass'))
+    _push(op, -(len(a) // 2 - prefix - suffix))
+    _push(op, suffix)
+    return op
+
+
+# ==================== DOCUMENTS ====================
+
+class TextDocument:
+    """Server copy of one node's content with its recent operation history"""
+
+    __slots__ = ('text', 'revision', 'history', 'saved_revision')
+
+    def __init__(self, text: str, revision: int = 0, history: int = TEXT_HISTORY):
+        self.text = text
+        self.revision = revision
+        self.history: deque = deque(maxlen=history)
+        self.saved_revision = revision
+
+    @property
+    def dirty(self) -> bool:
+        return self.revision != self.saved_revision
+
+    def receive(self, revision: int, op: Operation) -> Operation:
+        """
+        Apply a client operation based on `revision`; returns it transformed
+        against the operations committed since. Raises ValueError when
+        `revision` is no longer in the history and the client must reload.
+        """
+        behind = self.revision - revision
+        if behind < 0 or behind > len(self.history):
+            raise ValueError('Stale text revision')
+        for concurrent in list(self.history)[len(self.history) - behind:]:
+            op = transform(op, concurrent)[0]
+        if target_length(op) > TEXT_MAX_LENGTH:
+            raise ValueError('Content is too long')
+        self.text = apply(self.text, op)
+        self.history.append(op)
+        self.revision += 1
+        return op
+
+    def nbytes(self) -> int:
+        return 2 * len(self.text) + sum(2 * target_length(op) for op in self.history)
+
+
+class TextDocuments(ResidentComponent):
+    """
+    Open `TextDocument`s of a session's nodes. Documents start from the
+    resident board's content, so the session must be resident to edit.
+    """
+
+    name = 'text'
+
+    def __init__(self, mutations, boards, update_content, history: int = TEXT_HISTORY):
+        self.mutations = mutations
+        self.boards = boards
+        self.update_content = update_content
+        self.history = history
+        self.docs: Dict[int, Dict[int, TextDocument]] = {}
+        self.counters = {'edits': 0, 'transformed': 0, 'rejected': 0, 'materialized': 0}
+
+    def get(self, session_id: int, node_id: int) -> Optional[TextDocument]:
+        return self.docs.get(session_id, {}).get(node_id)
+
+    def open(self, session_id: int, node_id: int) -> TextDocument:
+        """The node's document, created from the board's content on first use"""
+        doc = self.get(session_id, node_id)
+        if doc is None:
+            board = self.boards.get(session_id)
+            content = board.content(node_id) if board is not None else None
+            if content is None:
+                raise ValueError('Node not found')
+            doc = self.docs.setdefault(session_id, {})[node_id] = TextDocument(content, history=self.history)
+        return doc
+
+    def edit(self, session_id: int, node_id: int, revision: Any, op: Any) -> Tuple[int, Operation]:
+        """Apply a client edit; returns the new revision and the transformed op"""
+        doc = self.open(session_id, node_id)
+        if not isinstance(revision, int):
+            raise ValueError('revision is required')
+        try:
+            applied = doc.receive(revision, normalize(op))
+        except ValueError:
+            self.counters['rejected'] += 1
+            raise
+        self.counters['edits'] += 1
+        if revision != doc.revision - 1:
+            self.counters['transformed'] += 1
+        return doc.revision, applied
+
+    def overlay(self, session_id: int, node: Dict[str, Any]) -> Dict[str, Any]:
+        """A node dict with the live document content in place of the stored one"""
+        doc = self.get(session_id, node['id'])
+        return node if doc is None else {**node, 'content': doc.text}
+
+    def revisions(self, session_id: int) -> Dict[int, int]:
+        """Current revision of each open document of a session"""
+        return {node_id: doc.revision for node_id, doc in self.docs.get(session_id, {}).items()}
+
+    def stamp(self, session_id: int, nodes: List[Dict[str, Any]]) -> Dict[int, int]:
+        """
+        Put the live text of open documents on wire-format `nodes` and return
+        their revisions. Called right before the nodes are sent, so clients
+        know which `node_text_edited` events the text already contains.
+        """
+        docs = self.docs.get(session_id)
+        revisions = {}
+        if docs:
+            for node in nodes:
+                doc = docs.get(node['id'])
+                if doc is not None:
+                    node['content'] = doc.text
+                    revisions[node['id']] = doc.revision
+        return revisions
+
+    def apply_event(self, session_id: int, event: str, data: Dict[str, Any]) -> None:
+        if event == 'node_deleted':
+            self.docs.get(session_id, {}).pop(data['node_id'], None)
+
+    # ==================== MATERIALIZATION ====================
+
+    def sizeof(self, session_id: int) -> int:
+        return sum(doc.nbytes() for doc in self.docs.get(session_id, {}).values())
+
+    def is_dirty(self, session_id: int) -> bool:
+        return any(doc.dirty for doc in self.docs.get(session_id, {}).values())
+
+    async def flush(self, session_id: int) -> None:
+        """Write every dirty document of a session in one transaction"""
+        dirty = [(node_id, doc, doc.revision, doc.text)
+                 for node_id, doc in self.docs.get(session_id, {}).items() if doc.dirty]
+        if not dirty:
+            return
+
+        async def apply(db):
+            for node_id, _, _, text in dirty:
+                await self.update_content(db, node_id, text)
+
+        async def on_commit(_):
+            for _, doc, revision, _ in dirty:
+                doc.saved_revision = max(doc.saved_revision, revision)
+            self.counters['materialized'] += len(dirty)
+
+        await self.mutations.submit(session_id, apply, on_commit)
+
+    async def run(self, interval: float = TEXT_MATERIALIZE_INTERVAL) -> None:
+        """Materialize dirty documents forever; meant to run as a background task"""
+        while True:
+            await asyncio.sleep(interval)
+            for session_id in list(self.docs):
+                try:
+                    await self.flush(session_id)
+                except Exception as e:
+                    print(f'❌ Error materializing text of session {session_id}: {e}')
+
+    def evict(self, session_id: int) -> None:
+        self.docs.pop(session_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'documents': sum(len(docs) for docs in self.docs.values()),
+            'dirty': sum(doc.dirty for docs in self.docs.values() for doc in docs.values()),
+            **self.counters,
+        }
@@ -0,0 +1,190 @@
+"""
+Server-rendered SVG thumbnails of boards.
+
+Rendering works on the compact board's coordinate arrays in the process pool.
+It is plain Python, not vectorized: bounds come from the builtin min/max over
+the columns, nodes are scaled in list comprehensions and emitted in a loop.
+Nodes or edges that would land on the same pixel cell are drawn once, so the
+output stays small however big the board is.
+
+Thumbnails are cached per session together with the session version they
+were rendered from. Mutations only bump the version of cached or rendering
+sessions; a stale thumbnail is re-rendered lazily on the next request, at most
+once per THUMBNAIL_DEBOUNCE.
+ETags are a hash of the SVG itself, so they survive restarts and agree across
+instances.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from compact_board import CompactBoard
+from offload import CPU, offloadable
+
+THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", "320"))
+THUMBNAIL_HEIGHT = int(os.getenv("THUMBNAIL_HEIGHT", "200"))
+THUMBNAIL_DEBOUNCE = float(os.getenv("THUMBNAIL_DEBOUNCE", "5"))
+THUMBNAIL_CACHE_SIZE = int(os.getenv("THUMBNAIL_CACHE_SIZE", "1000"))
+
+_PADDING = 8
+# Shapes falling into the same grid cell (px) are drawn once: more adds bytes, not detail
+_NODE_CELL = 2
+_EDGE_CELL = 4
+_NODE_FILL = '#e2e8f0'
+_NODE_STROKE = '#64748b'
+_EDGE_STROKE = '#94a3b8'
+_HEX_COLOR = re.compile(r'#[0-9a-fA-F]{3,8}')
+
+
+def _fill(style: Dict) -> str:
+    color = style.get('backgroundColor') or style.get('color')
+    # Styles are user input: only plain hex colours make it into the markup
+    return color if isinstance(color, str) and _HEX_COLOR.fullmatch(color) else _NODE_FILL
+
+
+@offloadable(CPU)
+def render_thumbnail(board: CompactBoard, width: int = THUMBNAIL_WIDTH, height: int = THUMBNAIL_HEIGHT) -> str:
+    """Render a board snapshot as a small SVG document"""
+    header = (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+              f'viewBox="0 0 {width} {height}"><rect width="100%" height="100%" fill="#ffffff"/>')
+    if not board.node_ids:
+        return header + '</svg>'
+
+    xs, ys, ws, hs = board.xs, board.ys, board.widths, board.heights
+    min_x, min_y = min(xs), min(ys)
+    max_x = max(map(int.__add__, xs, ws))
+    max_y = max(map(int.__add__, ys, hs))
+    scale = min((width - 2 * _PADDING) / max(max_x - min_x, 1),
+                (height - 2 * _PADDING) / max(max_y - min_y, 1))
+    off_x = _PADDING - min_x * scale
+    off_y = _PADDING - min_y * scale
+
+    # Scaled geometry of every node in one pass over the columns
+    left = [x * scale + off_x for x in xs]
+    top = [y * scale + off_y for y in ys]
+    rw = [max(w * scale, 1.0) for w in ws]
+    rh = [max(h * scale, 1.0) for h in hs]
+    fills = [_fill(style) for style in board.styles]
+
+    parts = [header, f'<g stroke="{_EDGE_STROKE}" stroke-width="1">']
+    seen = set()
+    rows = board._node_rows
+    for source, target in zip(board.sources, board.targets):
+        a, b = rows.get(source), rows.get(target)
+        if a is None or b is None:
+            continue
+        x1, y1 = left[a] + rw[a] / 2, top[a] + rh[a] / 2
+        x2, y2 = left[b] + rw[b] / 2, top[b] + rh[b] / 2
+        key = (int(x1) // _EDGE_CELL, int(y1) // _EDGE_CELL, int(x2) // _EDGE_CELL, int(y2) // _EDGE_CELL)
+        if key in seen:
+            continue
+        seen.add(key)
+        parts.append(f'<line x1="{x1:.0f}" y1="{y1:.0f}" x2="{x2:.0f}" y2="{y2:.0f}"/>')
+
+    parts.append(f'</g><g stroke="{_NODE_STROKE}" stroke-width="0.5" fill="{_NODE_FILL}">')
+    seen.clear()
+    for row in range(len(left)):
+        key = (int(left[row]) // _NODE_CELL, int(top[row]) // _NODE_CELL, int(rw[row]) // _NODE_CELL)
+        if key in seen:
+            continue
+        seen.add(key)
+        fill = fills[board.style_refs[row]]
+        parts.append(f'<rect x="{left[row]:.1f}" y="{top[row]:.1f}" width="{rw[row]:.1f}" height="{rh[row]:.1f}"'
+                     + ('' if fill == _NODE_FILL else f' fill="{fill}"') + '/>')
+    parts.append('</g></svg>')
+    return ''.join(parts)
+
+
+class _Thumbnail:
+    __slots__ = ('version', 'svg', 'etag', 'rendered_at')
+
+    def __init__(self, version: int, svg: str, rendered_at: float):
+        self.version = version
+        self.svg = svg
+        self.etag = '"' + hashlib.blake2b(svg.encode('utf-8'), digest_size=12).hexdigest() + '"'
+        self.rendered_at = rendered_at
+
+
+class ThumbnailCache:
+    """Per-session thumbnails keyed by session version, re-rendered lazily"""
+
+    def __init__(
+        self,
+        debounce: float = THUMBNAIL_DEBOUNCE,
+        max_entries: int = THUMBNAIL_CACHE_SIZE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.debounce = debounce
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: "OrderedDict[int, _Thumbnail]" = OrderedDict()
+        self._versions: Dict[int, int] = {}
+        self._rendering: Dict[int, asyncio.Task] = {}
+        self.counters = {'hits': 0, 'stale_hits': 0, 'renders': 0, 'invalidations': 0}
+
+    def invalidate(self, session_id: int) -> None:
+        """Mark a session's thumbnail stale after a mutation"""
+        if session_id not in self._entries and session_id not in self._rendering:
+            return  # nothing to go stale; the next render reads the board as it is
+        self._versions[session_id] = self._versions.get(session_id, 0) + 1
+        self.counters['invalidations'] += 1
+
+    def version(self, session_id: int) -> int:
+        return self._versions.get(session_id, 0)
+
+    async def get(
+        self,
+        session_id: int,
+        load_board: Callable[[int], Awaitable[Optional[CompactBoard]]],
+    ) -> Optional[Tuple[str, str]]:
+        """
+        `(etag, svg)` for a session, rendering it if missing or stale.
+        Stale thumbnails younger than the debounce window are served as-is.
+        `load_board` returns a board snapshot safe to hand to another process.
+        """
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            self._entries.move_to_end(session_id)
+            if entry.version == self.version(session_id):
+                self.counters['hits'] += 1
+                return entry.etag, entry.svg
+            if self.clock() - entry.rendered_at < self.debounce:
+                self.counters['stale_hits'] += 1
+                return entry.etag, entry.svg
+
+        # Concurrent requests share one render
+        task = self._rendering.get(session_id)
+        if task is None:
+            task = self._rendering[session_id] = asyncio.create_task(self._render(session_id, load_board))
+            task.add_done_callback(lambda _: self._rendering.pop(session_id, None))
+        entry = await asyncio.shield(task)
+        return None if entry is None else (entry.etag, entry.svg)
+
+    async def _render(self, session_id, load_board) -> Optional[_Thumbnail]:
+        version = self.version(session_id)
+        board = await load_board(session_id)
+        if board is None:
+            if session_id not in self._entries:
+                self._versions.pop(session_id, None)
+            return None
+        svg = await render_thumbnail.offload(board)
+        self.counters['renders'] += 1
+        entry = self._entries[session_id] = _Thumbnail(version, svg, self.clock())
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            if evicted not in self._rendering:
+                self._versions.pop(evicted, None)
+        return entry
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'cached': len(self._entries),
+            'versions': len(self._versions),
+            'rendering': len(self._rendering),
+            **self.counters,
+        }
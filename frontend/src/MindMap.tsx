@@ -10,8 +10,21 @@ import { Modal } from './components/Modal'
 import { ToastContainer } from './components/Toast'
 import { ProfileSidebar } from './components/ProfileSidebar'
 import { useToastStore } from './store/toastStore'
+import { decodePayload, supportsGzipPayloads } from './lib/utils'
 import { Plus, Link2, Wifi, WifiOff, User, Sparkles, Trash2 } from 'lucide-react'
-import type { Node, Edge } from './types'
+import type {
+  Node,
+  Edge,
+  JournalPosition,
+  SessionReplay,
+  SessionState,
+  SessionStateChunk,
+  NodeTextState,
+  NodeTextEdit,
+} from './types'
+
+// Live changes stop being held back if the initial state stalls this long (ms)
+const STREAM_TIMEOUT = 15000
 
 export default function MindMap() {
   const dispatch = useAppDispatch()
@@ -46,12 +59,19 @@ export default function MindMap() {
 
   const {
     initializeState,
+    resetTextClients,
+    appendStateChunk,
     createNode,
     updateNode,
+    openNodeText,
+    editNodeText,
+    reopenPendingText,
     deleteNode,
     createEdge,
     handleNodeCreated,
     handleNodeUpdated,
+    handleNodeTextState,
+    handleNodeTextEdited,
     handleNodeDeleted,
     handleEdgeCreated,
     handleEdgeDeleted,
@@ -60,6 +80,57 @@ export default function MindMap() {
   // Initialize Socket.IO
   useEffect(() => {
     let socketInstance: ReturnType<typeof io> | null = null
+    // While the initial state is streaming, live changes are buffered and
+    // applied in order once the last chunk has been merged
+    let streaming = false
+    let liveBuffer: Array<() => void> = []
+    let chunkQueue: Promise<void> = Promise.resolve()
+    let streamTimer: ReturnType<typeof setTimeout> | undefined
+    // Server journal position the local state reflects, sent as `resume` on
+    // reconnect so only the missed changes are replayed
+    let journal: JournalPosition | null = null
+    const applyLive = (apply: () => void) => {
+      if (streaming) liveBuffer.push(apply)
+      else apply()
+    }
+    // Journaled events carry their sequence number; buffered ones up to the
+    // position of the state or replay we received are already in it
+    const applyJournaled = (data: { seq?: number }, apply: () => void) => {
+      const run = (buffered: boolean) => {
+        if (journal && typeof data.seq === 'number') {
+          if (buffered && data.seq <= journal.seq) return
+          journal.seq = Math.max(journal.seq, data.seq)
+        }
+        apply()
+      }
+      if (streaming) liveBuffer.push(() => run(true))
+      else run(false)
+    }
+    // (Re)arm the stall timer; a stream that never sends its last chunk must
+    // not hold live changes back forever
+    const watchStream = () => {
+      clearTimeout(streamTimer)
+      streamTimer = setTimeout(() => {
+        console.warn('Initial state stalled, applying buffered changes')
+        finishStream()
+      }, STREAM_TIMEOUT)
+    }
+    const finishStream = () => {
+      clearTimeout(streamTimer)
+      streaming = false
+      const buffered = liveBuffer
+      liveBuffer = []
+      buffered.forEach((apply) => apply())
+    }
+    // Handlers of the events the server journals, for live events and replays
+    const journaled = {
+      node_created: ({ node }: { node: Node }) => handleNodeCreated(node),
+      node_updated: ({ node }: { node: Node }) => handleNodeUpdated(node),
+      node_text_edited: (edit: NodeTextEdit) => handleNodeTextEdited(edit),
+      node_deleted: ({ node_id }: { node_id: number }) => handleNodeDeleted(node_id),
+      edge_created: ({ edge }: { edge: Edge }) => handleEdgeCreated(edge),
+      edge_deleted: ({ edge_id }: { edge_id: number }) => handleEdgeDeleted(edge_id),
+    }
     
     try {
       setIsInitializing(true)
@@ -80,8 +151,9 @@ export default function MindMap() {
       setUser(userId, userName)
       setCurrentSession(sessionId)
 
-      // Get backend URL from environment variable or use default
-      const backendUrl = import.meta.env.VITE_BACKEND_URL || 'https://mind-map-uqyn.onrender.com'
+      // Get backend URL from a previous session_redirect, the environment or the default
+      const redirectKey = `mindmap_backend_url_${sessionId}`
+      const backendUrl = sessionStorage.getItem(redirectKey) || import.meta.env.VITE_BACKEND_URL || 'https://mind-map-uqyn.onrender.com'
       
       socketInstance = io(backendUrl, {
         transports: ['websocket'],
@@ -96,18 +168,34 @@ export default function MindMap() {
         setConnected(true)
         setIsInitializing(false)
         addToast('Connected to server', 'success')
+        streaming = true
+        liveBuffer = []
+        watchStream()
+        // The state is kept until the server answers with a replay of what we
+        // missed or a fresh state
+        const resume = journal
+        journal = null
+        resetTextClients()
         socketInstance?.emit('join_session', {
           session_id: sessionId,
           user_id: userId,
           user_name: userName,
+          accept_encoding: supportsGzipPayloads ? ['gzip'] : [],
+          stream: true,
+          viewport: { x: 0, y: 0, width: window.innerWidth, height: window.innerHeight },
+          resume: resume ?? undefined,
         })
+        // Text typed while disconnected is waiting for its document
+        reopenPendingText()
         // Add current user to online users
         addOnlineUser({ user_id: userId, user_name: userName })
       })
 
       socketInstance.on('connect_error', (err) => {
         console.error('Connection error:', err)
-        const backendUrl = import.meta.env.VITE_BACKEND_URL || 'https://mind-map-uqyn.onrender.com'
+        // A redirect target that cannot be reached is not used again; the
+        // next load starts from the default backend, which redirects anew
+        sessionStorage.removeItem(redirectKey)
         setError(`Failed to connect to server at ${backendUrl}`)
         setIsInitializing(false)
         addToast('Connection failed', 'error', 5000)
@@ -118,15 +206,62 @@ export default function MindMap() {
         addToast('Disconnected from server', 'warning')
       })
 
-      socketInstance.on('initial_state', (state: { nodes: Node[]; edges: Edge[] }) => {
+      socketInstance.on('initial_state', async (payload: unknown) => {
+        const state = await decodePayload<SessionState>(payload)
         console.log('📦 Received initial state:', state)
         if (state && (state.nodes || state.edges)) {
           initializeState({
             nodes: state.nodes || [],
-            edges: state.edges || []
+            edges: state.edges || [],
+            text_revisions: state.text_revisions,
           })
+          journal = state.journal ?? null
         }
         setIsInitializing(false)
+        finishStream()
+      })
+
+      socketInstance.on('initial_state_chunk', (payload: unknown) => {
+        // Decoding is async; chain chunks so they are merged in order
+        if (streaming) watchStream()
+        chunkQueue = chunkQueue.then(async () => {
+          const chunk = await decodePayload<SessionStateChunk>(payload)
+          if (chunk.seq === 0) {
+            // A fresh state replaces what we had
+            initializeState({ nodes: [], edges: [] })
+            setIsInitializing(false)
+          }
+          appendStateChunk({ nodes: chunk.nodes || [], edges: chunk.edges || [], text_revisions: chunk.text_revisions })
+          if (chunk.done) {
+            console.log(`📦 Received initial state: ${chunk.total_nodes} nodes, ${chunk.total_edges} edges`)
+            journal = chunk.journal ?? null
+            finishStream()
+          }
+        })
+      })
+
+      socketInstance.on('replay', ({ journal: position, events }: SessionReplay) => {
+        // Resumed after a reconnect: apply just the changes we missed
+        console.log(`📦 Replaying ${events.length} missed changes`)
+        for (const { event, data } of events) {
+          const handler = journaled[event as keyof typeof journaled] as ((data: unknown) => void) | undefined
+          handler?.(data)
+        }
+        journal = position
+        finishStream()
+      })
+
+      socketInstance.on('session_redirect', ({ url }: { session_id: number; instance: string; url: string }) => {
+        // Another backend instance owns this session; reconnect there
+        if (url && url !== backendUrl) {
+          sessionStorage.setItem(redirectKey, url)
+          socketInstance?.disconnect()
+          window.location.reload()
+          return
+        }
+        // Nowhere better to go: no state is coming, stop buffering
+        console.warn(`Ignoring session redirect to ${url || 'an empty URL'}`)
+        finishStream()
       })
 
       socketInstance.on('user_joined', (data: { user_id: string; user_name: string }) => {
@@ -136,36 +271,47 @@ export default function MindMap() {
         }
       })
 
-      socketInstance.on('node_created', ({ node }: { node: Node }) => {
-        handleNodeCreated(node)
+      socketInstance.on('node_created', (data: { node: Node; seq?: number }) => {
+        applyJournaled(data, () => journaled.node_created(data))
         addToast('New node created by another user', 'info')
       })
 
-      socketInstance.on('node_updated', ({ node }: { node: Node }) => {
-        handleNodeUpdated(node)
+      socketInstance.on('node_updated', (data: { node: Node; seq?: number }) => {
+        applyJournaled(data, () => journaled.node_updated(data))
+      })
+
+      socketInstance.on('node_text_state', (state: NodeTextState) => {
+        applyLive(() => handleNodeTextState(state))
       })
 
-      socketInstance.on('node_deleted', ({ node_id }: { node_id: number }) => {
-        handleNodeDeleted(node_id)
+      socketInstance.on('node_text_edited', (edit: NodeTextEdit & { seq?: number }) => {
+        applyJournaled(edit, () => journaled.node_text_edited(edit))
+      })
+
+      socketInstance.on('node_deleted', (data: { node_id: number; seq?: number }) => {
+        applyJournaled(data, () => journaled.node_deleted(data))
         addToast('Node deleted by another user', 'warning')
       })
 
-      socketInstance.on('edge_created', ({ edge }: { edge: Edge }) => {
-        handleEdgeCreated(edge)
+      socketInstance.on('edge_created', (data: { edge: Edge; seq?: number }) => {
+        applyJournaled(data, () => journaled.edge_created(data))
         addToast('New connection created', 'info')
       })
 
-      socketInstance.on('edge_deleted', ({ edge_id }: { edge_id: number }) => {
-        handleEdgeDeleted(edge_id)
+      socketInstance.on('edge_deleted', (data: { edge_id: number; seq?: number }) => {
+        applyJournaled(data, () => journaled.edge_deleted(data))
       })
 
-      socketInstance.on('error', ({ message }: { message: string }) => {
+      socketInstance.on('error', ({ message, event }: { message: string; event?: string }) => {
         console.error('Socket.IO error:', message)
         setError(message)
         addToast(message, 'error', 5000)
+        // A failed join sends no state; apply what was buffered
+        if (streaming && event === 'join_session') finishStream()
       })
 
       return () => {
+        clearTimeout(streamTimer)
         if (socketInstance) {
           socketInstance.disconnect()
         }
@@ -247,13 +393,6 @@ export default function MindMap() {
     addToast('Node created successfully', 'success')
   }
 
-  const handleUpdateNode = (id: number, updates: Partial<Node>) => {
-    updateNode(id, updates)
-    if (updates.content !== undefined) {
-      addToast('Node updated', 'info', 2000)
-    }
-  }
-
   const handleDeleteNode = (id: number) => {
     deleteNode(id)
     dispatch(selectNode(null))
@@ -479,7 +618,8 @@ export default function MindMap() {
                   handleNodeClick(node.id)
                 }
               }}
-              onUpdate={handleUpdateNode}
+              onOpenText={openNodeText}
+              onTextChange={editNodeText}
               onDelete={handleDeleteClick}
               onDragStart={handleNodeDragStart}
             />
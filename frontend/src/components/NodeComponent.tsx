@@ -1,13 +1,15 @@
-import React, { useState, useRef } from 'react'
+import React, { useState, useRef, useLayoutEffect } from 'react'
 import type { Node } from '../types'
 import { cn } from '../lib/utils'
+import { diffOp, transformIndex } from '../lib/textOT'
 import { X } from 'lucide-react'
 
 interface NodeComponentProps {
   node: Node
   isSelected: boolean
   onSelect: () => void
-  onUpdate: (id: number, updates: Partial<Node>) => void
+  onOpenText: (id: number) => void
+  onTextChange: (id: number, oldContent: string, newContent: string) => void
   onDelete: (id: number) => void
   onDragStart: (e: React.MouseEvent, id: number) => void
 }
@@ -16,15 +18,37 @@ export const NodeComponent: React.FC<NodeComponentProps> = ({
   node,
   isSelected,
   onSelect,
-  onUpdate,
+  onOpenText,
+  onTextChange,
   onDelete,
   onDragStart,
 }) => {
   const [isEditing, setIsEditing] = useState(false)
-  const [content, setContent] = useState(node.content)
   const inputRef = useRef<HTMLTextAreaElement>(null)
+  // Text and selection as last rendered, to keep the caret in place when
+  // someone else's edit changes the content
+  const rendered = useRef({ content: node.content, start: 0, end: 0 })
+
+  useLayoutEffect(() => {
+    const input = inputRef.current
+    const { content, start, end } = rendered.current
+    if (isEditing && input && content !== node.content) {
+      const op = diffOp(content, node.content)
+      input.setSelectionRange(transformIndex(start, op), transformIndex(end, op))
+    }
+    rendered.current.content = node.content
+  }, [isEditing, node.content])
+
+  const rememberSelection = () => {
+    const input = inputRef.current
+    if (input) {
+      rendered.current.start = input.selectionStart
+      rendered.current.end = input.selectionEnd
+    }
+  }
 
   const handleDoubleClick = () => {
+    onOpenText(node.id)
     setIsEditing(true)
     setTimeout(() => {
       inputRef.current?.focus()
@@ -32,11 +56,13 @@ export const NodeComponent: React.FC<NodeComponentProps> = ({
     }, 0)
   }
 
+  const handleChange = (e: React.ChangeEvent<HTMLTextAreaElement>) => {
+    onTextChange(node.id, node.content, e.target.value)
+    rememberSelection()
+  }
+
   const handleBlur = () => {
     setIsEditing(false)
-    if (content !== node.content) {
-      onUpdate(node.id, { content })
-    }
   }
 
   const handleKeyDown = (e: React.KeyboardEvent) => {
@@ -45,7 +71,6 @@ export const NodeComponent: React.FC<NodeComponentProps> = ({
       handleBlur()
     }
     if (e.key === 'Escape') {
-      setContent(node.content)
       setIsEditing(false)
     }
   }
@@ -76,8 +101,9 @@ export const NodeComponent: React.FC<NodeComponentProps> = ({
       {isEditing ? (
         <textarea
           ref={inputRef}
-          value={content}
-          onChange={(e) => setContent(e.target.value)}
+          value={node.content}
+          onChange={handleChange}
+          onSelect={rememberSelection}
           onBlur={handleBlur}
           onKeyDown={handleKeyDown}
           className="w-full h-full p-3.5 rounded-lg resize-none focus:outline-none text-sm leading-relaxed text-gray-900 placeholder:text-gray-400 bg-transparent"
@@ -1,20 +1,41 @@
 import { useCallback } from 'react'
 import { useAppDispatch, useAppSelector } from '../store/hooks'
 import { useSocketStore } from '../store/socketStore'
-import type { Node, Edge } from '../types'
+import type { Node, Edge, SessionState, NodeTextState, NodeTextEdit } from '../types'
+import { TextClient, applyOp, composeOps, diffOp, transformOps } from '../lib/textOT'
+import type { TextOp } from '../lib/textOT'
 import {
   setNodes,
-  addNode as addNodeAction,
+  upsertNodes,
   updateNode as updateNodeAction,
+  applyTextOp,
   deleteNode as deleteNodeAction,
 } from '../store/slices/nodesSlice'
 import {
   setEdges,
-  addEdge as addEdgeAction,
+  upsertEdges,
   deleteEdge as deleteEdgeAction,
   deleteEdgesByNode,
 } from '../store/slices/edgesSlice'
 
+// Collaborative text state of the nodes this client has opened for editing.
+// Socket handlers are registered once, so this lives outside the hook.
+const textClients = new Map<number, TextClient>()
+// Text revision each node's content had when the last state arrived; edits
+// at or below it are already applied (they may still be buffered or in flight)
+const textBaselines = new Map<number, number>()
+
+// Local edits made while a node had no text client yet (before its document
+// state arrived, or after a reconnect reset the clients): the text they were
+// made against and their combined operation, sent once the state is in
+const pendingText = new Map<number, { base: string; op: TextOp }>()
+
+const setTextBaselines = (revisions: Record<number, number> | undefined) => {
+  for (const [nodeId, revision] of Object.entries(revisions || {})) {
+    textBaselines.set(Number(nodeId), revision)
+  }
+}
+
 export const useMindMapCRUD = () => {
   const dispatch = useAppDispatch()
   const { socket, currentSessionId } = useSocketStore()
@@ -23,13 +44,33 @@ export const useMindMapCRUD = () => {
 
   // Initialize state from server
   const initializeState = useCallback(
-    (state: { nodes: Node[]; edges: Edge[] }) => {
+    (state: SessionState) => {
+      textClients.clear()
+      textBaselines.clear()
+      setTextBaselines(state.text_revisions)
       dispatch(setNodes(state.nodes))
       dispatch(setEdges(state.edges))
     },
     [dispatch]
   )
 
+  // A new connection has a new socket id and the server may have dropped the
+  // documents: text editing starts over from fresh document states
+  const resetTextClients = useCallback(() => {
+    textClients.clear()
+    textBaselines.clear()
+  }, [])
+
+  // Merge one chunk of a streamed initial state
+  const appendStateChunk = useCallback(
+    (chunk: SessionState) => {
+      setTextBaselines(chunk.text_revisions)
+      if (chunk.nodes.length) dispatch(upsertNodes(chunk.nodes))
+      if (chunk.edges.length) dispatch(upsertEdges(chunk.edges))
+    },
+    [dispatch]
+  )
+
   // Node CRUD
   const createNode = useCallback(
     (nodeData: Partial<Node>) => {
@@ -65,6 +106,41 @@ export const useMindMapCRUD = () => {
     [socket, currentSessionId]
   )
 
+  // Collaborative text editing: open a node's document, then send edits as
+  // operations against its revision
+  const openNodeText = useCallback((nodeId: number) => {
+    const { socket, currentSessionId } = useSocketStore.getState()
+    if (!socket || !currentSessionId) return
+    socket.emit('node_text_open', { session_id: currentSessionId, node_id: nodeId })
+  }, [])
+
+  const editNodeText = useCallback(
+    (nodeId: number, oldContent: string, newContent: string) => {
+      if (oldContent === newContent) return
+      const op = diffOp(oldContent, newContent)
+      dispatch(applyTextOp({ id: nodeId, op }))
+      const client = textClients.get(nodeId)
+      if (client) {
+        client.applyLocal(op)
+        return
+      }
+      const pending = pendingText.get(nodeId)
+      if (pending) {
+        pending.op = composeOps(pending.op, op)
+      } else {
+        pendingText.set(nodeId, { base: oldContent, op })
+        openNodeText(nodeId)
+      }
+    },
+    [dispatch, openNodeText]
+  )
+
+  // Ask again for the documents of queued edits, e.g. after a reconnect
+  // dropped the request or its answer
+  const reopenPendingText = useCallback(() => {
+    pendingText.forEach((_, nodeId) => openNodeText(nodeId))
+  }, [openNodeText])
+
   const deleteNode = useCallback(
     (nodeId: number) => {
       if (!socket || !currentSessionId) return
@@ -108,20 +184,107 @@ export const useMindMapCRUD = () => {
   // Socket event handlers (to be called from component)
   const handleNodeCreated = useCallback(
     (node: Node) => {
-      dispatch(addNodeAction(node))
+      // Upsert: the node may already have arrived in a streamed state chunk
+      dispatch(upsertNodes([node]))
     },
     [dispatch]
   )
 
   const handleNodeUpdated = useCallback(
     (node: Node) => {
-      dispatch(updateNodeAction({ id: node.id, updates: node }))
+      if (textClients.has(node.id)) {
+        // Text of an open document only changes through its operations
+        const updates: Partial<Node> = { ...node }
+        delete updates.content
+        dispatch(updateNodeAction({ id: node.id, updates }))
+      } else {
+        dispatch(updateNodeAction({ id: node.id, updates: node }))
+      }
+    },
+    [dispatch]
+  )
+
+  const handleNodeTextState = useCallback(
+    (state: NodeTextState) => {
+      const client = new TextClient(state.revision, (revision, op) => {
+        const { socket, currentSessionId } = useSocketStore.getState()
+        socket?.emit('node_text_edit', {
+          session_id: currentSessionId,
+          node_id: state.node_id,
+          revision,
+          op,
+        })
+      })
+      textClients.set(state.node_id, client)
+      textBaselines.delete(state.node_id)
+      let content = state.content
+      const pending = pendingText.get(state.node_id)
+      if (pending) {
+        // Rebase the queued edits onto the server's text and send them
+        pendingText.delete(state.node_id)
+        const [op] = transformOps(pending.op, diffOp(pending.base, state.content))
+        content = applyOp(state.content, op)
+        client.applyLocal(op)
+      }
+      dispatch(updateNodeAction({ id: state.node_id, updates: { content } }))
     },
     [dispatch]
   )
 
+  const handleNodeTextEdited = useCallback(
+    (edit: NodeTextEdit) => {
+      const baseline = textBaselines.get(edit.node_id)
+      if (baseline !== undefined) {
+        // Already part of the state we loaded
+        if (edit.revision <= baseline) return
+        textBaselines.delete(edit.node_id)
+      }
+      const client = textClients.get(edit.node_id)
+      if (client && edit.revision <= client.revision) {
+        // Sent before the document state we started from
+        return
+      }
+      const pending = pendingText.get(edit.node_id)
+      if (!client && pending) {
+        // Our queued edits are on top of the text: apply the op beneath them
+        try {
+          const [op, theirs] = transformOps(pending.op, edit.op)
+          pending.base = applyOp(pending.base, edit.op)
+          pending.op = op
+          dispatch(applyTextOp({ id: edit.node_id, op: theirs }))
+        } catch {
+          // The document state on its way rebases the queued edits anyway
+        }
+        return
+      }
+      if (!client) {
+        // Not being edited here: the op applies to the text we have
+        try {
+          dispatch(applyTextOp({ id: edit.node_id, op: edit.op }))
+        } catch {
+          openNodeText(edit.node_id)
+        }
+        return
+      }
+      if (edit.origin === useSocketStore.getState().socket?.id) {
+        if (!client.serverAck(edit.revision)) openNodeText(edit.node_id)
+        return
+      }
+      const op = client.applyServer(edit.revision, edit.op)
+      if (op === null) {
+        // Missed a revision: start over from the server's copy
+        openNodeText(edit.node_id)
+      } else {
+        dispatch(applyTextOp({ id: edit.node_id, op }))
+      }
+    },
+    [dispatch, openNodeText]
+  )
+
   const handleNodeDeleted = useCallback(
     (nodeId: number) => {
+      textClients.delete(nodeId)
+      pendingText.delete(nodeId)
       dispatch(deleteNodeAction(nodeId))
       // Also delete all edges connected to this node
       dispatch(deleteEdgesByNode(nodeId))
@@ -131,7 +294,7 @@ export const useMindMapCRUD = () => {
 
   const handleEdgeCreated = useCallback(
     (edge: Edge) => {
-      dispatch(addEdgeAction(edge))
+      dispatch(upsertEdges([edge]))
     },
     [dispatch]
   )
@@ -147,13 +310,20 @@ export const useMindMapCRUD = () => {
     nodes,
     edges,
     initializeState,
+    resetTextClients,
+    appendStateChunk,
     createNode,
     updateNode,
+    openNodeText,
+    editNodeText,
+    reopenPendingText,
     deleteNode,
     createEdge,
     deleteEdge,
     handleNodeCreated,
     handleNodeUpdated,
+    handleNodeTextState,
+    handleNodeTextEdited,
     handleNodeDeleted,
     handleEdgeCreated,
     handleEdgeDeleted,
@@ -0,0 +1,191 @@
+// Operational transformation for collaborative node text, mirroring
+// backend/text_sync.py. An operation is a list of components: a positive
+// number retains that many characters, a negative number deletes that many
+// and a string inserts itself. Positions are JavaScript string indices.
+export type TextOp = (number | string)[]
+
+const isRetain = (c: number | string | undefined): c is number => typeof c === 'number' && c > 0
+const isDelete = (c: number | string | undefined): c is number => typeof c === 'number' && c < 0
+const isInsert = (c: number | string | undefined): c is string => typeof c === 'string'
+
+function push(op: TextOp, c: number | string) {
+  if (c === 0 || c === '') return
+  const last = op[op.length - 1]
+  if ((isRetain(last) && isRetain(c)) || (isDelete(last) && isDelete(c))) {
+    op[op.length - 1] = (last as number) + (c as number)
+  } else if (isInsert(last) && isInsert(c)) {
+    op[op.length - 1] = last + c
+  } else if (isDelete(last) && isInsert(c)) {
+    // Inserts go ahead of deletes so equal edits have one representation
+    const before = op[op.length - 2]
+    if (isInsert(before)) op[op.length - 2] = before + c
+    else op.splice(op.length - 1, 0, c)
+  } else {
+    op.push(c)
+  }
+}
+
+export function applyOp(text: string, op: TextOp): string {
+  let pos = 0
+  let result = ''
+  for (const c of op) {
+    if (isRetain(c)) {
+      result += text.slice(pos, pos + c)
+      pos += c
+    } else if (isDelete(c)) {
+      pos -= c
+    } else {
+      result += c
+    }
+  }
+  if (pos !== text.length) throw new Error('Text operation does not match the document length')
+  return result
+}
+
+// Transform concurrent operations into [a', b'] so that a·b' equals b·a'.
+// On inserts at the same position a goes first (same rule as the server).
+export function transformOps(a: TextOp, b: TextOp): [TextOp, TextOp] {
+  const aPrime: TextOp = []
+  const bPrime: TextOp = []
+  let i = 0
+  let j = 0
+  let ca = a[i++]
+  let cb = b[j++]
+  while (ca !== undefined || cb !== undefined) {
+    if (isInsert(ca)) {
+      push(aPrime, ca)
+      push(bPrime, ca.length)
+      ca = a[i++]
+      continue
+    }
+    if (isInsert(cb)) {
+      push(aPrime, cb.length)
+      push(bPrime, cb)
+      cb = b[j++]
+      continue
+    }
+    if (ca === undefined || cb === undefined) throw new Error('Concurrent text operations have different base lengths')
+    const n = Math.min(Math.abs(ca), Math.abs(cb))
+    if (isRetain(ca) && isRetain(cb)) {
+      push(aPrime, n)
+      push(bPrime, n)
+    } else if (isDelete(ca) && isRetain(cb)) {
+      push(aPrime, -n)
+    } else if (isRetain(ca) && isDelete(cb)) {
+      push(bPrime, -n)
+    }
+    ca = Math.abs(ca) === n ? a[i++] : ca > 0 ? ca - n : ca + n
+    cb = Math.abs(cb) === n ? b[j++] : cb > 0 ? cb - n : cb + n
+  }
+  return [aPrime, bPrime]
+}
+
+// Combine a then b into one operation
+export function composeOps(a: TextOp, b: TextOp): TextOp {
+  const result: TextOp = []
+  let i = 0
+  let j = 0
+  let ca = a[i++]
+  let cb = b[j++]
+  while (ca !== undefined || cb !== undefined) {
+    if (isDelete(ca)) {
+      push(result, ca)
+      ca = a[i++]
+      continue
+    }
+    if (isInsert(cb)) {
+      push(result, cb)
+      cb = b[j++]
+      continue
+    }
+    if (ca === undefined || cb === undefined) throw new Error('Text operations cannot be composed')
+    const lenA = isInsert(ca) ? ca.length : ca
+    const n = Math.min(lenA, Math.abs(cb))
+    if (isRetain(cb)) push(result, isInsert(ca) ? ca.slice(0, n) : n)
+    else if (isRetain(ca)) push(result, -n)
+    // insert then delete cancels out
+    ca = lenA === n ? a[i++] : isInsert(ca) ? ca.slice(n) : ca - n
+    cb = Math.abs(cb) === n ? b[j++] : cb > 0 ? cb - n : cb + n
+  }
+  return result
+}
+
+// Smallest single-stretch operation turning `oldText` into `newText`
+export function diffOp(oldText: string, newText: string): TextOp {
+  let prefix = 0
+  const limit = Math.min(oldText.length, newText.length)
+  while (prefix < limit && oldText[prefix] === newText[prefix]) prefix++
+  let suffix = 0
+  while (
+    suffix < limit - prefix &&
+    oldText[oldText.length - 1 - suffix] === newText[newText.length - 1 - suffix]
+  ) suffix++
+  const op: TextOp = []
+  push(op, prefix)
+  push(op, newText.slice(prefix, newText.length - suffix))
+  push(op, -(oldText.length - prefix - suffix))
+  push(op, suffix)
+  return op
+}
+
+// Where a caret at `index` ends up after `op`
+export function transformIndex(index: number, op: TextOp): number {
+  let pos = 0
+  let result = index
+  for (const c of op) {
+    if (pos > index) break
+    if (isRetain(c)) pos += c
+    else if (isDelete(c)) {
+      result -= Math.min(-c, index - pos)
+      pos -= c
+    } else result += c.length
+  }
+  return result
+}
+
+// Client side of one node's document: at most one edit in flight, later local
+// edits are composed into a buffer until the server acknowledges it
+export class TextClient {
+  revision: number
+  private send: (revision: number, op: TextOp) => void
+  private outstanding: TextOp | null = null
+  private buffer: TextOp | null = null
+
+  constructor(revision: number, send: (revision: number, op: TextOp) => void) {
+    this.revision = revision
+    this.send = send
+  }
+
+  applyLocal(op: TextOp) {
+    if (this.outstanding === null) {
+      this.outstanding = op
+      this.send(this.revision, op)
+    } else {
+      this.buffer = this.buffer === null ? op : composeOps(this.buffer, op)
+    }
+  }
+
+  // Our own edit came back; returns false if a revision was missed
+  serverAck(revision: number): boolean {
+    if (revision !== this.revision + 1) return false
+    this.revision = revision
+    this.outstanding = this.buffer
+    this.buffer = null
+    if (this.outstanding !== null) this.send(this.revision, this.outstanding)
+    return true
+  }
+
+  // Someone else's edit; returns it transformed for the local text, or null
+  // if a revision was missed
+  applyServer(revision: number, op: TextOp): TextOp | null {
+    if (revision !== this.revision + 1) return null
+    this.revision = revision
+    if (this.outstanding !== null) {
+      ;[this.outstanding, op] = transformOps(this.outstanding, op)
+      if (this.buffer !== null) {
+        ;[this.buffer, op] = transformOps(this.buffer, op)
+      }
+    }
+    return op
+  }
+}
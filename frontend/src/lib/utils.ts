@@ -5,3 +5,16 @@ export function cn(...inputs: ClassValue[]) {
   return twMerge(clsx(inputs))
 }
 
+
+// Whether this browser can inflate gzip payloads sent by the backend
+export const supportsGzipPayloads = typeof DecompressionStream !== 'undefined'
+
+// Large Socket.IO payloads may arrive as { encoding: 'gzip', data: <gzipped JSON> }
+export async function decodePayload<T>(payload: unknown): Promise<T> {
+  const encoded = payload as { encoding?: string; data?: ArrayBuffer } | null
+  if (encoded && encoded.encoding === 'gzip' && encoded.data) {
+    const stream = new Blob([encoded.data]).stream().pipeThrough(new DecompressionStream('gzip'))
+    return JSON.parse(await new Response(stream).text()) as T
+  }
+  return payload as T
+}
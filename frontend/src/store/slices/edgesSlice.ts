@@ -20,6 +20,15 @@ const edgesSlice = createSlice({
     addEdge: (state, action: PayloadAction<Edge>) => {
       state.edges.push(action.payload)
     },
+    upsertEdges: (state, action: PayloadAction<Edge[]>) => {
+      const known = new Set(state.edges.map(e => e.id))
+      for (const edge of action.payload) {
+        if (!known.has(edge.id)) {
+          known.add(edge.id)
+          state.edges.push(edge)
+        }
+      }
+    },
     deleteEdge: (state, action: PayloadAction<number>) => {
       state.edges = state.edges.filter(e => e.id !== action.payload)
     },
@@ -31,6 +40,6 @@ const edgesSlice = createSlice({
   },
 })
 
-export const { setEdges, addEdge, deleteEdge, deleteEdgesByNode } = edgesSlice.actions
+export const { setEdges, addEdge, upsertEdges, deleteEdge, deleteEdgesByNode } = edgesSlice.actions
 export default edgesSlice.reducer
 
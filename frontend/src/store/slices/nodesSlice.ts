@@ -1,6 +1,7 @@
 import { createSlice } from '@reduxjs/toolkit'
 import type { PayloadAction } from '@reduxjs/toolkit'
 import type { Node } from '../../types'
+import { applyOp, type TextOp } from '../../lib/textOT'
 
 interface NodesState {
   nodes: Node[]
@@ -22,12 +23,30 @@ const nodesSlice = createSlice({
     addNode: (state, action: PayloadAction<Node>) => {
       state.nodes.push(action.payload)
     },
+    upsertNodes: (state, action: PayloadAction<Node[]>) => {
+      const index = new Map(state.nodes.map((n, i) => [n.id, i]))
+      for (const node of action.payload) {
+        const i = index.get(node.id)
+        if (i === undefined) {
+          index.set(node.id, state.nodes.length)
+          state.nodes.push(node)
+        } else {
+          state.nodes[i] = node
+        }
+      }
+    },
     updateNode: (state, action: PayloadAction<{ id: number; updates: Partial<Node> }>) => {
       const index = state.nodes.findIndex(n => n.id === action.payload.id)
       if (index !== -1) {
         state.nodes[index] = { ...state.nodes[index], ...action.payload.updates }
       }
     },
+    applyTextOp: (state, action: PayloadAction<{ id: number; op: TextOp }>) => {
+      const node = state.nodes.find(n => n.id === action.payload.id)
+      if (node) {
+        node.content = applyOp(node.content, action.payload.op)
+      }
+    },
     deleteNode: (state, action: PayloadAction<number>) => {
       state.nodes = state.nodes.filter(n => n.id !== action.payload)
       if (state.selectedNodeId === action.payload) {
@@ -47,6 +66,6 @@ const nodesSlice = createSlice({
   },
 })
 
-export const { setNodes, addNode, updateNode, deleteNode, selectNode, moveNode } = nodesSlice.actions
+export const { setNodes, addNode, upsertNodes, updateNode, applyTextOp, deleteNode, selectNode, moveNode } = nodesSlice.actions
 export default nodesSlice.reducer
 
@@ -26,9 +26,45 @@ export type Session = {
   updated_at?: string
 }
 
+// Position in a session's change journal
+export type JournalPosition = {
+  epoch: string
+  seq: number
+}
+
 export type SessionState = {
   nodes: Node[]
   edges: Edge[]
+  journal?: JournalPosition | null
+  // Text revision of nodes being edited: their node_text_edited events up
+  // to it are already in the content
+  text_revisions?: Record<number, number>
+}
+
+export type SessionStateChunk = SessionState & {
+  seq: number
+  total_nodes: number
+  total_edges: number
+  done: boolean
+}
+
+// Changes missed while disconnected, sent instead of a state on resume
+export type SessionReplay = {
+  journal: JournalPosition
+  events: { seq: number; event: string; data: unknown }[]
+}
+
+export type NodeTextState = {
+  node_id: number
+  revision: number
+  content: string
+}
+
+export type NodeTextEdit = {
+  node_id: number
+  revision: number
+  op: (number | string)[]
+  origin: string | null
 }
 
 export type UserCursor = {